@@ -6,7 +6,9 @@ from sqlalchemy import pool
 from alembic import context
 
 from src.models.base import Base
+from src.models.blob import Blob
 from src.models.image import Image
+from src.models.job import Job
 from src.models.user import User
 
 from src.settings.database_settings import DatabaseSettings
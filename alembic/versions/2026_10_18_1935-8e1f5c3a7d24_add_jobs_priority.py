@@ -0,0 +1,30 @@
+"""Add jobs priority
+
+Revision ID: 8e1f5c3a7d24
+Revises: 4b7d2e9c1a3f
+Create Date: 2026-10-18 19:35:08.904512
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e1f5c3a7d24'
+down_revision: Union[str, None] = '4b7d2e9c1a3f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('jobs', sa.Column('priority', sa.Integer(), server_default='0', nullable=False))
+    op.create_index('ix_jobs_status_priority_created_at', 'jobs', ['status', 'priority', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_jobs_status_priority_created_at', table_name='jobs')
+    op.drop_column('jobs', 'priority')
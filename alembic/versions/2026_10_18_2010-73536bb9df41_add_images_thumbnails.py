@@ -0,0 +1,30 @@
+"""Add images thumbnails
+
+Revision ID: 73536bb9df41
+Revises: 8e1f5c3a7d24
+Create Date: 2026-10-18 20:10:27.516083
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '73536bb9df41'
+down_revision: Union[str, None] = '8e1f5c3a7d24'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('images', sa.Column('thumbnail_small_path', sa.String(), nullable=True))
+    op.add_column('images', sa.Column('thumbnail_medium_path', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('images', 'thumbnail_medium_path')
+    op.drop_column('images', 'thumbnail_small_path')
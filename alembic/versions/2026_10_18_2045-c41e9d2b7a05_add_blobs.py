@@ -0,0 +1,46 @@
+"""Add blobs
+
+Revision ID: c41e9d2b7a05
+Revises: 73536bb9df41
+Create Date: 2026-10-18 20:45:13.204771
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41e9d2b7a05'
+down_revision: Union[str, None] = '73536bb9df41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'blobs',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('hash', sa.String(length=64), nullable=False),
+        sa.Column('extension', sa.String(), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('ref_count', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('hash')
+    )
+    op.add_column('images', sa.Column('defected_hash', sa.String(length=64), nullable=True))
+    op.add_column('images', sa.Column('fixed_hash', sa.String(length=64), nullable=True))
+    op.add_column('images', sa.Column('masked_hash', sa.String(length=64), nullable=True))
+    op.add_column('images', sa.Column('segmented_hash', sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('images', 'segmented_hash')
+    op.drop_column('images', 'masked_hash')
+    op.drop_column('images', 'fixed_hash')
+    op.drop_column('images', 'defected_hash')
+    op.drop_table('blobs')
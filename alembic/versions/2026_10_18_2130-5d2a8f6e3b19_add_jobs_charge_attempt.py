@@ -0,0 +1,28 @@
+"""Add jobs charge attempt
+
+Revision ID: 5d2a8f6e3b19
+Revises: c41e9d2b7a05
+Create Date: 2026-10-18 21:30:42.517306
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d2a8f6e3b19'
+down_revision: Union[str, None] = 'c41e9d2b7a05'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('jobs', sa.Column('charge_attempt', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('jobs', 'charge_attempt')
@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import Optional
 
 from pydantic import BaseModel
 
@@ -11,6 +12,12 @@ class ImageAddDTO(BaseModel):
     fixed_path: str
     masked_path: str
     segmented_path: str
+    defected_hash: Optional[str] = None
+    fixed_hash: Optional[str] = None
+    masked_hash: Optional[str] = None
+    segmented_hash: Optional[str] = None
+    thumbnail_small_path: Optional[str] = None
+    thumbnail_medium_path: Optional[str] = None
 
 
 class ImageDTO(ImageAddDTO):
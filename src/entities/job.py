@@ -0,0 +1,33 @@
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class JobAddDTO(BaseModel):
+    user_id: int
+    filename: str
+    source_path: str
+    upload_folder: str
+    priority: int = 0
+    charge_attempt: bool = False
+    max_attempts: int = 3
+
+
+class JobDTO(JobAddDTO):
+    id: int
+    status: str
+    stage: Optional[str] = None
+    fixed_path: Optional[str] = None
+    masked_path: Optional[str] = None
+    segmented_path: Optional[str] = None
+    from_cache: bool = False
+    error: Optional[str] = None
+    attempts: int = 0
+    worker_id: Optional[str] = None
+    lease_expires_at: Optional[datetime] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,305 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+
+import cv2
+
+from src.ml_pipeline.model_cnn.test.test_segment import ImageSegmentation
+from src.ml_pipeline.model_gan.test.test_inpaint import Inpainter
+from src.ml_pipeline.model_manager import ModelManager
+from src.ml_pipeline.restoration_context import RestorationContext
+from src.settings.ml_settings import ml_settings
+from src.utils.logger import logger
+from src.utils.mask_codec import MASK_EXTENSION
+from src.utils.metrics import metrics
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--config', type=str, default="src/settings/models_config.json", help="Path to models config")
+parser.add_argument('--input', type=str, required=True, help="Folder with source images, processed recursively")
+parser.add_argument('--output', type=str, required=True, help="Folder for restored images, mirrors the input tree")
+parser.add_argument('--manifest', type=str, default="", help="JSONL manifest, defaults to <output>/manifest.jsonl")
+parser.add_argument('--decode-workers', type=int, default=max(1, (os.cpu_count() or 2) // 2))
+parser.add_argument('--write-workers', type=int, default=max(1, (os.cpu_count() or 2) // 2))
+parser.add_argument('--batch-size', type=int, default=ml_settings.batch_max_size, help="Images per model call")
+parser.add_argument('--queue-size', type=int, default=32, help="Capacity of every queue between stages")
+parser.add_argument('--save-masks', action='store_true', help="Also write lossless .msk defect masks to <output>/_masks")
+parser.add_argument('--retry-failed', action='store_true', help="Process again files that failed in previous runs")
+
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+MASKS_FOLDER = "_masks"
+STOP = object()
+
+
+class Stage:
+    """Пул потоков одного этапа: берет элементы из входной очереди и передает результат в выходную."""
+
+    def __init__(self, name: str, handler, workers: int, input_queue: queue.Queue, output_queue: queue.Queue = None,
+                 batch_size: int = 1, on_error=None):
+        self.name = name
+        self.handler = handler
+        self.on_error = on_error
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.batch_size = batch_size
+        self._running = workers
+        self._lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._work, name=f"{name}-{index}", daemon=True)
+                        for index in range(workers)]
+
+    def start(self) -> "Stage":
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def join(self) -> None:
+        for thread in self.threads:
+            thread.join()
+
+    def _collect(self) -> list:
+        # Батч собирается из того, что уже лежит в очереди: этап не ждет добора, пока работают соседние
+        batch = [self.input_queue.get()]
+        while batch[-1] is not STOP and len(batch) < self.batch_size:
+            try:
+                batch.append(self.input_queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _work(self) -> None:
+        while True:
+            batch = self._collect()
+            stop = batch[-1] is STOP
+            items = batch[:-1] if stop else batch
+            if items:
+                try:
+                    outputs = self.handler(items)
+                except Exception as e:
+                    # Поток не должен погибнуть без STOP: иначе следующие этапы и run() ждали бы вечно
+                    logger.error(f"Stage {self.name} failed on {len(items)} items: {e}")
+                    outputs = []
+                    if self.on_error is not None:
+                        self.on_error(items, e)
+                for output in outputs:
+                    if self.output_queue is not None:
+                        self.output_queue.put(output)
+            if stop:
+                # Соседние потоки этапа тоже должны увидеть конец потока, следующий этап - только от последнего
+                self.input_queue.put(STOP)
+                with self._lock:
+                    self._running -= 1
+                    last = self._running == 0
+                if last and self.output_queue is not None:
+                    self.output_queue.put(STOP)
+                return
+
+
+class BatchRestorer:
+    """Офлайн-обработка дерева каталогов: decode -> segment -> inpaint -> write с отдельным пулом на каждый этап."""
+
+    def __init__(self, model_manager: ModelManager, input_dir: str, output_dir: str, manifest_path: str = "",
+                 batch_size: int = 8, queue_size: int = 32, save_masks: bool = False):
+        self.model_manager = model_manager
+        self.input_dir = os.path.abspath(input_dir)
+        self.output_dir = os.path.abspath(output_dir)
+        self.manifest_path = manifest_path or os.path.join(self.output_dir, "manifest.jsonl")
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.save_masks = save_masks
+        if self.output_dir == self.input_dir:
+            raise ValueError("Результаты нельзя записывать поверх исходных изображений")
+        self.cnn_model = None
+        self.gan_model = None
+        self.model_versions = None
+        self.counts = {"done": 0, "no_defects": 0, "failed": 0}
+        self._manifest = None
+        self._manifest_lock = threading.Lock()
+
+    def load_manifest(self, retry_failed: bool = False) -> set:
+        processed = set()
+        if not os.path.exists(self.manifest_path):
+            return processed
+        with open(self.manifest_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Последняя строка могла оборваться при аварийной остановке - файл просто обработается заново
+                    continue
+                if record["status"] == "failed" and retry_failed:
+                    processed.discard(record["path"])
+                else:
+                    processed.add(record["path"])
+        return processed
+
+    def _manifest_ends_with_newline(self) -> bool:
+        with open(self.manifest_path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            if not f.tell():
+                return True
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def scan(self, processed: set):
+        # Дерево обходится лениво: в памяти только очередь ближайших файлов, а не список всего каталога
+        for root, dirs, filenames in os.walk(self.input_dir):
+            dirs.sort()
+            if os.path.commonpath([root, self.output_dir]) == self.output_dir:
+                dirs.clear()
+                continue
+            for filename in sorted(filenames):
+                if not filename.lower().endswith(IMG_EXTENSIONS):
+                    continue
+                path = os.path.relpath(os.path.join(root, filename), self.input_dir).replace(os.sep, "/")
+                if path not in processed:
+                    yield path
+
+    def _record(self, path: str, status: str, started_at: float, error: str = None) -> None:
+        record = {
+            "path": path,
+            "status": status,
+            "seconds": round(time.perf_counter() - started_at, 3),
+            "models": self.model_versions,
+            "finished_at": time.strftime("%Y-%m-%d %H:%M:%S")
+        }
+        if error:
+            record["error"] = error
+        with self._manifest_lock:
+            # Строка пишется после того, как файл результата уже на месте: запись в манифесте означает готовый файл
+            self._manifest.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._manifest.flush()
+            self.counts[status] += 1
+            total = sum(self.counts.values())
+        if total % 100 == 0:
+            logger.info(f"Restored {total} images: {self.counts}")
+
+    def _fail(self, items: list, error: Exception) -> None:
+        # Элемент любого этапа начинается с (путь, время начала)
+        for path, started_at, *_ in items:
+            self._record(path, "failed", started_at, str(error))
+
+    def _decode(self, items: list) -> list:
+        outputs = []
+        for path, started_at in items:
+            try:
+                with metrics.timer("decode"), open(os.path.join(self.input_dir, path), "rb") as f:
+                    outputs.append((path, started_at, RestorationContext.from_bytes(path, f.read())))
+            except Exception as e:
+                logger.error(f"Failed to decode {path}: {e}")
+                self._record(path, "failed", started_at, str(e))
+        return outputs
+
+    def _segment(self, items: list) -> list:
+        try:
+            outputs = ImageSegmentation(model=self.cnn_model).segment_arrays([context.image for _, _, context in items])
+        except Exception as e:
+            logger.error(f"Segmentation of {len(items)} images failed: {e}")
+            for path, started_at, _ in items:
+                self._record(path, "failed", started_at, str(e))
+            return []
+
+        segmented = []
+        for (path, started_at, context), mask in zip(items, outputs):
+            if mask is None:
+                self._record(path, "no_defects", started_at)
+                continue
+            context.mask = mask
+            segmented.append((path, started_at, context))
+        return segmented
+
+    def _inpaint(self, items: list) -> list:
+        try:
+            inpainted = Inpainter.inpaint_batch(
+                generator=self.gan_model,
+                images=[context.image for _, _, context in items],
+                masks=[context.mask for _, _, context in items],
+                max_batch_size=self.batch_size,
+                **ml_settings.inpaint_options
+            )
+        except Exception as e:
+            logger.error(f"Inpainting of {len(items)} images failed: {e}")
+            for path, started_at, _ in items:
+                self._record(path, "failed", started_at, str(e))
+            return []
+
+        for (_, _, context), result in zip(items, inpainted):
+            context.result = result
+            context.compact()
+        return items
+
+    def _write(self, items: list) -> list:
+        for path, started_at, context in items:
+            try:
+                self._write_image(os.path.join(self.output_dir, path), cv2.cvtColor(context.result, cv2.COLOR_RGB2BGR))
+                if self.save_masks:
+                    mask_path = os.path.join(self.output_dir, MASKS_FOLDER, os.path.splitext(path)[0] + MASK_EXTENSION)
+                    self._write_file(mask_path, context.mask_bytes())
+                self._record(path, "done", started_at)
+            except Exception as e:
+                logger.error(f"Failed to write {path}: {e}")
+                self._record(path, "failed", started_at, str(e))
+        return []
+
+    @classmethod
+    def _write_image(cls, path: str, image) -> None:
+        with metrics.timer("encode"):
+            _, buffer = cv2.imencode(os.path.splitext(path)[1], image)
+        cls._write_file(path, buffer.tobytes())
+
+    @staticmethod
+    def _write_file(path: str, data: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with metrics.timer("disk_write"), open(tmp_path, "wb") as f:
+            f.write(data)
+        # Файл появляется под своим именем только целиком: прерванный запуск не оставит битых результатов
+        os.replace(tmp_path, path)
+
+    def run(self, decode_workers: int, write_workers: int, retry_failed: bool = False) -> dict:
+        processed = self.load_manifest(retry_failed)
+        if processed:
+            logger.info(f"Resuming: {len(processed)} images are already in {self.manifest_path}")
+
+        self.cnn_model, cnn_version = self.model_manager.acquire('cnn')
+        self.gan_model, gan_version = self.model_manager.acquire(ml_settings.gan_model_name)
+        self.model_versions = [cnn_version, gan_version]
+
+        paths, decoded, segmented, inpainted = (queue.Queue(maxsize=self.queue_size) for _ in range(4))
+        stages = [
+            Stage("decode", self._decode, decode_workers, paths, decoded, on_error=self._fail),
+            # Модели заняты по одному потоку на этап: segment следующего батча идет параллельно с inpaint текущего
+            Stage("segment", self._segment, 1, decoded, segmented, batch_size=self.batch_size, on_error=self._fail),
+            Stage("inpaint", self._inpaint, 1, segmented, inpainted, batch_size=self.batch_size, on_error=self._fail),
+            Stage("write", self._write, write_workers, inpainted, on_error=self._fail)
+        ]
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.manifest_path)), exist_ok=True)
+        start_time = time.perf_counter()
+        with open(self.manifest_path, "a", encoding="utf-8") as self._manifest:
+            if not self._manifest_ends_with_newline():
+                # Оборванная строка прошлого запуска не должна склеиться с первой новой записью
+                self._manifest.write("\n")
+            for stage in stages:
+                stage.start()
+            for path in self.scan(processed):
+                # Ограниченная очередь тормозит обход каталога, если этапы не успевают
+                paths.put((path, time.perf_counter()))
+            paths.put(STOP)
+            for stage in stages:
+                stage.join()
+
+        elapsed = time.perf_counter() - start_time
+        total = sum(self.counts.values())
+        return {**self.counts, "elapsed_s": elapsed, "images_per_sec": total / elapsed if elapsed else 0.0}
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    model_manager = ModelManager(args.config, ml_settings=ml_settings)
+    restorer = BatchRestorer(model_manager, args.input, args.output, args.manifest, batch_size=args.batch_size,
+                             queue_size=args.queue_size, save_masks=args.save_masks)
+    summary = restorer.run(args.decode_workers, args.write_workers, args.retry_failed)
+    print(f"done={summary['done']} no_defects={summary['no_defects']} failed={summary['failed']} "
+          f"in {summary['elapsed_s']:.1f}s ({summary['images_per_sec']:.2f} img/s)")
@@ -0,0 +1,231 @@
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import psutil
+from PIL import Image
+
+from src.ml_pipeline.inference_scheduler import InferenceScheduler
+from src.ml_pipeline.model_manager import ModelHandle, ModelManager
+from src.ml_pipeline.restoration_context import RestorationContext
+from src.settings.ml_settings import ml_settings
+from src.utils.metrics import metrics
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--config', type=str, default="src/settings/models_config.json", help="Path to models config")
+parser.add_argument('--data', type=str, nargs='+', default=["EXAMPLES"], help="Folders with source images")
+parser.add_argument('--resolutions', type=str, default="512,1024,0", help="Longest side buckets, 0 keeps the original size")
+parser.add_argument('--concurrency', type=str, default="1,4,8", help="Numbers of simultaneous requests")
+parser.add_argument('--repeats', type=int, default=1, help="How many times every image is processed per run")
+parser.add_argument('--warmup', type=int, default=2, help="Untimed requests before every run")
+parser.add_argument('--output-dir', type=str, default="benchmark_results", help="Folder for JSON/CSV reports")
+parser.add_argument('--baseline', type=str, default="", help="Previous JSON report to compare against")
+parser.add_argument('--tolerance', type=float, default=0.1, help="Allowed relative regression vs baseline")
+
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+ARTIFACT_MARKERS = ('_f_', '_m_', '_s_')
+STAGE_METRICS = ("decode", "queue_wait", "yolo_forward", "mask_union", "classical_inpaint", "generator_forward", "encode",
+                 "disk_write")
+QUANTILES = (50, 95, 99)
+
+
+class PeakRssSampler:
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.peak = self.process.memory_info().rss
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.process.memory_info().rss)
+
+
+class PipelineBenchmark:
+    """Прогоняет полный путь decode -> segment -> inpaint -> persist по корпусу изображений."""
+
+    def __init__(self, scheduler: InferenceScheduler, data_dirs: list, output_dir: str):
+        self.scheduler = scheduler
+        self.output_dir = output_dir
+        self.images = self._load_images(data_dirs)
+        if not self.images:
+            raise FileNotFoundError(f"В папках {data_dirs} не найдено исходных изображений")
+
+    def _load_images(self, data_dirs: list) -> list:
+        images = []
+        for data_dir in data_dirs:
+            for root, _, filenames in sorted(os.walk(data_dir)):
+                for filename in sorted(filenames):
+                    if filename.lower().endswith(IMG_EXTENSIONS) and not any(m in filename for m in ARTIFACT_MARKERS):
+                        with Image.open(os.path.join(root, filename)) as image:
+                            images.append((filename, image.convert("RGB")))
+        return images
+
+    def _encode_bucket(self, resolution: int) -> list:
+        # Запросы кодируются заранее, чтобы в замер попадало только декодирование на стороне сервиса
+        encoded = []
+        for filename, image in self.images:
+            if resolution:
+                scale = resolution / max(image.size)
+                image = image.resize((round(image.width * scale), round(image.height * scale)), Image.BICUBIC)
+            buffer = io.BytesIO()
+            image.save(buffer, format="JPEG", quality=95)
+            encoded.append((os.path.splitext(filename)[0] + ".jpg", buffer.getvalue()))
+        return encoded
+
+    def _process(self, filename: str, image_bytes: bytes, upload_folder: str) -> float:
+        start_time = time.perf_counter()
+        with metrics.timer("decode"):
+            context = RestorationContext.from_bytes(filename, image_bytes)
+        context = self.scheduler.process(context)
+        context.persist(upload_folder)
+        return time.perf_counter() - start_time
+
+    def _process_safe(self, filename: str, image_bytes: bytes, upload_folder: str):
+        try:
+            return self._process(filename, image_bytes, upload_folder)
+        except ValueError:
+            # На изображении не нашлось дефектов - в пропускной способности такой запрос не учитываем
+            return None
+
+    def run(self, resolution: int, concurrency: int, repeats: int = 1, warmup: int = 2) -> dict:
+        requests = self._encode_bucket(resolution) * repeats
+        with tempfile.TemporaryDirectory() as upload_folder:
+            for filename, image_bytes in requests[:warmup]:
+                self._process_safe(filename, image_bytes, upload_folder)
+
+            metrics.reset()
+            with PeakRssSampler() as rss, ThreadPoolExecutor(max_workers=concurrency) as executor:
+                start_time = time.perf_counter()
+                latencies = list(executor.map(lambda request: self._process_safe(*request, upload_folder), requests))
+                elapsed = time.perf_counter() - start_time
+
+        latencies = [latency for latency in latencies if latency is not None]
+        snapshot = metrics.snapshot()["histograms"]
+        result = {
+            "resolution": resolution,
+            "concurrency": concurrency,
+            "images": len(latencies),
+            "skipped": len(requests) - len(latencies),
+            "elapsed_s": elapsed,
+            "images_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+            "peak_rss_mb": rss.peak / (1024 * 1024),
+            "latency": self._percentiles(latencies),
+            "stages": {stage: snapshot[f"{stage}_seconds"] for stage in STAGE_METRICS if f"{stage}_seconds" in snapshot}
+        }
+        return result
+
+    @staticmethod
+    def _percentiles(values: list) -> dict:
+        if not values:
+            return {}
+        return {f"p{q}": float(v) for q, v in zip(QUANTILES, np.percentile(values, QUANTILES))}
+
+    def save(self, report: dict) -> tuple:
+        os.makedirs(self.output_dir, exist_ok=True)
+        name = time.strftime("benchmark_%Y%m%d%H%M%S")
+        json_path = os.path.join(self.output_dir, f"{name}.json")
+        csv_path = os.path.join(self.output_dir, f"{name}.csv")
+
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+
+        rows = [self._flatten(run) for run in report["runs"]]
+        columns = list(dict.fromkeys(column for row in rows for column in row))
+        with open(csv_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+        return json_path, csv_path
+
+    @staticmethod
+    def _flatten(run: dict) -> dict:
+        row = {key: value for key, value in run.items() if not isinstance(value, dict)}
+        row.update({f"latency_{q}": value for q, value in run["latency"].items()})
+        for stage, summary in run["stages"].items():
+            row.update({f"{stage}_{q}": value for q, value in summary.items() if q.startswith("p")})
+        return row
+
+    @staticmethod
+    def compare(report: dict, baseline: dict, tolerance: float) -> list:
+        baseline_runs = {(run["resolution"], run["concurrency"]): run for run in baseline["runs"]}
+        comparison = []
+        for run in report["runs"]:
+            reference = baseline_runs.get((run["resolution"], run["concurrency"]))
+            # Прогон без обработанных изображений (в нем или в базовом отчете) сравнивать не с чем
+            if reference is None or not reference["images_per_sec"] or not run["latency"] or not reference["latency"]:
+                continue
+
+            throughput_ratio = run["images_per_sec"] / reference["images_per_sec"]
+            latency_ratio = run["latency"]["p95"] / reference["latency"]["p95"]
+            comparison.append({
+                "resolution": run["resolution"],
+                "concurrency": run["concurrency"],
+                "throughput_ratio": throughput_ratio,
+                "latency_p95_ratio": latency_ratio,
+                "peak_rss_ratio": run["peak_rss_mb"] / reference["peak_rss_mb"],
+                "regression": throughput_ratio < 1 - tolerance or latency_ratio > 1 + tolerance
+            })
+        return comparison
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    model_manager = ModelManager(args.config, ml_settings=ml_settings)
+    scheduler = InferenceScheduler(
+        cnn_model=ModelHandle(model_manager, 'cnn'),
+        gan_model=ModelHandle(model_manager, ml_settings.gan_model_name),
+        max_batch_size=ml_settings.batch_max_size,
+        max_wait_ms=ml_settings.batch_max_wait_ms,
+        inpaint_options=ml_settings.inpaint_options
+    )
+    benchmark = PipelineBenchmark(scheduler, args.data, args.output_dir)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "models": [model_manager.get_model_version('cnn'), model_manager.get_model_version(ml_settings.gan_model_name)],
+        "inpaint_mode": ml_settings.inpaint_mode,
+        "runs": []
+    }
+    for resolution in [int(value) for value in args.resolutions.split(',')]:
+        for concurrency in [int(value) for value in args.concurrency.split(',')]:
+            run = benchmark.run(resolution, concurrency, args.repeats, args.warmup)
+            print(f"resolution={resolution or 'original'} concurrency={concurrency}: "
+                  f"{run['images_per_sec']:.2f} img/s, p95={run['latency'].get('p95', 0):.3f}s, "
+                  f"peak RSS={run['peak_rss_mb']:.0f} MB")
+            report["runs"].append(run)
+
+    has_regression = False
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["baseline"] = {"path": args.baseline,
+                                  "comparison": benchmark.compare(report, json.load(f), args.tolerance)}
+        for item in report["baseline"]["comparison"]:
+            status = "REGRESSION" if item["regression"] else "ok"
+            print(f"[{status}] resolution={item['resolution'] or 'original'} concurrency={item['concurrency']}: "
+                  f"throughput x{item['throughput_ratio']:.2f}, p95 latency x{item['latency_p95_ratio']:.2f}")
+            has_regression = has_regression or item["regression"]
+
+    json_path, csv_path = benchmark.save(report)
+    print(f"Reports saved to {json_path} and {csv_path}")
+    sys.exit(1 if has_regression else 0)
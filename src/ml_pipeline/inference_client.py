@@ -0,0 +1,101 @@
+import queue
+from multiprocessing.connection import Client
+from typing import Callable, Optional, Union
+
+from src.ml_pipeline.priorities import PRIORITY_PAID, AdmissionError
+from src.ml_pipeline.restoration_context import RestorationContext
+
+UNIX_PREFIX = "unix:"
+
+
+def parse_address(address: str) -> Union[str, tuple]:
+    # unix:/run/flawless/inference.sock - Unix-сокет, host:port - TCP
+    if address.startswith(UNIX_PREFIX):
+        return address[len(UNIX_PREFIX):]
+    host, _, port = address.rpartition(':')
+    return host or "127.0.0.1", int(port)
+
+
+class InferenceClient:
+    """Клиент сервера инференса с тем же интерфейсом, что и у InferenceScheduler."""
+
+    def __init__(self, address: str, authkey: bytes, max_idle_connections: int = 8, timeout: float = 300.0):
+        if not authkey:
+            raise ValueError("Не задан INFERENCE_SERVER_AUTHKEY: подключение к серверу инференса требует ключа")
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=max_idle_connections)
+
+    def _connect(self):
+        try:
+            return Client(self.address, authkey=self.authkey)
+        except OSError as e:
+            raise ConnectionError(f"Сервер инференса {self.address} недоступен: {str(e)}")
+
+    def _release(self, connection) -> None:
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def _call(self, request: dict, progress: Callable[[str], None] = None):
+        for attempt in range(2):
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                connection = self._connect()
+
+            try:
+                connection.send(request)
+                message = self._receive(connection, progress)
+            except (EOFError, OSError) as e:
+                # Соединение из пула могло закрыться после перезапуска сервера - повторяем один раз на новом
+                connection.close()
+                if attempt:
+                    raise ConnectionError(f"Сервер инференса {self.address} разорвал соединение: {str(e)}")
+                continue
+
+            if message is None:
+                # Зависший сервер не должен вечно держать поток задачи. Запрос не повторяется: он мог уже
+                # выполняться, а ответ на него пришел бы в чужой вызов, поэтому соединение закрывается
+                connection.close()
+                raise ConnectionError(f"Сервер инференса {self.address} не ответил за {self.timeout} с")
+
+            self._release(connection)
+            if "error" in message:
+                error_types = {"ValueError": ValueError, "AdmissionError": AdmissionError}
+                raise error_types.get(message["error_type"], RuntimeError)(message["error"])
+            return message["result"]
+
+    def _receive(self, connection, progress: Callable[[str], None] = None) -> Optional[dict]:
+        # Тайм-аут считается от последнего сообщения: этапы обработки приходят по мере выполнения
+        while connection.poll(self.timeout):
+            message = connection.recv()
+            if "stage" not in message:
+                return message
+            if progress is not None:
+                progress(message["stage"])
+        return None
+
+    def process(self, context: RestorationContext, progress: Callable[[str], None] = None,
+                user_id: Optional[int] = None, priority: int = PRIORITY_PAID) -> RestorationContext:
+        payload = self._call({"op": "process", "filename": context.filename, "image": context.image,
+                              "user_id": user_id, "priority": priority}, progress)
+        context.load_result_payload(payload)
+        return context
+
+    def check_admission(self, user_id: Optional[int] = None, priority: int = PRIORITY_PAID) -> None:
+        self._call({"op": "check_admission", "user_id": user_id, "priority": priority})
+
+    def get_model_versions(self) -> list:
+        return self._call({"op": "versions"})
+
+    def is_ready(self) -> bool:
+        try:
+            return self._call({"op": "ready"})
+        except ConnectionError:
+            return False
+
+    def set_active_version(self, model_name: str, version: str) -> str:
+        return self._call({"op": "set_active_version", "model_name": model_name, "version": version})
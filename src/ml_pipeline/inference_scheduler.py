@@ -0,0 +1,200 @@
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from src.ml_pipeline.model_cnn.test.test_segment import ImageSegmentation
+from src.ml_pipeline.model_gan.test.test_inpaint import Inpainter
+from src.ml_pipeline.model_manager import ModelHandle
+from src.ml_pipeline.priorities import PRIORITY_FREE, PRIORITY_NAMES, PRIORITY_PAID, AdmissionError
+from src.ml_pipeline.restoration_context import RestorationContext
+from src.utils.logger import logger
+from src.utils.metrics import metrics
+
+
+@dataclass
+class InferenceRequest:
+    context: RestorationContext
+    progress: Optional[Callable[[str], None]] = None
+    future: Future = field(default_factory=Future)
+    user_id: Optional[int] = None
+    priority: int = PRIORITY_PAID
+    submitted_at: float = field(default_factory=time.perf_counter)
+
+    def report(self, stage: str):
+        if self.progress is None:
+            return
+        try:
+            self.progress(stage)
+        except Exception as e:
+            # Обработчик прогресса выполняется в потоке батча: его ошибка не должна провалить чужие запросы
+            logger.warning(f"Progress callback for stage {stage} failed: {e}")
+
+
+class InferenceScheduler:
+    """Собирает запросы всех сессий в микробатчи и прогоняет их через cnn и gan модели одним проходом."""
+
+    def __init__(self, cnn_model, gan_model, max_batch_size: int = 8, max_wait_ms: float = 10.0,
+                 inpaint_options: dict = None, max_queue_size: int = 0, free_queue_share: float = 1.0,
+                 max_inflight_per_user: int = 0):
+        self.cnn_model = cnn_model
+        self.gan_model = gan_model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.inpaint_options = inpaint_options or {}
+
+        self.max_queue_size = max_queue_size
+        self.free_queue_limit = int(max_queue_size * free_queue_share)
+        self.max_inflight_per_user = max_inflight_per_user
+
+        # Подписчики всегда впереди бесплатных запросов, внутри класса - порядок поступления
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._worker = None
+
+        self._admission_lock = threading.Lock()
+        self._pending = 0
+        self._inflight = {}
+
+    def start(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="inference-scheduler", daemon=True)
+                self._worker.start()
+
+    def _check_admission(self, user_id: Optional[int], priority: int) -> None:
+        error = None
+        if self.max_queue_size and self._pending >= self.max_queue_size:
+            error = "Сервис перегружен, попробуйте позже"
+        elif self.max_queue_size and priority != PRIORITY_PAID and self._pending >= self.free_queue_limit:
+            # Бесплатные запросы отсекаются раньше: оставшиеся места в очереди резервируются за подписчиками
+            error = ("Сервис сейчас загружен, бесплатная обработка временно недоступна. "
+                     "Попробуйте через несколько минут или оформите подписку")
+        elif user_id is not None and self.max_inflight_per_user and \
+                self._inflight.get(user_id, 0) >= self.max_inflight_per_user:
+            error = "Дождитесь завершения предыдущих обработок"
+
+        if error is not None:
+            metrics.increment(f"admission_rejected_{PRIORITY_NAMES[priority]}_total")
+            raise AdmissionError(error)
+
+    def check_admission(self, user_id: Optional[int] = None, priority: int = PRIORITY_PAID) -> None:
+        with self._admission_lock:
+            self._check_admission(user_id, priority)
+
+    def _release(self, request: InferenceRequest) -> None:
+        with self._admission_lock:
+            self._pending -= 1
+            if request.user_id is not None:
+                self._inflight[request.user_id] -= 1
+                if not self._inflight[request.user_id]:
+                    del self._inflight[request.user_id]
+
+    def submit(self, context: RestorationContext, progress: Callable[[str], None] = None,
+               user_id: Optional[int] = None, priority: int = PRIORITY_PAID) -> Future:
+        self.start()
+        request = InferenceRequest(context=context, progress=progress, user_id=user_id, priority=priority)
+        with self._admission_lock:
+            self._check_admission(user_id, priority)
+            self._pending += 1
+            if user_id is not None:
+                self._inflight[user_id] = self._inflight.get(user_id, 0) + 1
+        request.future.add_done_callback(lambda _: self._release(request))
+        self._queue.put((priority, next(self._sequence), request))
+        return request.future
+
+    def process(self, context: RestorationContext, progress: Callable[[str], None] = None,
+                user_id: Optional[int] = None, priority: int = PRIORITY_PAID) -> RestorationContext:
+        return self.submit(context, progress, user_id, priority).result()
+
+    def _handles(self) -> list:
+        return [model for model in (self.cnn_model, self.gan_model) if isinstance(model, ModelHandle)]
+
+    def get_model_versions(self) -> list:
+        return [handle.model_manager.get_model_version(handle.model_name) for handle in self._handles()]
+
+    def is_ready(self) -> bool:
+        return all(handle.model_manager.is_ready() for handle in self._handles())
+
+    def set_active_version(self, model_name: str, version: str) -> str:
+        for handle in self._handles():
+            if handle.model_name == model_name:
+                return handle.model_manager.set_active_version(model_name, version)
+        raise ValueError(f"Модель '{model_name}' не используется планировщиком")
+
+    def _collect_batch(self) -> list:
+        batch = [self._queue.get()[2]]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout)[2])
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            try:
+                self._process_batch(batch)
+            except Exception as e:
+                logger.error(f"Inference batch of {len(batch)} images failed: {e}")
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+    def _resolve(self, model):
+        # ModelHandle отдает активную версию на момент начала батча, весь батч выполняется на ней
+        if isinstance(model, ModelHandle):
+            return model.acquire()
+        return model, None
+
+    def _process_batch(self, batch: list):
+        start_time = time.time()
+        cnn_model, cnn_version = self._resolve(self.cnn_model)
+        gan_model, gan_version = self._resolve(self.gan_model)
+        metrics.observe("batch_size", len(batch))
+
+        for request in batch:
+            queue_wait = time.perf_counter() - request.submitted_at
+            metrics.observe("queue_wait_seconds", queue_wait)
+            metrics.observe(f"queue_wait_{PRIORITY_NAMES[request.priority]}_seconds", queue_wait)
+            request.report("segment")
+
+        segmentation = ImageSegmentation(model=cnn_model)
+        outputs = segmentation.segment_arrays([request.context.image for request in batch])
+
+        segmented = []
+        for request, mask in zip(batch, outputs):
+            if mask is None:
+                request.future.set_exception(ValueError("Маски не обнаружены"))
+            else:
+                request.report("mask")
+                request.context.mask = mask
+                segmented.append(request)
+
+        if segmented:
+            for request in segmented:
+                request.report("inpaint")
+            inpainted = Inpainter.inpaint_batch(
+                generator=gan_model,
+                images=[request.context.image for request in segmented],
+                masks=[request.context.mask for request in segmented],
+                max_batch_size=self.max_batch_size,
+                **self.inpaint_options
+            )
+            for request, inpainted_image in zip(segmented, inpainted):
+                request.context.result = inpainted_image
+                if cnn_version is not None and gan_version is not None:
+                    request.context.model_versions = [cnn_version, gan_version]
+                request.context.compact()
+                request.future.set_result(request.context)
+
+        logger.debug(f"Inference batch of {len(batch)} images processed in {time.time() - start_time:.3f}s")
@@ -0,0 +1,146 @@
+import argparse
+import multiprocessing
+import os
+import queue
+import threading
+from multiprocessing.connection import Listener
+
+from src.ml_pipeline.inference_client import parse_address
+from src.ml_pipeline.inference_scheduler import PRIORITY_PAID, InferenceScheduler
+from src.ml_pipeline.model_manager import ModelHandle, ModelManager
+from src.ml_pipeline.restoration_context import RestorationContext
+from src.settings.metrics_settings import metrics_settings
+from src.settings.ml_settings import ml_settings
+from src.utils.logger import logger
+from src.utils.metrics import metrics
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--config', type=str, default="src/settings/models_config.json", help="Path to models config")
+parser.add_argument('--address', type=str, default=ml_settings.inference_server_address or "127.0.0.1:8765",
+                    help="'host:port' or 'unix:/path/to/socket'")
+parser.add_argument('--workers', type=int, default=ml_settings.inference_server_workers, help="Number of worker processes")
+
+
+class InferenceServer:
+    """Процесс, владеющий моделями: UI-процессы Streamlit отправляют ему изображения через InferenceClient."""
+
+    def __init__(self, config_path: str, address: str, authkey: bytes, workers: int = 1):
+        if not authkey:
+            # Listener распаковывает pickle от любого подключившегося процесса - без ключа это исполнение чужого кода
+            raise ValueError("Не задан INFERENCE_SERVER_AUTHKEY: сервер инференса не запускается без ключа")
+        self.config_path = config_path
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self.workers = workers
+
+    def serve(self) -> None:
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+        listener = Listener(self.address, authkey=self.authkey)
+        logger.info(f"Inference server listening on {self.address} with {self.workers} workers")
+
+        if self.workers <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+            self._run_worker(listener, 0, 1)
+            return
+
+        # Воркеры наследуют слушающий сокет и принимают соединения сами. Модели загружаются уже после fork:
+        # потоки torch не переживают fork, а веса генератора все равно общие через mmap
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=self._run_worker, args=(listener, index, self.workers), daemon=True)
+                     for index in range(self.workers)]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        finally:
+            for process in processes:
+                process.terminate()
+            listener.close()
+
+    def _worker_limit(self, limit: int, workers: int) -> int:
+        # 0 означает отсутствие лимита
+        return -(-limit // workers) if limit else 0
+
+    def _run_worker(self, listener: Listener, index: int, workers: int) -> None:
+        # У каждого воркера свой планировщик, а соединения между воркерами распределяет ядро. Лимиты очереди
+        # делятся между воркерами, чтобы сервер в целом принимал не больше настроенного. Лимит на пользователя
+        # после деления приблизительный: запросы одного пользователя могут попасть в разные воркеры
+        model_manager = ModelManager(self.config_path, ml_settings=ml_settings,
+                                     memory_budget_bytes=ml_settings.model_memory_budget_mb * 1024 * 1024)
+        scheduler = InferenceScheduler(
+            cnn_model=ModelHandle(model_manager, 'cnn'),
+            gan_model=ModelHandle(model_manager, ml_settings.gan_model_name),
+            max_batch_size=ml_settings.batch_max_size,
+            max_wait_ms=ml_settings.batch_max_wait_ms,
+            inpaint_options=ml_settings.inpaint_options,
+            max_queue_size=self._worker_limit(ml_settings.scheduler_max_queue_size, workers),
+            free_queue_share=ml_settings.scheduler_free_queue_share,
+            max_inflight_per_user=self._worker_limit(ml_settings.scheduler_max_inflight_per_user, workers)
+        )
+        if ml_settings.model_preload:
+            threading.Thread(target=model_manager.preload, args=(['cnn', ml_settings.gan_model_name],),
+                             name="model-preload", daemon=True).start()
+        else:
+            model_manager.ready.set()
+        if metrics_settings.metrics_port:
+            metrics.set_readiness_check(model_manager.is_ready)
+            metrics.start_http_server(metrics_settings.metrics_host, metrics_settings.metrics_port + index)
+
+        while True:
+            try:
+                connection = listener.accept()
+            except (OSError, multiprocessing.AuthenticationError) as e:
+                logger.warning(f"Inference worker {index} rejected a connection: {e}")
+                continue
+            threading.Thread(target=self._serve_connection, args=(connection, scheduler, model_manager),
+                             daemon=True).start()
+
+    def _serve_connection(self, connection, scheduler: InferenceScheduler, model_manager: ModelManager) -> None:
+        with connection:
+            while True:
+                try:
+                    request = connection.recv()
+                except (EOFError, OSError):
+                    return
+
+                try:
+                    response = {"result": self._handle(request, connection, scheduler, model_manager)}
+                except (EOFError, OSError):
+                    # Клиент отключился, пока шла обработка
+                    return
+                except Exception as e:
+                    response = {"error": str(e), "error_type": type(e).__name__}
+                try:
+                    connection.send(response)
+                except (EOFError, OSError):
+                    return
+
+    def _handle(self, request: dict, connection, scheduler: InferenceScheduler, model_manager: ModelManager):
+        op = request.get("op")
+        if op == "process":
+            context = RestorationContext(filename=request["filename"], source_bytes=b"", image=request["image"])
+            # Этапы отправляет поток соединения: медленный или отключившийся клиент не задерживает батч
+            stages = queue.Queue()
+            future = scheduler.submit(context, progress=stages.put, user_id=request.get("user_id"),
+                                      priority=request.get("priority", PRIORITY_PAID))
+            future.add_done_callback(lambda _: stages.put(None))
+            for stage in iter(stages.get, None):
+                connection.send({"stage": stage})
+            return future.result().result_payload()
+        if op == "check_admission":
+            return scheduler.check_admission(request.get("user_id"), request.get("priority", PRIORITY_PAID))
+        if op == "versions":
+            return scheduler.get_model_versions()
+        if op == "ready":
+            return scheduler.is_ready()
+        if op == "set_active_version":
+            previous = scheduler.set_active_version(request["model_name"], request["version"])
+            model_manager.write_active_version(request["model_name"], request["version"])
+            return previous
+        raise ValueError(f"Неизвестная операция '{op}'")
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    InferenceServer(args.config, args.address, ml_settings.inference_server_authkey.encode(), args.workers).serve()
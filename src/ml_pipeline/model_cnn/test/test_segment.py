@@ -1,47 +1,59 @@
 import os
 import cv2
 import numpy as np
+import torch
+import torch.nn.functional as F
 from PIL import Image
-from ultralytics import YOLO
+
+from src.ml_pipeline.restoration_context import render_overlay
+from src.utils.metrics import metrics
 
 
 class ImageSegmentation:
-    def __init__(self, model, save_segment_dir: str, save_mask_dir: str):
+    def __init__(self, model, save_segment_dir: str = None, save_mask_dir: str = None):
         self.model = model
         self.save_segment_dir = save_segment_dir
         self.save_mask_dir = save_mask_dir
-        os.makedirs(self.save_mask_dir, exist_ok=True)
-        os.makedirs(self.save_segment_dir, exist_ok=True)
-
-    def segment_image(self, image: np.array, save_filename: str):
-        # Преобразуем изображение в формате BGR (если это нужно) для YOLO
-        results = self.model(image, task="segment")
+        for directory in (self.save_mask_dir, self.save_segment_dir):
+            if directory is not None:
+                os.makedirs(directory, exist_ok=True)
 
-        # Сохранение масок, если они есть
-        if results[0].masks is not None:
-            segment_image = results[0].plot()
-            segment_path = os.path.join(self.save_segment_dir, save_filename)
-            cv2.imwrite(segment_path, cv2.cvtColor(segment_image, cv2.COLOR_RGB2BGR))
+    def segment_arrays(self, images: list) -> list:
+        # Ничего не пишет на диск: маска остается torch-тензором для передачи генератору без копий
+        with metrics.timer("yolo_forward"):
+            results = self.model(images, task="segment")
+        with metrics.timer("mask_union"):
+            # Results с масками всех объектов и копией исходника освобождаются сразу, остается одна bool-маска
+            return [self.build_mask(result) for result in results]
 
-            masks = results[0].masks.data.cpu().numpy()  # [N, H, W]
-            orig_shape = results[0].orig_shape
+    def build_mask(self, result):
+        if result.masks is None:
+            return None
 
-            combined_mask = np.any(masks, axis=0).astype(np.uint8) * 255
+        combined_mask = result.masks.data.any(dim=0)  # [H, W], bool
+        orig_shape = tuple(result.orig_shape)
+        if tuple(combined_mask.shape) != orig_shape:
+            combined_mask = F.interpolate(
+                combined_mask[None, None].to(torch.uint8),
+                size=orig_shape,
+                mode="nearest"
+            )[0, 0].bool()
+        return combined_mask.cpu()
 
-            if masks.shape[1:] != orig_shape:
-                combined_mask = cv2.resize(
-                    combined_mask,
-                    (orig_shape[1], orig_shape[0]),
-                    interpolation=cv2.INTER_NEAREST
-                )
-            mask_path = os.path.join(self.save_mask_dir, save_filename)
-            cv2.imwrite(mask_path, combined_mask)
-            return Image.fromarray(cv2.cvtColor(segment_image, cv2.COLOR_RGB2BGR)), Image.fromarray(combined_mask)
-        else:
+    def segment_image(self, image: np.array, save_filename: str):
+        # Отладочный запуск идет тем же путем, что и конвейер, и только затем пишет результаты в папки
+        mask = self.segment_arrays([image])[0]
+        if mask is None:
             print("Маски не обнаружены.")
-            print(results)
             return None
 
+        mask = mask.numpy()
+        segment_image = render_overlay(cv2.cvtColor(image, cv2.COLOR_BGR2RGB), mask)
+        combined_mask = mask.astype(np.uint8) * 255
+        cv2.imwrite(os.path.join(self.save_segment_dir, save_filename), cv2.cvtColor(segment_image, cv2.COLOR_RGB2BGR))
+        cv2.imwrite(os.path.join(self.save_mask_dir, save_filename), combined_mask)
+        return Image.fromarray(segment_image), Image.fromarray(combined_mask)
+
     def segment_image_from_path(self, image_path: str):
         # Загружаем изображение из пути
         image = cv2.imread(image_path)
@@ -1,14 +1,33 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
 import torch
 from PIL import Image
 import torchvision.transforms as T
 import torch.nn.functional as F
 
+from src.utils.metrics import metrics
+
 
 class Inpainter:
-    def __init__(self, generator, image=None, mask=None, weights="", ):
+    def __init__(self, generator, image=None, mask=None, weights="", mode="full", roi_context=32, roi_merge_distance=16,
+                 tile_size=0, tile_overlap=32, tile_workers=2, classical_method="telea", classical_max_thickness=6,
+                 classical_max_area=0, classical_radius=3):
         self.image = image
         self.mask = mask
         self.weights = weights
+        self.mode = mode
+        self.roi_context = roi_context
+        self.roi_merge_distance = roi_merge_distance
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.tile_workers = tile_workers
+        self.classical_method = classical_method
+        self.classical_max_thickness = classical_max_thickness
+        self.classical_max_area = classical_max_area
+        self.classical_radius = classical_radius
+        self.hybrid_report = None
 
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         self.generator = generator
@@ -20,43 +39,295 @@ class Inpainter:
         padding = (0, pad_w, 0, pad_h)  # (left, right, top, bottom)
         return F.pad(tensor, padding), (h, w)
 
-    def prepare_inputs(self):
+    @staticmethod
+    def _pad_to(tensor, height, width):
+        return F.pad(tensor, (0, width - tensor.shape[-1], 0, height - tensor.shape[-2]))
+
+    def _load_inputs(self):
         if isinstance(self.image, str):
             self.image = Image.open(self.image).convert("RGB")
         if isinstance(self.mask, str):
             self.mask = Image.open(self.mask).convert("L")
 
-        image_tensor = T.ToTensor()(self.image)[:3]
-        mask_tensor = T.ToTensor()(self.mask)[0:1]
+    def _image_tensor(self, image):
+        if isinstance(image, np.ndarray):
+            # from_numpy разделяет память с буфером изображения, копия появляется только при переводе во float
+            return torch.from_numpy(image).permute(2, 0, 1)[:3].float().div(255)
+        return T.ToTensor()(image)[:3]
+
+    def _mask_tensor(self, mask):
+        if isinstance(mask, torch.Tensor):
+            return mask[None].float()
+        if isinstance(mask, np.ndarray) and mask.dtype == bool:
+            return torch.from_numpy(mask)[None].float()
+        return T.ToTensor()(mask)[0:1]
+
+    def _to_tensors(self, image, mask):
+        image_tensor = self._image_tensor(image)
+        mask_tensor = self._mask_tensor(mask)
 
-        image_tensor, self.orig_size = self._pad_to_multiple(image_tensor)
+        image_tensor, orig_size = self._pad_to_multiple(image_tensor)
         mask_tensor, _ = self._pad_to_multiple(mask_tensor)
 
         image_tensor = image_tensor.unsqueeze(0).to(self.device)
         mask_tensor = (mask_tensor > 0.5).float().unsqueeze(0).to(self.device)
 
         image_tensor = image_tensor * 2 - 1.
-        return image_tensor, mask_tensor
+        return image_tensor, mask_tensor, orig_size
 
-    def inpaint(self):
-        image_tensor, mask_tensor = self.prepare_inputs()
+    def prepare_inputs(self):
+        self._load_inputs()
+        image_tensor, mask_tensor, self.orig_size = self._to_tensors(self.image, self.mask)
+        return image_tensor, mask_tensor
 
+    def build_generator_input(self, image_tensor, mask_tensor):
         image_masked = image_tensor * (1. - mask_tensor)
         ones_x = torch.ones_like(image_masked)[:, 0:1, :, :]
-        x = torch.cat([image_masked, ones_x, ones_x * mask_tensor], dim=1)
+        return torch.cat([image_masked, ones_x, ones_x * mask_tensor], dim=1)
+
+    def _complete(self, image_tensor, mask_tensor):
+        x = self.build_generator_input(image_tensor, mask_tensor)
 
-        with torch.inference_mode():
+        with torch.inference_mode(), metrics.timer("generator_forward"):
             _, x_stage2 = self.generator(x, mask_tensor)
 
-        image_inpainted = image_tensor * (1. - mask_tensor) + x_stage2 * mask_tensor
+        return image_tensor * (1. - mask_tensor) + x_stage2 * mask_tensor
 
+    def _to_array(self, image_inpainted, orig_size):
         # Crop back to original size
-        h_orig, w_orig = self.orig_size
-        image_inpainted = image_inpainted[:, :, :h_orig, :w_orig]
+        h_orig, w_orig = orig_size
+        image_inpainted = image_inpainted[:, :h_orig, :w_orig]
+
+        img_out = ((image_inpainted.permute(1, 2, 0) + 1) * 127.5).clamp(0, 255)
+        return img_out.to('cpu', dtype=torch.uint8).numpy()
+
+    def _inpaint_array(self, image_np, mask_np):
+        image_tensor, mask_tensor, orig_size = self._to_tensors(image_np, mask_np)
+        image_inpainted = self._complete(image_tensor, mask_tensor)
+        return self._to_array(image_inpainted[0], orig_size)
+
+    def _needs_tiling(self, height, width):
+        return self.tile_size > 0 and (height > self.tile_size or width > self.tile_size)
+
+    def _tile_starts(self, length, tile):
+        if length <= tile:
+            return [0]
+        stride = max(1, tile - self.tile_overlap)
+        starts = list(range(0, length - tile, stride))
+        starts.append(length - tile)
+        return starts
+
+    def _tile_weights(self, height, width):
+        # Линейное затухание к краям тайла: в зоне перекрытия соседние тайлы смешиваются плавно
+        ramp = self.tile_overlap + 1
+        weight_y = np.minimum(np.arange(1, height + 1), np.arange(height, 0, -1)) / ramp
+        weight_x = np.minimum(np.arange(1, width + 1), np.arange(width, 0, -1)) / ramp
+        return np.outer(np.minimum(weight_y, 1), np.minimum(weight_x, 1)).astype(np.float32)
+
+    def _inpaint_tile(self, image_np, mask_np, y, x, tile_h, tile_w):
+        mask_tile = mask_np[y:y + tile_h, x:x + tile_w]
+        if not mask_tile.any():
+            return None
+        return self._inpaint_array(image_np[y:y + tile_h, x:x + tile_w], mask_tile)
+
+    def _inpaint_tiled(self, image_np, mask_np):
+        height, width = mask_np.shape
+        tile_h, tile_w = min(self.tile_size, height), min(self.tile_size, width)
+        starts_y = self._tile_starts(height, tile_h)
+        starts_x = self._tile_starts(width, tile_w)
+        weights = self._tile_weights(tile_h, tile_w)
+
+        result = image_np.copy()
+        carry_acc, carry_weight = None, None
+
+        # Тайлы обрабатываются полосами: в памяти одновременно находится только одна полоса аккумуляторов
+        with ThreadPoolExecutor(max_workers=self.tile_workers) as executor:
+            for row, y in enumerate(starts_y):
+                band_acc = np.zeros((tile_h, width, 3), dtype=np.float32)
+                band_weight = np.zeros((tile_h, width), dtype=np.float32)
+                if carry_acc is not None:
+                    band_acc[:len(carry_acc)] += carry_acc
+                    band_weight[:len(carry_weight)] += carry_weight
+
+                tiles = executor.map(
+                    lambda x: self._inpaint_tile(image_np, mask_np, y, x, tile_h, tile_w),
+                    starts_x
+                )
+                for x, tile in zip(starts_x, tiles):
+                    if tile is None:
+                        continue
+                    band_acc[:, x:x + tile_w] += tile * weights[:, :, None]
+                    band_weight[:, x:x + tile_w] += weights
+
+                next_y = starts_y[row + 1] if row + 1 < len(starts_y) else y + tile_h
+                done = next_y - y
+                carry_acc, carry_weight = band_acc[done:], band_weight[done:]
+
+                rows_weight = band_weight[:done]
+                rows_mask = mask_np[y:next_y] & (rows_weight > 0)
+                blended = band_acc[:done][rows_mask] / rows_weight[rows_mask][:, None]
+                result[y:next_y][rows_mask] = blended.round().clip(0, 255).astype(np.uint8)
+        return result
+
+    def _inpaint_region(self, image_np, mask_np):
+        height, width = mask_np.shape
+        if self._needs_tiling(height, width):
+            return self._inpaint_tiled(image_np, mask_np)
+        return self._inpaint_array(image_np, mask_np)
+
+    def _roi_boxes(self, mask_np):
+        height, width = mask_np.shape
+        mask_u8 = mask_np.astype(np.uint8)
+
+        # Дилатация объединяет компоненты, расстояние между которыми меньше roi_merge_distance
+        if self.roi_merge_distance > 0:
+            kernel_size = 2 * (self.roi_merge_distance // 2) + 1
+            mask_u8 = cv2.dilate(mask_u8, np.ones((kernel_size, kernel_size), np.uint8))
+
+        count, _, stats, _ = cv2.connectedComponentsWithStats(mask_u8, connectivity=8)
+        boxes = []
+        for x, y, w, h, _ in stats[1:count]:
+            boxes.append([
+                max(0, x - self.roi_context),
+                max(0, y - self.roi_context),
+                min(width, x + w + self.roi_context),
+                min(height, y + h + self.roi_context)
+            ])
+
+        # Контекстные области соседних групп могут пересекаться - сливаем их до неподвижной точки
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(boxes)):
+                for j in range(i + 1, len(boxes)):
+                    a, b = boxes[i], boxes[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                        boxes[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                        del boxes[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return boxes
+
+    def _inpaint_roi(self, image_np, mask_np, boxes=None):
+        result = image_np.copy()
+        for x0, y0, x1, y1 in boxes if boxes is not None else self._roi_boxes(mask_np):
+            mask_crop = mask_np[y0:y1, x0:x1]
+            inpainted_crop = self._inpaint_region(image_np[y0:y1, x0:x1], mask_crop)
+            result[y0:y1, x0:x1][mask_crop] = inpainted_crop[mask_crop]
+        return result
+
+    def _split_components(self, mask_np):
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(mask_np.astype(np.uint8), connectivity=8)
+
+        # Толщина компоненты - удвоенное максимальное расстояние от ее пикселей до границы маски
+        distance = cv2.distanceTransform(mask_np.astype(np.uint8), cv2.DIST_L2, 3)
+        thickness = np.zeros(count, dtype=np.float32)
+        np.maximum.at(thickness, labels[mask_np], distance[mask_np])
+        thickness *= 2
+
+        classical = np.zeros(count, dtype=bool)
+        if self.classical_max_thickness > 0:
+            classical |= thickness <= self.classical_max_thickness
+        if self.classical_max_area > 0:
+            classical |= stats[:, cv2.CC_STAT_AREA] <= self.classical_max_area
+        classical[0] = False
+
+        classical_mask = classical[labels]
+        return classical_mask, mask_np & ~classical_mask, int(classical[1:].sum()), count - 1
+
+    def _inpaint_hybrid(self, image_np, mask_np):
+        classical_mask, gan_mask, classical_count, component_count = self._split_components(mask_np)
+
+        # Тонкие царапины заполняются классическим алгоритмом, генератор получает только крупные области
+        result = image_np
+        if classical_mask.any():
+            flags = cv2.INPAINT_NS if self.classical_method == "ns" else cv2.INPAINT_TELEA
+            with metrics.timer("classical_inpaint"):
+                result = cv2.inpaint(np.ascontiguousarray(image_np), classical_mask.astype(np.uint8) * 255,
+                                     self.classical_radius, flags)
+
+        boxes = self._roi_boxes(gan_mask) if gan_mask.any() else []
+        if boxes:
+            result = self._inpaint_roi(result, gan_mask, boxes)
+
+        height, width = mask_np.shape
+        gan_area = int(sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in boxes))
+        self.hybrid_report = {
+            "components": component_count,
+            "classical_components": classical_count,
+            "gan_components": component_count - classical_count,
+            "classical_pixels": int(classical_mask.sum()),
+            "gan_pixels": int(gan_mask.sum()),
+            "gan_input_pixels": gan_area,
+            "gan_compute_avoided": float(1 - gan_area / (height * width))
+        }
+        metrics.increment("hybrid_classical_components_total", classical_count)
+        metrics.increment("hybrid_gan_components_total", component_count - classical_count)
+        metrics.observe("hybrid_gan_compute_avoided_ratio", self.hybrid_report["gan_compute_avoided"])
+        return result.copy() if result is image_np else result
+
+    def _input_arrays(self):
+        self._load_inputs()
+        image_np = self.image if isinstance(self.image, np.ndarray) else np.array(self.image)
+        image_np = image_np[:, :, :3]
+        if isinstance(self.mask, torch.Tensor):
+            return image_np, self.mask.cpu().numpy().astype(bool, copy=False)
+        mask_np = np.asarray(self.mask)
+        if mask_np.ndim == 3:
+            mask_np = mask_np[:, :, 0]
+        if mask_np.dtype == bool:
+            return image_np, mask_np
+        return image_np, mask_np > 127
+
+    def inpaint_array(self):
+        image_np, mask_np = self._input_arrays()
+        if self.mode == "roi":
+            return self._inpaint_roi(image_np, mask_np)
+        if self.mode == "hybrid":
+            return self._inpaint_hybrid(image_np, mask_np)
+        if self._needs_tiling(*mask_np.shape):
+            return self._inpaint_tiled(image_np, mask_np)
+
+        image_tensor, mask_tensor = self.prepare_inputs()
+        image_inpainted = self._complete(image_tensor, mask_tensor)
+        return self._to_array(image_inpainted[0], self.orig_size)
+
+    def inpaint(self):
+        return Image.fromarray(self.inpaint_array())
+
+    @classmethod
+    def inpaint_batch(cls, generator, images: list, masks: list, max_batch_size: int = 8, **options):
+        inpainters = [cls(generator=generator, image=image, mask=mask, **options) for image, mask in zip(images, masks)]
+        outputs = [None] * len(inpainters)
+
+        # В режимах roi и hybrid и при тайлинге каждое изображение дает свой набор кропов произвольного размера
+        batched = []
+        for index, inpainter in enumerate(inpainters):
+            # Маска может быть путем к файлу или PIL-изображением, у которых нет shape
+            inpainter._load_inputs()
+            height, width = np.asarray(inpainter.mask).shape[:2]
+            if inpainter.mode != "full" or inpainter._needs_tiling(height, width):
+                outputs[index] = inpainter.inpaint_array()
+            else:
+                batched.append(index)
+
+        prepared = {index: inpainters[index].prepare_inputs() for index in batched}
 
-        img_out = ((image_inpainted[0].permute(1, 2, 0) + 1) * 127.5).clamp(0, 255)
-        img_out = img_out.to('cpu', dtype=torch.uint8).numpy()
-        return Image.fromarray(img_out)
+        # Соседние по размеру изображения попадают в один чанк, внутри чанка тензоры дополняются нулями
+        # до максимальной высоты и ширины (обе уже кратны 8), выход обрезается по orig_size каждого изображения
+        batched.sort(key=lambda i: tuple(prepared[i][0].shape[2:]))
+        for start in range(0, len(batched), max_batch_size):
+            chunk = batched[start:start + max_batch_size]
+            height = max(prepared[i][0].shape[2] for i in chunk)
+            width = max(prepared[i][0].shape[3] for i in chunk)
+            image_batch = torch.cat([cls._pad_to(prepared[i][0], height, width) for i in chunk], dim=0)
+            mask_batch = torch.cat([cls._pad_to(prepared[i][1], height, width) for i in chunk], dim=0)
+            inpainted_batch = inpainters[chunk[0]]._complete(image_batch, mask_batch)
+            for position, index in enumerate(chunk):
+                outputs[index] = inpainters[index]._to_array(inpainted_batch[position], inpainters[index].orig_size)
+        return outputs
 
 
 if __name__ == '__main__':
@@ -1,22 +1,63 @@
+import hashlib
 import json
 import importlib
 import os
+import threading
+import time
 import torch
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
 from pathlib import Path
-from typing import Union, Dict, Any, Type
+from typing import Union, Dict, Any, Type, Optional, Tuple
 from ultralytics import YOLO
 from torch import nn
 
+from src.ml_pipeline.onnx_backend import OnnxGenerator
+from src.ml_pipeline.precision_generator import PrecisionGenerator
+from src.utils.logger import logger
+
+DEFAULT_VERSION = 'default'
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+VERSION_KEYS = ('versions', 'active_version')
+
+
+class ModelHandle:
+    """Ссылка на активную версию модели: сама модель загружается при первом обращении."""
+
+    def __init__(self, model_manager: "ModelManager", model_name: str):
+        self.model_manager = model_manager
+        self.model_name = model_name
+
+    def acquire(self) -> Tuple[Any, str]:
+        return self.model_manager.acquire(self.model_name)
+
 
 class ModelManager:
 
-    def __init__(self, config_path: str, ml_settings):
+    def __init__(self, config_path: str, ml_settings, memory_budget_bytes: int = 0, config_check_interval: float = 5.0):
         self.config_path = Path(config_path)
         self.ml_settings = ml_settings
         self.models_config = self._load_and_interpolate_config()
-        self.models = {}
+        self.active_versions = {name: config.get('active_version', DEFAULT_VERSION)
+                                for name, config in self.models_config.items()}
+        # (имя, версия) -> (модель, строка версии, размер в байтах); порядок ключей - порядок последнего обращения
+        self.models = OrderedDict()
+        # Версии, добавленные через register_version: хранятся отдельно и переживают перечитывание конфигурации
+        self.registered_versions = {}
+        self.memory_budget_bytes = memory_budget_bytes
+        self.config_check_interval = config_check_interval
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
+        self.ready = threading.Event()
+
+        self._lock = threading.RLock()
+        # (имя, версия) -> Future загрузки: параллельные запросы той же версии ждут одну загрузку
+        self._loading = {}
+        self._config_mtime = self.config_path.stat().st_mtime_ns
+        self._config_checked_at = time.monotonic()
+
     def _load_and_interpolate_config(self) -> Dict[str, Any]:
         if not self.config_path.exists():
             raise FileNotFoundError(f"Конфигурационный файл не найден: {self.config_path}")
@@ -30,9 +71,40 @@ class ModelManager:
                     model_config['model_path'] = self.ml_settings.path_to_cnn
                 elif model_name == 'gan':
                     model_config['model_path'] = self.ml_settings.path_to_gan
+                elif model_name == 'gan_quantized':
+                    model_config['model_path'] = self.ml_settings.path_to_gan_quantized
+            if 'onnx_path' in model_config:
+                if model_name == 'cnn':
+                    model_config['onnx_path'] = self.ml_settings.path_to_cnn_onnx
+                elif model_name == 'gan':
+                    model_config['onnx_path'] = self.ml_settings.path_to_gan_onnx
 
         return config
 
+    def _version_config(self, model_name: str, version: Optional[str] = None) -> Dict[str, Any]:
+        if model_name not in self.models_config:
+            raise ValueError(f"Конфигурация для модели '{model_name}' не найдена")
+
+        base = self.models_config[model_name]
+        version = version or self.active_versions.get(model_name, DEFAULT_VERSION)
+        config = {key: value for key, value in base.items() if key not in VERSION_KEYS}
+        if version != DEFAULT_VERSION:
+            versions = self._versions(model_name)
+            if version not in versions:
+                raise ValueError(f"Версия '{version}' модели '{model_name}' не найдена в конфигурации")
+            # Версия переопределяет только отличающиеся ключи, остальное наследуется от базовой записи
+            config.update(versions[version])
+        config['version'] = version
+        return config
+
+    def _versions(self, model_name: str) -> Dict[str, Any]:
+        return {**self.models_config[model_name].get('versions', {}), **self.registered_versions.get(model_name, {})}
+
+    def list_versions(self, model_name: str) -> list:
+        if model_name not in self.models_config:
+            raise ValueError(f"Конфигурация для модели '{model_name}' не найдена")
+        return [DEFAULT_VERSION, *self._versions(model_name)]
+
     def _load_model_class(self, class_path: str) -> Type[nn.Module]:
         module_path, class_name = class_path.rsplit('.', 1)
         try:
@@ -41,49 +113,360 @@ class ModelManager:
         except (ImportError, AttributeError) as e:
             raise ImportError(f"Не удалось загрузить класс {class_path}: {str(e)}")
 
-    def load_model(self, model_name: str) -> Union[YOLO, nn.Module]:
-        if model_name in self.models:
-            return self.models[model_name]
+    def _is_yolo(self, model_name: str, config: Dict[str, Any]) -> bool:
+        return config.get('is_yolo', model_name == 'yolo' or 'yolo' in model_name.lower())
 
-        if model_name not in self.models_config:
-            raise ValueError(f"Конфигурация для модели '{model_name}' не найдена")
+    def load_model(self, model_name: str, version: Optional[str] = None) -> Union[YOLO, nn.Module, OnnxGenerator]:
+        return self._get_or_load(model_name, version)[0]
+
+    def acquire(self, model_name: str) -> Tuple[Any, str]:
+        # Модель и ее версия берутся вместе: запрос доработает на тех весах, с которыми начался,
+        # даже если активную версию переключат или вытеснят из памяти
+        self._refresh_config()
+        return self._get_or_load(model_name)
+
+    def _get_or_load(self, model_name: str, version: Optional[str] = None) -> Tuple[Any, str]:
+        # Под блокировкой только проверка и вставка в реестр: загрузка и прогрев новой версии
+        # не останавливают запросы к уже загруженным моделям
+        with self._lock:
+            config = self._version_config(model_name, version)
+            key = (model_name, config['version'])
+            if key in self.models:
+                self.models.move_to_end(key)
+                model, version_string, _ = self.models[key]
+                return model, version_string
+            loading = self._loading.get(key)
+            owner = loading is None
+            if owner:
+                loading = self._loading[key] = Future()
+
+        if not owner:
+            return loading.result()
+
+        try:
+            backend = config.get('backend', 'torch')
+            if backend == 'onnxruntime':
+                model = self._load_onnx_model(model_name, config)
+            elif backend == 'torch':
+                model = self._load_torch_model(model_name, config)
+            else:
+                raise ValueError(f"Неизвестный backend '{backend}' для модели '{model_name}'")
+
+            version_string = self._version_string(model_name, config)
+            model = self._prepare_model(model_name, model, config, version_string)
+            size = self._model_size(model, config)
+        except Exception as e:
+            with self._lock:
+                del self._loading[key]
+            loading.set_exception(e)
+            raise
+
+        with self._lock:
+            self.models[key] = (model, version_string, size)
+            del self._loading[key]
+            self._evict(keep=key)
+        loading.set_result((model, version_string))
+        logger.info(f"Model {model_name} version {config['version']} loaded")
+        return model, version_string
+
+    def preload(self, model_names: list) -> None:
+        # Сервис объявляет готовность только после загрузки и прогрева активных версий
+        try:
+            for model_name in model_names:
+                self._get_or_load(model_name)
+        except Exception as e:
+            # Интерфейс не должен навсегда остаться в состоянии прогрева: модели догрузятся при первом запросе
+            logger.error(f"Models preload failed, they will be loaded on the first request: {e}")
+        else:
+            logger.info(f"Models {', '.join(model_names)} are ready")
+        finally:
+            self.ready.set()
+
+    def is_ready(self) -> bool:
+        return self.ready.is_set()
+
+    def _prepare_model(self, model_name: str, model, config: Dict[str, Any], version_string: str):
+        compile_mode = config.get('compile', self.ml_settings.model_compile)
+        if compile_mode != 'none' and isinstance(model, nn.Module) and not self._is_yolo(model_name, config):
+            model = self._compile_model(model_name, model, config, compile_mode, version_string)
+        self._warm_up(model_name, model, config)
+        return model
+
+    def _warmup_sizes(self, config: Dict[str, Any]) -> list:
+        resolutions = config.get('warmup_resolutions', self.ml_settings.model_warmup_resolutions)
+        if isinstance(resolutions, str):
+            resolutions = [int(value) for value in resolutions.split(',') if value.strip()]
+
+        sizes = []
+        for resolution in resolutions:
+            height, width = resolution if isinstance(resolution, (list, tuple)) else (resolution, resolution)
+            # Генератор принимает стороны, кратные 8 - как после паддинга в Inpainter
+            sizes.append((-(-height // 8) * 8, -(-width // 8) * 8))
+        return sizes
+
+    def _generator_inputs(self, height: int, width: int) -> tuple:
+        mask = torch.zeros(1, 1, height, width, device=self.device)
+        mask[:, :, height // 4:height // 2, width // 4:width // 2] = 1.
+        x = torch.cat([torch.zeros(1, 3, height, width, device=self.device), torch.ones_like(mask), mask], dim=1)
+        return x, mask
+
+    def _warm_up(self, model_name: str, model, config: Dict[str, Any]) -> None:
+        sizes = self._warmup_sizes(config)
+        passes = config.get('warmup_passes', self.ml_settings.model_warmup_passes)
+        if not sizes or passes <= 0:
+            return
+
+        # Первые проходы выделяют память аллокатора, выбирают ядра oneDNN/cuDNN и сливают слои YOLO
+        start_time = time.perf_counter()
+        with torch.inference_mode():
+            for height, width in sizes:
+                for _ in range(passes):
+                    if self._is_yolo(model_name, config):
+                        model(np.zeros((height, width, 3), dtype=np.uint8), verbose=False)
+                    else:
+                        model(*self._generator_inputs(height, width))
+        logger.info(f"Model {model_name} version {config['version']} warmed up on {sizes} "
+                    f"in {time.perf_counter() - start_time:.2f}s")
+
+    def _compile_model(self, model_name: str, model: nn.Module, config: Dict[str, Any], compile_mode: str,
+                       version_string: str) -> nn.Module:
+        cache_dir = PROJECT_ROOT / self.ml_settings.model_compile_cache_dir
+        if compile_mode == 'torchscript':
+            # Трассированный граф привязан к сборке torch: артефакт другой версии не переиспользуется
+            digest = hashlib.sha256(f"{version_string}:{self.device}:{torch.__version__}".encode()).hexdigest()[:16]
+            compiled_path = cache_dir / f"{model_name}_{config['version']}_{digest}.pt"
+            if compiled_path.exists():
+                return torch.jit.load(str(compiled_path), map_location=self.device).eval()
+
+            sizes = self._warmup_sizes(config) or [(256, 256)]
+            # Трассировка записывает операции для одного размера входа. Сверка с eager на другом размере
+            # показывает, не зашиты ли в граф формы тензоров
+            check_size = next((size for size in sizes[1:] if size != sizes[0]), (sizes[0][0] + 64, sizes[0][1] + 32))
+            with torch.no_grad():
+                traced = torch.jit.trace(model, self._generator_inputs(*sizes[0]), check_trace=False)
+                check_inputs = self._generator_inputs(*check_size)
+                try:
+                    matches = self._outputs_match(model(*check_inputs), traced(*check_inputs))
+                except RuntimeError as e:
+                    logger.warning(f"Traced model {model_name} failed on {check_size}: {e}")
+                    matches = False
+            if not matches:
+                logger.warning(f"Model {model_name} version {config['version']} traced on {sizes[0]} diverges from "
+                               f"eager on {check_size}, falling back to eager model")
+                return model
+
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = compiled_path.with_suffix('.tmp')
+            torch.jit.save(traced, str(tmp_path))
+            os.replace(tmp_path, compiled_path)
+            logger.info(f"Model {model_name} version {config['version']} traced to {compiled_path}")
+            return traced.eval()
+        if compile_mode == 'torch_compile':
+            # Скомпилированные ядра inductor кэширует на диске и переиспользует при следующем запуске
+            os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', str(cache_dir / 'inductor'))
+            return torch.compile(model, dynamic=True)
+        raise ValueError(f"Неизвестный режим компиляции '{compile_mode}' для модели '{model_name}'")
 
-        config = self.models_config[model_name]
+    def _outputs_match(self, expected, actual) -> bool:
+        if isinstance(expected, (list, tuple)):
+            return isinstance(actual, (list, tuple)) and len(expected) == len(actual) and \
+                all(self._outputs_match(e, a) for e, a in zip(expected, actual))
+        return expected.shape == actual.shape and torch.allclose(expected, actual, rtol=1e-3, atol=1e-4)
+
+    def _tensor_bytes(self, value) -> int:
+        if isinstance(value, torch.Tensor):
+            return value.numel() * value.element_size()
+        if isinstance(value, (list, tuple)):
+            return sum(self._tensor_bytes(item) for item in value)
+        return 0
+
+    def _model_size(self, model, config: Dict[str, Any]) -> int:
+        if isinstance(model, nn.Module):
+            # Веса INT8-модулей FX лежат в упакованных параметрах, которых нет в parameters() и buffers(),
+            # но есть в state_dict()
+            size = sum(self._tensor_bytes(value) for value in model.state_dict().values())
+            if size:
+                return size
+        path = config['onnx_path'] if config.get('backend') == 'onnxruntime' else config['model_path']
+        return os.path.getsize(path)
+
+    def loaded_bytes(self) -> int:
+        with self._lock:
+            return sum(size for _, _, size in self.models.values())
+
+    def _evict(self, keep: tuple) -> None:
+        if not self.memory_budget_bytes:
+            return
+        for key in list(self.models):
+            if self.loaded_bytes() <= self.memory_budget_bytes:
+                break
+            if key == keep:
+                continue
+            # Удаляется только ссылка реестра: батч, который уже получил модель, держит ее до завершения
+            del self.models[key]
+            logger.info(f"Model {key[0]} version {key[1]} evicted from memory")
+
+    def set_active_version(self, model_name: str, version: str, preload: bool = True) -> str:
+        # Новая версия загружается до переключения, чтобы запросы не ждали загрузку весов
+        if preload:
+            self._get_or_load(model_name, version)
+        else:
+            self._version_config(model_name, version)
+        with self._lock:
+            previous = self.active_versions.get(model_name, DEFAULT_VERSION)
+            self.active_versions[model_name] = version
+        logger.info(f"Model {model_name} switched from version {previous} to {version}")
+        return previous
+
+    def write_active_version(self, model_name: str, version: str) -> None:
+        # Активная версия сохраняется в конфигурации: ее подхватят все процессы, читающие этот файл
+        self._version_config(model_name, version)
+        with open(self.config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        config[model_name]['active_version'] = version
+
+        tmp_path = self.config_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(config, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.config_path)
+
+    def register_version(self, model_name: str, version: str, config: Dict[str, Any]) -> None:
+        if version == DEFAULT_VERSION:
+            raise ValueError(f"Имя версии '{DEFAULT_VERSION}' зарезервировано")
+        with self._lock:
+            if model_name not in self.models_config:
+                raise ValueError(f"Конфигурация для модели '{model_name}' не найдена")
+            self.registered_versions.setdefault(model_name, {})[version] = config
+
+    def _refresh_config(self) -> None:
+        # Переключение версий правкой конфигурации без перезапуска Streamlit
+        now = time.monotonic()
+        if now - self._config_checked_at < self.config_check_interval:
+            return
+        self._config_checked_at = now
+
+        mtime = self.config_path.stat().st_mtime_ns
+        if mtime == self._config_mtime:
+            return
+        try:
+            config = self._load_and_interpolate_config()
+        except (OSError, ValueError) as e:
+            logger.error(f"Models config reload failed: {e}")
+            return
+
+        with self._lock:
+            self._config_mtime = mtime
+            self.models_config = config
+        for model_name, model_config in config.items():
+            version = model_config.get('active_version', DEFAULT_VERSION)
+            if self.active_versions.get(model_name) != version:
+                self.set_active_version(model_name, version, preload=False)
+
+    def _load_onnx_model(self, model_name: str, config: Dict[str, Any]) -> Union[YOLO, OnnxGenerator]:
+        if 'onnx_path' not in config:
+            raise KeyError(f"Для модели '{model_name}' отсутствует обязательный ключ 'onnx_path'")
+
+        onnx_path = config['onnx_path']
+        if not os.path.exists(onnx_path):
+            raise FileNotFoundError(f"Файл модели не найден: {onnx_path}")
+
+        if self._is_yolo(model_name, config):
+            # ultralytics сам выполняет .onnx модель через onnxruntime, постобработка масок остается прежней
+            return YOLO(onnx_path, task=config.get('model_type', 'segment'))
+        return OnnxGenerator(onnx_path, intra_op_num_threads=config.get('intra_op_num_threads', 0))
+
+    def load_torch_model(self, model_name: str, version: Optional[str] = None) -> Union[YOLO, nn.Module]:
+        return self._load_torch_model(model_name, self._version_config(model_name, version))
+
+    def _load_torch_model(self, model_name: str, config: Dict[str, Any]) -> Union[YOLO, nn.Module]:
         model_path = config['model_path']
 
         if not os.path.exists(model_path):
             raise FileNotFoundError(f"Файл модели не найден: {model_path}")
 
-        is_yolo = config.get('is_yolo', model_name == 'yolo' or 'yolo' in model_name.lower())
-
-        if is_yolo:
+        if self._is_yolo(model_name, config):
             model = YOLO(model_path)
             if 'model_type' in config:
                 model.task = config['model_type']
+        elif config.get('precision', 'fp32') != 'fp32':
+            model = self._load_quantized_model(model_name, config)
         else:
             if 'model_class' not in config:
                 raise KeyError(f"Для модели '{model_name}' отсутствует обязательный ключ 'model_class'")
 
             model_class = self._load_model_class(config['model_class'])
             model_args = config.get('model_args', {})
-            model = model_class(**model_args).to(self.device)
-
-            state_dict = torch.load(model_path, map_location=self.device)
-            if 'G' in state_dict:
-                model.load_state_dict(state_dict['G'])
-            elif 'generator_state_dict' in state_dict:
-                model.load_state_dict(state_dict['generator_state_dict'])
-            elif 'state_dict' in state_dict:
-                model.load_state_dict(state_dict['state_dict'])
-            else:
-                try:
-                    model.load_state_dict(state_dict)
-                except RuntimeError as e:
-                    raise RuntimeError(f"Не удалось загрузить веса: {str(e)}")
-
+            model = model_class(**model_args)
+            model = self._load_weights(model, model_path, config).to(self.device)
             model.eval()
 
-        self.models[model_name] = model
+        return model
+
+    @staticmethod
+    def extract_state_dict(checkpoint: Dict[str, Any]) -> Dict[str, torch.Tensor]:
+        for key in ('G', 'generator_state_dict', 'state_dict'):
+            if key in checkpoint:
+                return checkpoint[key]
+        return checkpoint
+
+    def _read_state_dict(self, model_path: str, mmap: bool) -> Dict[str, torch.Tensor]:
+        if model_path.endswith('.safetensors'):
+            try:
+                from safetensors.torch import load_file
+            except ImportError as e:
+                raise ImportError(f"Для весов в формате safetensors требуется пакет safetensors: {str(e)}")
+            return load_file(model_path, device='cpu')
+
+        try:
+            return self.extract_state_dict(torch.load(model_path, map_location='cpu', mmap=mmap))
+        except RuntimeError as e:
+            if not mmap:
+                raise
+            # Старый формат torch.save не отображается в память - его нужно один раз пересохранить
+            logger.warning(f"Weights {model_path} can not be memory-mapped ({e}), "
+                           f"convert them with src.ml_pipeline.weights_converter")
+            return self.extract_state_dict(torch.load(model_path, map_location='cpu'))
+
+    def _load_weights(self, model: nn.Module, model_path: str, config: Dict[str, Any]) -> nn.Module:
+        mmap = config.get('mmap', self.ml_settings.model_mmap)
+        state_dict = self._read_state_dict(model_path, mmap)
+
+        # assign=True делает параметры модели тензорами, отображенными из файла, без копирования.
+        # Страницы отображения в режиме copy-on-write не изменяются при инференсе,
+        # поэтому все процессы с одними весами используют одну копию в page cache
+        try:
+            model.load_state_dict(state_dict, assign=mmap and self.device.type == 'cpu')
+        except RuntimeError as e:
+            raise RuntimeError(f"Не удалось загрузить веса: {str(e)}")
+        return model
+
+    def _load_quantized_model(self, model_name: str, config: Dict[str, Any]) -> nn.Module:
+        model_path = config['model_path']
+        # Квантованный FX-граф сохраняется целиком: из state_dict его не восстановить без повторной калибровки
+        artifact = torch.load(model_path, map_location='cpu', weights_only=False)
+        # Точность берется из самого артефакта quantization.py: конфигурация лишь отмечает, что модель не fp32
+        precision = artifact.get('precision', config['precision']) if isinstance(artifact, dict) else config['precision']
+        if precision != config['precision']:
+            logger.warning(f"Model {model_name} is configured as {config['precision']}, "
+                           f"but {model_path} contains {precision} weights")
+
+        if precision == 'int8':
+            model = artifact['model']
+        elif precision == 'bf16':
+            if 'model_class' not in config:
+                raise KeyError(f"Для модели '{model_name}' отсутствует обязательный ключ 'model_class'")
+
+            model_class = self._load_model_class(config['model_class'])
+            model = model_class(**config.get('model_args', {}))
+            try:
+                model.load_state_dict(self.extract_state_dict(artifact))
+            except RuntimeError as e:
+                raise RuntimeError(f"Не удалось загрузить веса: {str(e)}")
+            model = PrecisionGenerator(model.to(self.device), torch.bfloat16)
+        else:
+            raise ValueError(f"Неизвестная точность '{precision}' для модели '{model_name}'")
+
+        model.eval()
         return model
 
     def save_model(
@@ -108,11 +491,18 @@ class ModelManager:
             }
             torch.save(state_dict, save_path)
 
-    def get_model_info(self, model_name: str) -> Dict[str, Any]:
-        if model_name not in self.models_config:
-            raise ValueError(f"Модель '{model_name}' не найдена в конфигурации")
+    def get_model_version(self, model_name: str, version: Optional[str] = None) -> str:
+        return self._version_string(model_name, self._version_config(model_name, version))
+
+    def _version_string(self, model_name: str, config: Dict[str, Any]) -> str:
+        backend = config.get('backend', 'torch')
+        model_path = config['onnx_path'] if backend == 'onnxruntime' else config['model_path']
+        stat = os.stat(model_path)
+        return (f"{model_name}:{config['version']}:{backend}:{config.get('precision', 'fp32')}:"
+                f"{stat.st_size}:{stat.st_mtime_ns}")
 
-        config = self.models_config[model_name]
+    def get_model_info(self, model_name: str, version: Optional[str] = None) -> Dict[str, Any]:
+        config = self._version_config(model_name, version)
         model_path = config['model_path']
 
         info = {
@@ -120,13 +510,17 @@ class ModelManager:
             'path': model_path,
             'exists': os.path.exists(model_path),
             'size': os.path.getsize(model_path) if os.path.exists(model_path) else 0,
-            'type': 'yolo' if model_name == 'yolo' else 'pytorch'
+            'type': 'yolo' if model_name == 'yolo' else 'pytorch',
+            'backend': config.get('backend', 'torch'),
+            'version': config['version'],
+            'active': config['version'] == self.active_versions.get(model_name, DEFAULT_VERSION),
+            'loaded': (model_name, config['version']) in self.models
         }
 
         if model_name == 'cnn':
             info['task'] = config.get('model_type', 'segment')
         else:
-            info['model_class'] = config['model_class'].__name__
+            info['model_class'] = config.get('model_class')
         return info
 
 # if __name__ == '__main__':
@@ -0,0 +1,27 @@
+import torch
+
+
+class OnnxGenerator:
+    """Обертка над onnxruntime-сессией генератора с тем же интерфейсом вызова, что и у torch-модели."""
+
+    def __init__(self, model_path: str, intra_op_num_threads: int = 0):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError(f"Для backend 'onnxruntime' требуется пакет onnxruntime: {str(e)}")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = intra_op_num_threads
+
+        self.model_path = model_path
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+    def __call__(self, x: torch.Tensor, mask: torch.Tensor):
+        inputs = dict(zip(self.input_names, (x.detach().cpu().numpy(), mask.detach().cpu().numpy())))
+        outputs = self.session.run(None, inputs)
+        return tuple(torch.from_numpy(output).to(x.device) for output in outputs)
+
+    def eval(self):
+        return self
@@ -0,0 +1,73 @@
+import argparse
+import shutil
+from pathlib import Path
+
+import torch
+from ultralytics import YOLO
+
+from src.ml_pipeline.model_manager import ModelManager
+from src.settings.ml_settings import ml_settings
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--config', type=str, default="src/settings/models_config.json", help="Path to models config")
+parser.add_argument('--models', type=str, nargs='+', default=['cnn', 'gan'], help="Models to export")
+parser.add_argument('--output-dir', type=str, default="onnx_models", help="Folder for exported .onnx files")
+parser.add_argument('--opset', type=int, default=17, help="ONNX opset version")
+parser.add_argument('--imgsz', type=int, default=640, help="Export resolution for the YOLO model")
+
+
+class OnnxExporter:
+    def __init__(self, model_manager: ModelManager, output_dir: str, opset: int = 17):
+        self.model_manager = model_manager
+        self.output_dir = Path(output_dir)
+        self.opset = opset
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+
+    def export_yolo(self, model_name: str, imgsz: int = 640) -> Path:
+        model = self.model_manager.load_torch_model(model_name)
+        if not isinstance(model, YOLO):
+            raise ValueError(f"Модель '{model_name}' не является YOLO моделью")
+
+        exported = model.export(format="onnx", dynamic=True, imgsz=imgsz, opset=self.opset)
+        save_path = self.output_dir / f"{model_name}.onnx"
+        shutil.move(exported, save_path)
+        return save_path
+
+    def export_generator(self, model_name: str, sample_size: int = 256) -> Path:
+        model = self.model_manager.load_torch_model(model_name)
+        device = self.model_manager.device
+
+        x = torch.zeros(1, 5, sample_size, sample_size, device=device)
+        mask = torch.zeros(1, 1, sample_size, sample_size, device=device)
+
+        save_path = self.output_dir / f"{model_name}.onnx"
+        # Трассировка при экспорте несовместима с inference-тензорами, градиенты отключаются через no_grad
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                (x, mask),
+                str(save_path),
+                input_names=["x", "mask"],
+                output_names=["x_stage1", "x_stage2"],
+                dynamic_axes={
+                    "x": {0: "batch", 2: "height", 3: "width"},
+                    "mask": {0: "batch", 2: "height", 3: "width"},
+                    "x_stage1": {0: "batch", 2: "height", 3: "width"},
+                    "x_stage2": {0: "batch", 2: "height", 3: "width"}
+                },
+                opset_version=self.opset
+            )
+        return save_path
+
+    def export(self, model_name: str, imgsz: int = 640) -> Path:
+        config = self.model_manager.models_config[model_name]
+        if self.model_manager._is_yolo(model_name, config):
+            return self.export_yolo(model_name, imgsz)
+        return self.export_generator(model_name)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    exporter = OnnxExporter(ModelManager(args.config, ml_settings=ml_settings), args.output_dir, args.opset)
+    for name in args.models:
+        print(f"Модель '{name}' экспортирована в {exporter.export(name, args.imgsz)}")
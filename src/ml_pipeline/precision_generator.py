@@ -0,0 +1,15 @@
+import torch
+from torch import nn
+
+
+class PrecisionGenerator(nn.Module):
+    """Выполняет генератор в пониженной точности, сохраняя fp32 вход и выход для Inpainter."""
+
+    def __init__(self, generator: nn.Module, dtype: torch.dtype = torch.bfloat16):
+        super().__init__()
+        self.generator = generator.to(dtype)
+        self.dtype = dtype
+
+    def forward(self, x: torch.Tensor, mask: torch.Tensor):
+        outputs = self.generator(x.to(self.dtype), mask.to(self.dtype))
+        return tuple(output.float() if output is not None else None for output in outputs)
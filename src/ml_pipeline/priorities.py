@@ -0,0 +1,7 @@
+PRIORITY_PAID = 0
+PRIORITY_FREE = 1
+PRIORITY_NAMES = {PRIORITY_PAID: "paid", PRIORITY_FREE: "free"}
+
+
+class AdmissionError(Exception):
+    """Запрос отклонен до постановки в очередь: очередь заполнена или превышен лимит пользователя."""
@@ -0,0 +1,141 @@
+import argparse
+import copy
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+import torchvision.transforms as T
+from PIL import Image
+from torch import nn
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+from src.ml_pipeline.model_gan.test.test_inpaint import Inpainter
+from src.ml_pipeline.model_gan.train.losses_metrics.metrics import Metrics
+from src.ml_pipeline.model_manager import ModelManager
+from src.ml_pipeline.precision_generator import PrecisionGenerator
+from src.settings.ml_settings import ml_settings
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--config', type=str, default="src/settings/models_config.json", help="Path to models config")
+parser.add_argument('--model', type=str, default="gan", help="fp32 generator entry in models config")
+parser.add_argument('--precision', type=str, default="int8", choices=["int8", "bf16"], help="Target precision")
+parser.add_argument('--data', type=str, default="EXAMPLES", help="Folder with images and their '_m_' masks")
+parser.add_argument('--samples', type=int, default=10, help="Number of calibration images")
+parser.add_argument('--max-side', type=int, default=512, help="Longest image side used for calibration")
+parser.add_argument('--output', type=str, required=True, help="Path for the quantized artifact")
+parser.add_argument('--report', type=str, default="", help="Path for the JSON comparison report")
+
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+ARTIFACT_MARKERS = ('_f_', '_m_', '_s_')
+
+
+class GeneratorQuantizer:
+    def __init__(self, generator: nn.Module, data_dir: str, samples: int = 10, max_side: int = 512):
+        self.generator = generator.cpu().eval()
+        self.samples = self._load_samples(data_dir, samples, max_side)
+        if not self.samples:
+            raise FileNotFoundError(f"В папке {data_dir} не найдено изображений с масками")
+
+    def _load_samples(self, data_dir: str, limit: int, max_side: int) -> list:
+        samples = []
+        for root, _, filenames in sorted(os.walk(data_dir)):
+            for filename in sorted(filenames):
+                if not filename.lower().endswith(IMG_EXTENSIONS) or any(m in filename for m in ARTIFACT_MARKERS):
+                    continue
+
+                # Маска лежит рядом с исходником: <timestamp>_m_<uuid>.<ext>
+                timestamp, _, rest = filename.partition('_')
+                mask_path = os.path.join(root, f"{timestamp}_m_{rest}")
+                if not os.path.exists(mask_path):
+                    continue
+
+                image = Image.open(os.path.join(root, filename)).convert("RGB")
+                mask = Image.open(mask_path).convert("L")
+                scale = max_side / max(image.size)
+                if scale < 1:
+                    size = (int(image.width * scale), int(image.height * scale))
+                    image = image.resize(size, Image.BICUBIC)
+                    mask = mask.resize(size, Image.NEAREST)
+
+                samples.append((np.array(image), np.array(mask)))
+                if len(samples) >= limit:
+                    return samples
+        return samples
+
+    def _generator_inputs(self, image: np.ndarray, mask: np.ndarray):
+        inpainter = Inpainter(generator=self.generator, image=image, mask=mask)
+        inpainter.device = torch.device('cpu')
+        image_tensor, mask_tensor = inpainter.prepare_inputs()
+        return inpainter.build_generator_input(image_tensor, mask_tensor), mask_tensor
+
+    def quantize_int8(self) -> nn.Module:
+        example_inputs = self._generator_inputs(*self.samples[0])
+        prepared = prepare_fx(copy.deepcopy(self.generator), get_default_qconfig_mapping("x86"), example_inputs)
+
+        # Калибровка: наблюдатели собирают диапазоны активаций на реальных фото
+        with torch.inference_mode():
+            for image, mask in self.samples:
+                prepared(*self._generator_inputs(image, mask))
+        return convert_fx(prepared).eval()
+
+    def convert_bf16(self) -> nn.Module:
+        return PrecisionGenerator(copy.deepcopy(self.generator), torch.bfloat16).eval()
+
+    def save(self, model: nn.Module, precision: str, save_path: str) -> None:
+        save_path = Path(save_path)
+        save_path.parent.mkdir(parents=True, exist_ok=True)
+        if precision == 'int8':
+            torch.save({'precision': precision, 'model': model}, save_path)
+        else:
+            torch.save({'precision': precision, 'state_dict': model.generator.state_dict()}, save_path)
+
+    def _run(self, generator: nn.Module, image: np.ndarray, mask: np.ndarray):
+        inpainter = Inpainter(generator=generator, image=image, mask=mask)
+        inpainter.device = torch.device('cpu')
+        start_time = time.perf_counter()
+        result = inpainter.inpaint()
+        return T.ToTensor()(result).unsqueeze(0), time.perf_counter() - start_time
+
+    def report(self, quantized: nn.Module) -> dict:
+        psnr, ssim, fp32_latency, quantized_latency = [], [], [], []
+        for image, mask in self.samples:
+            reference, reference_time = self._run(self.generator, image, mask)
+            output, output_time = self._run(quantized, image, mask)
+            mask_tensor = T.ToTensor()(mask).unsqueeze(0).gt(0.5).float()
+
+            psnr.append(Metrics.psnr_score(output, reference, mask_tensor).item())
+            ssim.append(Metrics.ssim_score(output, reference, mask_tensor).item())
+            fp32_latency.append(reference_time)
+            quantized_latency.append(output_time)
+
+        return {
+            'samples': len(self.samples),
+            'psnr_vs_fp32': float(np.mean(psnr)),
+            'ssim_vs_fp32': float(np.mean(ssim)),
+            'fp32_latency_ms': float(np.mean(fp32_latency) * 1000),
+            'quantized_latency_ms': float(np.mean(quantized_latency) * 1000),
+            'speedup': float(np.mean(fp32_latency) / np.mean(quantized_latency))
+        }
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    model_manager = ModelManager(args.config, ml_settings=ml_settings)
+    quantizer = GeneratorQuantizer(model_manager.load_torch_model(args.model), args.data, args.samples, args.max_side)
+
+    if args.precision == 'int8':
+        quantized_model = quantizer.quantize_int8()
+    else:
+        quantized_model = quantizer.convert_bf16()
+    quantizer.save(quantized_model, args.precision, args.output)
+
+    report = quantizer.report(quantized_model)
+    report['precision'] = args.precision
+    print(json.dumps(report, indent=4))
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
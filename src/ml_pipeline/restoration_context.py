@@ -0,0 +1,191 @@
+import io
+import os
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Optional
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from src.utils.mask_codec import MASK_EXTENSION, decode_packed, encode_packed
+from src.utils.metrics import metrics
+
+if TYPE_CHECKING:
+    import torch
+
+OVERLAY_COLOR = np.array([255, 56, 56], dtype=np.uint8)
+
+
+def render_overlay(image: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    # Найденные дефекты подсвечиваются полупрозрачной заливкой поверх исходного изображения
+    overlay = image.copy()
+    overlay[mask] = (overlay[mask] * 0.5 + OVERLAY_COLOR * 0.5).astype(np.uint8)
+    return overlay
+
+
+def artifact_path(folder: str, kind: str, filename: str) -> str:
+    # Маска хранится без потерь в .msk, остальные артефакты - с расширением загруженного файла
+    if kind == "masked":
+        filename = os.path.splitext(filename)[0] + MASK_EXTENSION
+    return os.path.join(folder, kind, filename)
+
+
+@dataclass
+class RestorationContext:
+    """Состояние одного запроса на всем пути decode -> segment -> inpaint -> persist.
+
+    Изображение декодируется один раз, маска передается генератору тензором без промежуточных
+    файлов, а визуализация сегментации и маска кодируются только когда их запросили или сохраняют.
+    """
+    filename: str
+    source_bytes: bytes
+    image: np.ndarray
+    mask: Optional["torch.Tensor"] = None
+    result: Optional[np.ndarray] = None
+    from_cache: bool = False
+    model_versions: Optional[list] = None
+    _segmented: Optional[np.ndarray] = field(default=None, repr=False)
+    _packed_mask: Optional[np.ndarray] = field(default=None, repr=False)
+    _mask_shape: Optional[tuple] = field(default=None, repr=False)
+
+    @classmethod
+    def from_bytes(cls, filename: str, source_bytes: bytes) -> "RestorationContext":
+        with Image.open(io.BytesIO(source_bytes)) as image:
+            image_np = np.array(image.convert('RGB'))
+        return cls(filename=filename, source_bytes=source_bytes, image=image_np)
+
+    @classmethod
+    def from_files(cls, filename: str, folder: str) -> "RestorationContext":
+        # Результат, сохраненный другим процессом: исходник, итог и маска, сегментация - если есть
+        with open(os.path.join(folder, "defected", filename), "rb") as f:
+            context = cls.from_bytes(filename, f.read())
+        with Image.open(os.path.join(folder, "fixed", filename)) as image:
+            context.result = np.array(image.convert('RGB'))
+        mask_path = artifact_path(folder, "masked", filename)
+        if os.path.exists(mask_path):
+            with open(mask_path, "rb") as f:
+                context.load_mask_bytes(f.read())
+        else:
+            # Маски, сохраненные до перехода на .msk, лежат изображением
+            with Image.open(os.path.join(folder, "masked", filename)) as image:
+                context.load_mask_array(np.array(image.convert('L')) > 127)
+
+        segmented_path = os.path.join(folder, "segmented", filename)
+        if os.path.exists(segmented_path):
+            with Image.open(segmented_path) as image:
+                context.segmented = np.array(image.convert('RGB'))
+        return context
+
+    def compact(self) -> None:
+        # После инпейнтинга маска нужна только для отображения и сохранения - храним ее по биту на пиксель
+        if self.mask is not None:
+            self._mask_shape = tuple(self.mask.shape)
+            self._packed_mask = np.packbits(self.mask.numpy())
+            self.mask = None
+
+    def mask_bytes(self) -> bytes:
+        self.compact()
+        return encode_packed(self._packed_mask, self._mask_shape)
+
+    def load_mask_array(self, mask: np.ndarray) -> None:
+        self._mask_shape = tuple(mask.shape)
+        self._packed_mask = np.packbits(mask)
+        self.mask = None
+
+    def load_mask_bytes(self, data: bytes) -> None:
+        self._packed_mask, self._mask_shape = decode_packed(data)
+        self.mask = None
+
+    def result_payload(self) -> dict:
+        # Результат инференса для передачи между процессами: маска уже упакована по биту на пиксель
+        self.compact()
+        return {
+            "result": self.result,
+            "packed_mask": self._packed_mask,
+            "mask_shape": self._mask_shape,
+            "model_versions": self.model_versions
+        }
+
+    def load_result_payload(self, payload: dict) -> None:
+        self.result = payload["result"]
+        self._packed_mask = payload["packed_mask"]
+        self._mask_shape = payload["mask_shape"]
+        self.model_versions = payload["model_versions"]
+        self.mask = None
+
+    @property
+    def mask_bool(self) -> np.ndarray:
+        if self.mask is not None:
+            # numpy() у CPU-тензора разделяет память с маской
+            return self.mask.numpy()
+        count = self._mask_shape[0] * self._mask_shape[1]
+        return np.unpackbits(self._packed_mask, count=count).reshape(self._mask_shape).astype(bool)
+
+    @property
+    def mask_array(self) -> np.ndarray:
+        return self.mask_bool.astype(np.uint8) * 255
+
+    @property
+    def segmented(self) -> np.ndarray:
+        if self._segmented is None:
+            # Визуализация строится из упакованной маски одинаково для свежего результата, кэша и сервера инференса
+            self._segmented = render_overlay(self.image, self.mask_bool)
+        return self._segmented
+
+    @segmented.setter
+    def segmented(self, value: Optional[np.ndarray]) -> None:
+        self._segmented = value
+
+    @property
+    def has_segmented(self) -> bool:
+        return self._segmented is not None
+
+    @property
+    def original_image(self) -> Image.Image:
+        return Image.fromarray(self.image)
+
+    @property
+    def segmented_image(self) -> Image.Image:
+        return Image.fromarray(self.segmented)
+
+    @property
+    def masked_image(self) -> Image.Image:
+        return Image.fromarray(self.mask_array)
+
+    @property
+    def result_image(self) -> Image.Image:
+        return Image.fromarray(self.result)
+
+    def persist(self, folder: str) -> None:
+        for subfolder in ("defected", "fixed"):
+            os.makedirs(os.path.join(folder, subfolder), exist_ok=True)
+
+        # Исходный файл сохраняется байтами загрузки, без повторного декодирования и кодирования
+        self._write_bytes(os.path.join(folder, "defected", self.filename), self.source_bytes)
+        self._write_image(os.path.join(folder, "fixed", self.filename), cv2.cvtColor(self.result, cv2.COLOR_RGB2BGR))
+
+    def persist_steps(self, folder: str) -> None:
+        segmented_path = artifact_path(folder, "segmented", self.filename)
+        masked_path = artifact_path(folder, "masked", self.filename)
+        if os.path.exists(segmented_path) and os.path.exists(masked_path):
+            return
+
+        for subfolder in ("masked", "segmented"):
+            os.makedirs(os.path.join(folder, subfolder), exist_ok=True)
+        self._write_image(segmented_path, cv2.cvtColor(self.segmented, cv2.COLOR_RGB2BGR))
+        with metrics.timer("encode"):
+            mask_bytes = self.mask_bytes()
+        self._write_bytes(masked_path, mask_bytes)
+
+    def _write_image(self, path: str, image: np.ndarray) -> None:
+        with metrics.timer("encode"):
+            _, buffer = cv2.imencode(os.path.splitext(path)[1], image)
+        self._write_bytes(path, buffer.tobytes())
+
+    def _write_bytes(self, path: str, data: bytes) -> None:
+        # Запись в новый файл с заменой: сохраненный результат может быть жесткой ссылкой на прежний файл
+        tmp_path = f"{path}.tmp"
+        with metrics.timer("disk_write"):
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
@@ -0,0 +1,57 @@
+import argparse
+import os
+from pathlib import Path
+
+import torch
+
+from src.ml_pipeline.model_manager import ModelManager
+from src.settings.ml_settings import ml_settings
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--config', type=str, default="src/settings/models_config.json", help="Path to models config")
+parser.add_argument('--model', type=str, default="gan", help="Generator entry in models config")
+parser.add_argument('--version', type=str, default=None, help="Model version, the active one by default")
+parser.add_argument('--format', type=str, default="pt", choices=["pt", "safetensors"], help="Output weights format")
+parser.add_argument('--output', type=str, required=True, help="Path for the converted weights")
+
+
+class WeightsConverter:
+    """Пересохраняет чекпоинт генератора в виде, пригодном для загрузки через mmap."""
+
+    def __init__(self, model_manager: ModelManager):
+        self.model_manager = model_manager
+
+    def convert(self, model_name: str, save_path: str, weights_format: str = "pt", version: str = None) -> Path:
+        config = self.model_manager._version_config(model_name, version)
+        if self.model_manager._is_yolo(model_name, config):
+            raise ValueError(f"Модель '{model_name}' загружается ultralytics, ее веса не конвертируются")
+        if config.get('precision', 'fp32') == 'int8':
+            raise ValueError(f"Квантованный граф '{model_name}' хранится целиком и не конвертируется")
+
+        checkpoint = torch.load(config['model_path'], map_location='cpu')
+        state_dict = ModelManager.extract_state_dict(checkpoint)
+
+        # В файл попадают только веса генератора: без дискриминатора и состояния оптимизатора,
+        # каждый тензор в своем непрерывном хранилище
+        state_dict = {key: tensor.detach().contiguous().clone() for key, tensor in state_dict.items()}
+
+        save_path = Path(save_path)
+        save_path.parent.mkdir(parents=True, exist_ok=True)
+        if weights_format == 'safetensors':
+            try:
+                from safetensors.torch import save_file
+            except ImportError as e:
+                raise ImportError(f"Для формата safetensors требуется пакет safetensors: {str(e)}")
+            save_file(state_dict, str(save_path))
+        else:
+            torch.save(state_dict, save_path)
+        return save_path
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    converter = WeightsConverter(ModelManager(args.config, ml_settings=ml_settings))
+    source_path = converter.model_manager._version_config(args.model, args.version)['model_path']
+    output = converter.convert(args.model, args.output, args.format, args.version)
+    print(f"Веса '{args.model}' сохранены в {output}: "
+          f"{os.path.getsize(source_path) / 2 ** 20:.1f} MB -> {os.path.getsize(output) / 2 ** 20:.1f} MB")
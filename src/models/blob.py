@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, func
+
+from src.models.base import Base
+
+
+class Blob(Base):
+    __tablename__ = 'blobs'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    hash = Column(String(64), unique=True, nullable=False)
+    extension = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+
+    def __repr__(self):
+        return f"<Blob(hash={self.hash}, ref_count={self.ref_count})>"
@@ -15,6 +15,12 @@ class Image(Base):
     fixed_path = Column(String, nullable=False)
     masked_path = Column(String, nullable=False)
     segmented_path = Column(String, nullable=False)
+    defected_hash = Column(String(64), nullable=True)
+    fixed_hash = Column(String(64), nullable=True)
+    masked_hash = Column(String(64), nullable=True)
+    segmented_hash = Column(String(64), nullable=True)
+    thumbnail_small_path = Column(String, nullable=True)
+    thumbnail_medium_path = Column(String, nullable=True)
 
     user = relationship("User", back_populates="images")
 
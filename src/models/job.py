@@ -0,0 +1,39 @@
+from sqlalchemy import Column, Integer, Boolean, String, ForeignKey, DateTime, Index, func
+from sqlalchemy.orm import relationship
+
+from src.models.base import Base
+
+
+class Job(Base):
+    __tablename__ = 'jobs'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    status = Column(String, nullable=False, default='queued')
+    priority = Column(Integer, nullable=False, default=0)
+    stage = Column(String, nullable=True)
+    filename = Column(String, nullable=False)
+    source_path = Column(String, nullable=False)
+    upload_folder = Column(String, nullable=False)
+    fixed_path = Column(String, nullable=True)
+    masked_path = Column(String, nullable=True)
+    segmented_path = Column(String, nullable=True)
+    from_cache = Column(Boolean, default=False)
+    charge_attempt = Column(Boolean, nullable=False, default=False)
+    error = Column(String, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    worker_id = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+    finished_at = Column(DateTime, nullable=True)
+
+    user = relationship("User")
+
+    __table_args__ = (
+        Index('ix_jobs_status_created_at', 'status', 'created_at'),
+        Index('ix_jobs_status_priority_created_at', 'status', 'priority', 'created_at'),
+    )
+
+    def __repr__(self):
+        return f"<Job(id={self.id}, user_id={self.user_id}, status={self.status})>"
@@ -19,8 +19,8 @@ class AccountPage(BasePage):
         self.injection_handler = AccountInjectionHandler()
 
     def build_header(self):
-        logo_base64 = self.ui_utils.get_image_base64(self.logo_path)
-        self.injection_handler.header_injection(st, logo_base64)
+        logo_src = self.ui_utils.get_image_src(self.logo_path)
+        self.injection_handler.header_injection(st, logo_src)
 
 
     def build_content(self, user_info: User):
@@ -25,8 +25,8 @@ class AuthPage(BasePage):
             st.stop()
 
     def build_header(self):
-        logo_base64 = self.ui_utils.get_image_base64(self.logo_path)
-        self.injection_handler.header_injection(st, logo_base64)
+        logo_src = self.ui_utils.get_image_src(self.logo_path)
+        self.injection_handler.header_injection(st, logo_src)
 
     def login_widget(self) -> None:
         if not st.session_state['LOGGED_IN']:
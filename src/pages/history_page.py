@@ -1,7 +1,6 @@
 import io
 
 import streamlit as st
-import base64
 from pathlib import Path
 
 from src.pages.auth_page import AuthPage
@@ -35,8 +34,8 @@ class HistoryPage(BasePage):
         st.query_params.update(**params)
 
     def build_header(self):
-        logo_base64 = self.ui_utils.get_image_base64(self.logo_path)
-        self.injection_handler.header_injection(st, logo_base64)
+        logo_src = self.ui_utils.get_image_src(self.logo_path)
+        self.injection_handler.header_injection(st, logo_src)
 
     def render_image_view(self, item):
         st.markdown('<div class="image-view-content">', unsafe_allow_html=True)
@@ -123,6 +122,19 @@ class HistoryPage(BasePage):
         st.markdown('</div>', unsafe_allow_html=True)
         st.markdown('</div>', unsafe_allow_html=True)
 
+    def render_thumbnail(self, item, size_name: str):
+        # В галерею встраиваются только миниатюры, полное изображение загружается в render_image_view
+        thumbnail_path = self.history_service.get_thumbnail_path(item, size_name)
+        if thumbnail_path:
+            # Ссылка подписана для владельца изображения: чужой пользователь по ней файл не получит
+            image_src = self.ui_utils.get_image_src(thumbnail_path, item.user_id)
+            st.markdown(
+                f"<img src='{image_src}' width='100%' style='border-radius: 8px;'/>",
+                unsafe_allow_html=True
+            )
+        else:
+            st.warning("Изображение не найдено.")
+
     def build_content(self):
         st.markdown('<div class="main-content">', unsafe_allow_html=True)
 
@@ -149,16 +161,7 @@ class HistoryPage(BasePage):
                         self.liked_states[item_id] = item.is_liked
 
                     with row[j]:
-                        img_path = Path(item.fixed_path)
-                        if img_path.exists():
-                            with open(img_path, "rb") as img_file:
-                                encoded = base64.b64encode(img_file.read()).decode()
-                            st.markdown(
-                                f"<img src='data:image/png;base64,{encoded}' width='100%' style='border-radius: 8px;'/>",
-                                unsafe_allow_html=True
-                            )
-                        else:
-                            st.warning("Изображение не найдено.")
+                        self.render_thumbnail(item, "medium")
 
                         st.markdown(
                             f"<div style='margin-top: 10px; font-size: 20px; font-weight: bold; text-align: center;'>{item.fix_datetime}</div>",
@@ -188,16 +191,7 @@ class HistoryPage(BasePage):
                         self.liked_states[item_id] = item.is_liked
 
                     with row[j]:
-                        img_path = Path(item.fixed_path)
-                        if img_path.exists():
-                            with open(img_path, "rb") as img_file:
-                                encoded = base64.b64encode(img_file.read()).decode()
-                            st.markdown(
-                                f"<img src='data:image/png;base64,{encoded}' width='100%' style='border-radius: 8px;'/>",
-                                unsafe_allow_html=True
-                            )
-                        else:
-                            st.warning("Изображение не найдено.")
+                        self.render_thumbnail(item, "small")
 
                         st.markdown(
                             f"<div style='margin-top: 10px; font-size: 20px; font-weight: bold; text-align: center;'>{item.fix_datetime}</div>",
@@ -91,7 +91,7 @@ class AccountInjectionHandler(BaseInjectionHandler):
             </style>
 
             <div class="custom-header">
-                <img src="data:image/png;base64,{logo}" alt="Logo" />
+                <img src="{logo}" alt="Logo" />
                 <div class="header-buttons">
                     <a href="/" target="_self">Главная</a>
                     <a href="/?page=history" target="_self">История</a>
@@ -56,7 +56,7 @@ class AuthInjectionHandler(BaseInjectionHandler):
             </style>
 
             <div class="custom-header">
-                <img src="data:image/png;base64,{logo}" alt="Logo" />
+                <img src="{logo}" alt="Logo" />
                 <div class="header-buttons">
                     <a href="/?auth=login" target="_self" {'class="active"' if st.query_params.get('auth') == 'login' else ''}>Вход</a>
                     <a href="/?auth=signup" target="_self" {'class="active"' if st.query_params.get('auth') == 'signup' else ''}>Создать аккаунт</a>
@@ -53,7 +53,7 @@ class MainInjectionHandler(BaseInjectionHandler):
             </style>
 
             <div class="custom-header">
-                <img src="data:image/png;base64,{logo}" alt="Logo" />
+                <img src="{logo}" alt="Logo" />
                 <div class="header-buttons">
                     <a href="/" target="_self">Главная</a>
                     <a href="/?page=history" target="_self">История</a>
@@ -144,7 +144,7 @@ class MainInjectionHandler(BaseInjectionHandler):
     def arrow_injection(self, st, image):
         st.markdown(f"""
         <div style='margin: 30px 0; display: flex; justify-content: center;'>
-            <img src="data:image/png;base64,{image}" style='height: 75px;' />
+            <img src="{image}" style='height: 75px;' />
         </div>
         """, unsafe_allow_html=True)
 
@@ -152,7 +152,7 @@ class MainInjectionHandler(BaseInjectionHandler):
         st.markdown(f"""
             <div style='width: 700px; height: 250px; background-color: #f3f3f3; border-radius: 12px; display: flex; overflow: hidden; box-shadow: 0 4px 10px rgba(0,0,0,0.1);'>
                 <div style='flex: 5;'>
-                    <img src="data:image/png;base64,{image}" style='height: 100%; width: 100%; object-fit: cover;' />
+                    <img src="{image}" style='height: 100%; width: 100%; object-fit: cover;' />
                 </div>
                 <div style='flex: 8; padding: 20px; display: flex; align-items: center; justify-content: center;'>
                     <p style='font-size: 18px; color: #222; text-align: center;'>
@@ -171,7 +171,7 @@ class MainInjectionHandler(BaseInjectionHandler):
                     </p>
                 </div>
                 <div style='flex: 5;'>
-                    <img src="data:image/png;base64,{image}" style='height: 100%; width: 100%; object-fit: cover;' />
+                    <img src="{image}" style='height: 100%; width: 100%; object-fit: cover;' />
                 </div>
             </div>
             """, unsafe_allow_html=True)
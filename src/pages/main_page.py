@@ -8,13 +8,37 @@ from src.models.user import User
 from src.pages.auth_page import AuthPage
 from src.pages.base_page import BasePage
 from src.pages.html_jnjection_handlers.main_handler import MainInjectionHandler
+from src.ml_pipeline.priorities import AdmissionError
 from src.services.account_service import AccountService
+from src.services.batch_service import BatchService
+from src.services.job_service import create_job_service
 from src.services.main_service import MainService
 from src.utils.logger import logger
+from src.utils.temp_collector import temp_collector
 from src.utils.ui import UserInterfaceUtils
 
 
+STAGE_LABELS = {
+    None: "Ожидание в очереди...",
+    "decode": "Чтение изображения...",
+    "segment": "Поиск дефектов...",
+    "mask": "Построение маски...",
+    "inpaint": "Удаление дефектов...",
+    "persist": "Сохранение результата..."
+}
+WARMUP_LABEL = "Подготовка моделей после запуска сервиса..."
+BATCH_STATUS_LABELS = {
+    "queued": "В очереди",
+    "running": "Обработка",
+    "done": "Готово",
+    "failed": "Ошибка",
+    "skipped": "Пропущено"
+}
+
+
 class MainPage(BasePage):
+    job_poll_interval = 1
+
     def __init__(self, auth: AuthPage, paths: dict):
         self.temp_folder = paths["temp_folder"]
         self.upload_folder = paths["upload_folder"]
@@ -27,29 +51,44 @@ class MainPage(BasePage):
 
         self.ui_utils = UserInterfaceUtils()
         self.main_service = MainService()
+        self.job_service = create_job_service(self.main_service)
+        self.batch_service = BatchService(self.main_service)
         self.account_service = AccountService()
         self.injection_handler = MainInjectionHandler()
 
         self.auth = auth
         os.makedirs(self.upload_folder, exist_ok=True)
+        temp_collector.start(self.temp_folder)
 
     def setup_session_state(self):
         for key, default in {
             "state": "initial",
+            "job_id": None,
+            "batch_id": None,
         }.items():
             if key not in st.session_state:
                 st.session_state[key] = default
 
     def build_header(self):
-        logo_base64 = self.ui_utils.get_image_base64(self.logo_path)
-        self.injection_handler.header_injection(st, logo_base64)
+        logo_src = self.ui_utils.get_image_src(self.logo_path)
+        self.injection_handler.header_injection(st, logo_src)
 
     def reset_app(self):
+        if st.session_state.job_id:
+            self.job_service.discard(st.session_state.job_id)
+            st.session_state.job_id = None
         self.main_service.delete_temp_image(self.temp_folder, st.session_state["filename"])
         st.session_state.state = "initial"
         st.session_state.uploaded_image = None
         st.session_state.original_image = None
         st.session_state.result_image = None
+        st.session_state.restoration_context = None
+
+    def reset_batch(self):
+        if st.session_state.batch_id:
+            self.batch_service.discard(st.session_state.batch_id)
+            st.session_state.batch_id = None
+        st.session_state.state = "initial"
 
     def process_image(self):
         st.session_state.state = "processing"
@@ -73,8 +112,14 @@ class MainPage(BasePage):
                 st.session_state.uploaded_image = uploaded_file
                 st.session_state.state = "uploaded"
                 st.rerun()
+            self.build_batch_upload(user_info, free_uses, is_subscription_active)
+
+        elif st.session_state.state == "batch":
+            self.build_batch_progress(user_info)
 
         elif st.session_state.state == "uploaded":
+            if st.session_state.get("processing_error"):
+                st.error(f"Не удалось обработать изображение: {st.session_state.pop('processing_error')}")
             st.image(st.session_state.uploaded_image, use_container_width=True)
             col1, col2 = st.columns(2)
             with col1:
@@ -83,48 +128,53 @@ class MainPage(BasePage):
                 st.button("Начать обработку", on_click=self.process_image)
 
         elif st.session_state.state == "processing":
-            if free_uses > 0 or is_subscription_active:
-                if free_uses > 0:
-                    self.main_service.decrease_attempts_count(user_info.id)
-
-                st.markdown(
-                    """
-                    <div style='padding: 15px; background-color: #ff6600; color: white; border-radius: 8px; font-size: 18px; text-align: center;'>🚀 Обработка изображения...</div>
-                    """,
-                    unsafe_allow_html=True
-                )
-
-                filename = self.main_service.generate_unique_filename(st.session_state.uploaded_image.name)
-                st.session_state["filename"] = filename
-                self.main_service.handle_processing(st, self.temp_folder, filename)
-                if not st.session_state["show_steps"]:
-                    st.session_state.state = "processed"
+            if not st.session_state.job_id:
+                if free_uses > 0 or is_subscription_active:
+                    filename = self.main_service.generate_unique_filename(st.session_state.uploaded_image.name)
+                    st.session_state["filename"] = filename
+                    try:
+                        st.session_state.job_id = self.job_service.submit(
+                            user_info.id,
+                            st.session_state.uploaded_image.getvalue(),
+                            self.temp_folder,
+                            filename,
+                            priority=self.account_service.get_inference_priority(user_info),
+                            # То же правило, что и для пакета: подписчики попытки не тратят
+                            charge_attempt=not is_subscription_active
+                        )
+                    except AdmissionError as e:
+                        logger.info(f"User (id={user_info.id}) processing rejected by admission control: {e}")
+                        st.session_state.processing_error = str(e)
+                        st.session_state.state = "uploaded"
+                        st.rerun()
                 else:
-                    st.session_state.state = "processed_with_steps"
-                logger.debug(f"User (id={user_info.id}) successfully processed image")
-                st.rerun()
-            else:
-                st.error("У вас закончились бесплатные попытки, купите подписку")
-                logger.debug(f"User (id={user_info.id}) tried to process without permissions")
+                    st.error("У вас закончились бесплатные попытки, купите подписку")
+                    logger.debug(f"User (id={user_info.id}) tried to process without permissions")
+
+            if st.session_state.job_id:
+                self.build_job_progress(user_info, free_uses)
 
         elif st.session_state.state == "processed" or st.session_state.state == "processed_with_steps":
             st.markdown("<h3 style='text-align:center;'>Результат обработки:</h3>", unsafe_allow_html=True)
             if st.session_state.state == "processed_with_steps":
+                context = st.session_state.restoration_context
+                segmented_image = context.segmented_image
+                masked_image = context.masked_image
                 st.markdown("<h4 style='text-align:center;'>Сегментация изображения:</h4>", unsafe_allow_html=True)
                 image_comparison(
                     img1=Image.open(st.session_state.original_image),
-                    img2=st.session_state.segmented_image,
+                    img2=segmented_image,
                     label1="До", label2="После"
                 )
                 st.markdown("<h4 style='text-align:center;'>Маска изображения:</h4>", unsafe_allow_html=True)
                 image_comparison(
-                    img1=st.session_state.segmented_image,
-                    img2=st.session_state.masked_image,
+                    img1=segmented_image,
+                    img2=masked_image,
                     label1="До", label2="После"
                 )
                 st.markdown("<h4 style='text-align:center;'>Удаление найденных дефектов:</h4>", unsafe_allow_html=True)
                 image_comparison(
-                    img1=st.session_state.masked_image,
+                    img1=masked_image,
                     img2=st.session_state.result_image,
                     label1="До", label2="После"
                 )
@@ -138,12 +188,14 @@ class MainPage(BasePage):
             col1, col2 = st.columns(2)
             with col1:
                 if st.button("💾 Сохранить результат"):
-                    self.main_service.add_image(user_info.id, False, self.temp_folder, self.upload_folder, st.session_state["filename"])
+                    self.main_service.add_image(user_info.id, False, self.temp_folder, self.upload_folder, st.session_state["filename"],
+                                                st.session_state.restoration_context)
                     logger.info(f"User (id={user_info.id}) save image successfully")
                     st.success("Изображение сохранено")
             with col2:
                 if st.button("⭐ Добавить в понравившиеся"):
-                    self.main_service.add_image(user_info.id, True, self.temp_folder, self.upload_folder, st.session_state["filename"])
+                    self.main_service.add_image(user_info.id, True, self.temp_folder, self.upload_folder, st.session_state["filename"],
+                                                st.session_state.restoration_context)
                     logger.info(f"User (id={user_info.id}) save image as 'liked' successfully")
                     st.success("Изображение сохранено")
 
@@ -153,12 +205,111 @@ class MainPage(BasePage):
 
         self.build_description_and_faq()
 
+    @st.fragment(run_every=job_poll_interval)
+    def build_job_progress(self, user_info: User, free_uses: int):
+        job = self.job_service.get(st.session_state.job_id)
+        if job is None:
+            st.session_state.job_id = None
+            st.session_state.state = "uploaded"
+            st.rerun()
+
+        st.markdown(
+            """
+            <div style='padding: 15px; background-color: #ff6600; color: white; border-radius: 8px; font-size: 18px; text-align: center;'>🚀 Обработка изображения...</div>
+            """,
+            unsafe_allow_html=True
+        )
+        label = STAGE_LABELS.get(job.stage, STAGE_LABELS[None])
+        if job.stage in (None, "segment") and not self.main_service.is_ready():
+            label = WARMUP_LABEL
+        st.progress(job.progress, text=label)
+
+        if job.is_finished:
+            self.job_service.discard(job.id)
+            st.session_state.job_id = None
+
+            if job.status == "done":
+                self.main_service.apply_result(st, job.result)
+                if not st.session_state["show_steps"]:
+                    st.session_state.state = "processed"
+                else:
+                    st.session_state.state = "processed_with_steps"
+                logger.debug(f"User (id={user_info.id}) successfully processed image")
+            else:
+                st.session_state.processing_error = job.error
+                st.session_state.state = "uploaded"
+            st.rerun()
+
+    def build_batch_upload(self, user_info: User, free_uses: int, is_subscription_active: bool):
+        with st.expander("Пакетная обработка: несколько изображений или ZIP-архив"):
+            if st.session_state.get("batch_error"):
+                st.error(st.session_state.pop("batch_error"))
+            uploaded_files = st.file_uploader("", type=["jpg", "jpeg", "png", "zip"], accept_multiple_files=True,
+                                              key="batch_files")
+            if uploaded_files and st.button("Обработать пакет"):
+                if free_uses <= 0 and not is_subscription_active:
+                    st.error("У вас закончились бесплатные попытки, купите подписку")
+                    return
+                try:
+                    st.session_state.batch_id = self.batch_service.submit(
+                        user_info.id,
+                        uploaded_files,
+                        self.temp_folder,
+                        priority=self.account_service.get_inference_priority(user_info),
+                        # Подписчики не ограничены, бесплатным пользователям обрабатывается не больше остатка попыток
+                        attempts_limit=None if is_subscription_active else free_uses
+                    )
+                except ValueError as e:
+                    st.session_state.batch_error = str(e)
+                    st.rerun()
+                st.session_state.state = "batch"
+                st.rerun()
+
+    @st.fragment(run_every=job_poll_interval)
+    def build_batch_progress(self, user_info: User):
+        batch = self.batch_service.get(st.session_state.batch_id)
+        if batch is None:
+            st.session_state.batch_id = None
+            st.session_state.state = "initial"
+            st.rerun()
+
+        done, total = batch.count("done"), len(batch.items)
+        label = f"Обработано {batch.finished_count} из {total}"
+        if not batch.is_finished and not self.main_service.is_ready():
+            label = WARMUP_LABEL
+        st.progress(batch.progress, text=label)
+        st.dataframe(
+            [{"Файл": item.name,
+              "Статус": BATCH_STATUS_LABELS[item.status],
+              "Этап": STAGE_LABELS.get(item.stage, "") if item.status == "running" else "",
+              "Комментарий": item.error or ("из кэша" if item.from_cache else "")}
+             for item in batch.items],
+            use_container_width=True, hide_index=True
+        )
+
+        if not batch.is_finished:
+            if not batch.cancelled:
+                st.button("Отменить", on_click=self.batch_service.cancel, args=(batch.id,))
+            return
+
+        if done:
+            with open(batch.archive_path, "rb") as archive:
+                st.download_button(f"📦 Скачать результаты ({done})", archive, file_name="flawless_results.zip",
+                                   mime="application/zip")
+            if st.button("💾 Сохранить результаты в историю"):
+                for item in batch.items:
+                    if item.status == "done":
+                        self.main_service.add_image(user_info.id, False, batch.folder, self.upload_folder, item.filename)
+                logger.info(f"User (id={user_info.id}) saved {done} images of batch {batch.id}")
+                st.success("Изображения сохранены")
+        st.button("🔙 Вернуться", on_click=self.reset_batch)
+
     def build_description_and_faq(self):
-        example1 = self.ui_utils.get_image_base64(self.example1_img_path)
-        example2 = self.ui_utils.get_image_base64(self.example2_img_path)
-        example3 = self.ui_utils.get_image_base64(self.example3_img_path)
-        left = self.ui_utils.get_image_base64(self.arrow_left_path)
-        right = self.ui_utils.get_image_base64(self.arrow_right_path)
+        example1 = self.ui_utils.get_image_src(self.example1_img_path)
+        example2 = self.ui_utils.get_image_src(self.example2_img_path)
+        example3 = self.ui_utils.get_image_src(self.example3_img_path)
+        left = self.ui_utils.get_image_src(self.arrow_left_path)
+        right = self.ui_utils.get_image_src(self.arrow_right_path)
 
         st.markdown("<div style='display: flex; flex-direction: column; align-items: center;  margin-top: 150px;'>", unsafe_allow_html=True)
         st.markdown("<h4 style='text-align:center;'>Процесс обработки изображений:</h4>", unsafe_allow_html=True)
@@ -0,0 +1,51 @@
+from typing import Optional
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from src.models.blob import Blob
+
+
+class BlobRepository:
+    """Счетчики ссылок на файлы хранилища. Методы не фиксируют транзакцию: это делает вызывающий вместе со строкой Image."""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def _lock_hash(self, digest: str) -> None:
+        # Блокировка по хэшу держится до конца транзакции: запись файла при сохранении
+        # и его удаление после фиксации удаления строки не пересекаются
+        self.db.execute(select(func.pg_advisory_xact_lock(func.hashtext(digest))))
+
+    def acquire(self, digest: str, extension: str, size: int) -> str:
+        self._lock_hash(digest)
+        # Повторная загрузка того же содержимого только увеличивает счетчик и получает расширение первого файла
+        statement = insert(Blob).values(hash=digest, extension=extension, size=size, ref_count=1)
+        statement = statement.on_conflict_do_update(
+            index_elements=[Blob.hash],
+            set_={"ref_count": Blob.ref_count + 1}
+        ).returning(Blob.extension)
+        return self.db.execute(statement).scalar_one()
+
+    def release(self, digest: str) -> bool:
+        # True - ссылок больше нет и строка удалена. Файл удаляется только после фиксации транзакции
+        # и если is_orphaned подтвердит, что то же содержимое за это время не сохранили заново
+        ref_count = self.db.execute(
+            update(Blob).where(Blob.hash == digest).values(ref_count=Blob.ref_count - 1).returning(Blob.ref_count)
+        ).scalar_one_or_none()
+        if ref_count is None or ref_count > 0:
+            return False
+        deleted = self.db.execute(
+            delete(Blob).where(Blob.hash == digest, Blob.ref_count <= 0).returning(Blob.id)
+        ).scalar_one_or_none()
+        return deleted is not None
+
+    def is_orphaned(self, digest: str) -> bool:
+        # Под блокировкой хэша: параллельный acquire либо уже зафиксировал новую строку, либо ждет,
+        # и тогда запишет файл заново после его удаления
+        self._lock_hash(digest)
+        return self.get_blob(digest) is None
+
+    def get_blob(self, digest: str) -> Optional[Blob]:
+        return self.db.query(Blob).filter(Blob.hash == digest).first()
@@ -5,11 +5,16 @@ from sqlalchemy.orm import Session
 
 from src.entities.image import ImageDTO, ImageAddDTO
 from src.models.image import Image
+from src.repositories.blob_repository import BlobRepository
+from src.utils.logger import logger
+
+ARTIFACTS = ("defected", "fixed", "masked", "segmented")
 
 
 class ImageRepository:
     def __init__(self, db: Session):
         self.db = db
+        self.blob_repo = BlobRepository(db)
 
     def add_image(self, image_data: ImageAddDTO) -> ImageDTO:
         db_image = Image(
@@ -19,7 +24,13 @@ class ImageRepository:
             defected_path=image_data.defected_path,
             fixed_path=image_data.fixed_path,
             masked_path=image_data.masked_path,
-            segmented_path=image_data.segmented_path
+            segmented_path=image_data.segmented_path,
+            thumbnail_small_path=image_data.thumbnail_small_path,
+            thumbnail_medium_path=image_data.thumbnail_medium_path,
+            defected_hash=image_data.defected_hash,
+            fixed_hash=image_data.fixed_hash,
+            masked_hash=image_data.masked_hash,
+            segmented_hash=image_data.segmented_hash
         )
         self.db.add(db_image)
         self.db.commit()
@@ -33,7 +44,13 @@ class ImageRepository:
             defected_path=db_image.defected_path,
             fixed_path=db_image.fixed_path,
             masked_path=db_image.masked_path,
-            segmented_path=db_image.segmented_path
+            segmented_path=db_image.segmented_path,
+            thumbnail_small_path=db_image.thumbnail_small_path,
+            thumbnail_medium_path=db_image.thumbnail_medium_path,
+            defected_hash=db_image.defected_hash,
+            fixed_hash=db_image.fixed_hash,
+            masked_hash=db_image.masked_hash,
+            segmented_hash=db_image.segmented_hash
         )
 
     def get_image_by_id(self, image_id: int) -> Optional[ImageDTO]:
@@ -50,7 +67,13 @@ class ImageRepository:
             defected_path=db_image.defected_path,
             fixed_path=db_image.fixed_path,
             masked_path=db_image.masked_path,
-            segmented_path=db_image.segmented_path
+            segmented_path=db_image.segmented_path,
+            thumbnail_small_path=db_image.thumbnail_small_path,
+            thumbnail_medium_path=db_image.thumbnail_medium_path,
+            defected_hash=db_image.defected_hash,
+            fixed_hash=db_image.fixed_hash,
+            masked_hash=db_image.masked_hash,
+            segmented_hash=db_image.segmented_hash
         )
 
     def get_user_images(self, user_id: int) -> list[ImageDTO]:
@@ -65,7 +88,13 @@ class ImageRepository:
                 defected_path=image.defected_path,
                 fixed_path=image.fixed_path,
                 masked_path=image.masked_path,
-                segmented_path=image.segmented_path
+                segmented_path=image.segmented_path,
+                thumbnail_small_path=image.thumbnail_small_path,
+                thumbnail_medium_path=image.thumbnail_medium_path,
+                defected_hash=image.defected_hash,
+                fixed_hash=image.fixed_hash,
+                masked_hash=image.masked_hash,
+                segmented_hash=image.segmented_hash
             )
             for image in db_images
         ]
@@ -81,23 +110,53 @@ class ImageRepository:
 
         return db_image.is_liked
 
+    def set_thumbnails(self, image_id: int, thumbnail_small_path: str, thumbnail_medium_path: str) -> None:
+        db_image = self.db.query(Image).filter(Image.id == image_id).first()
+        if not db_image:
+            return
+
+        db_image.thumbnail_small_path = thumbnail_small_path
+        db_image.thumbnail_medium_path = thumbnail_medium_path
+        self.db.commit()
+
     def delete_image_by_id(self, image_id: int) -> bool:
         image = self.db.query(Image).filter(Image.id == image_id).first()
         if not image:
             return False
         try:
-            for file_path in [
-                image.defected_path,
-                image.fixed_path,
-                image.masked_path,
-                image.segmented_path
-            ]:
-                if file_path and os.path.exists(file_path):
-                    os.remove(file_path)
+            files_to_remove = [image.thumbnail_small_path, image.thumbnail_medium_path]
+            released_blobs = []
+            for kind in ARTIFACTS:
+                digest = getattr(image, f"{kind}_hash")
+                if digest is None:
+                    files_to_remove.append(getattr(image, f"{kind}_path"))
+                # Файл в хранилище по хэшу удаляется только вместе с последней ссылкой на него
+                elif self.blob_repo.release(digest):
+                    released_blobs.append((digest, getattr(image, f"{kind}_path")))
             self.db.delete(image)
             self.db.commit()
-            return True
-
         except Exception as e:
             self.db.rollback()
             raise RuntimeError(f"Deleting image error: {str(e)}")
+
+        # Файлы удаляются только после фиксации: при откате строка Image осталась бы со ссылками на удаленные файлы.
+        # Ошибка здесь оставляет лишь неиспользуемый файл на диске, само изображение уже удалено
+        try:
+            for file_path in files_to_remove:
+                self._remove_file(file_path)
+            for digest, file_path in released_blobs:
+                if self.blob_repo.is_orphaned(digest):
+                    self._remove_file(file_path)
+                self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            logger.warning(f"Failed to remove files of deleted image (id={image_id}): {e}")
+        return True
+
+    def _remove_file(self, file_path: Optional[str]) -> None:
+        if not file_path:
+            return
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
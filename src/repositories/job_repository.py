@@ -0,0 +1,132 @@
+from datetime import timedelta
+from typing import Optional
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Session
+
+from src.entities.job import JobAddDTO, JobDTO
+from src.models.job import Job
+
+
+class JobRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def add_job(self, job_data: JobAddDTO) -> JobDTO:
+        db_job = Job(
+            user_id=job_data.user_id,
+            status='queued',
+            filename=job_data.filename,
+            source_path=job_data.source_path,
+            upload_folder=job_data.upload_folder,
+            priority=job_data.priority,
+            charge_attempt=job_data.charge_attempt,
+            max_attempts=job_data.max_attempts
+        )
+        self.db.add(db_job)
+        self.db.commit()
+        self.db.refresh(db_job)
+        return JobDTO.model_validate(db_job)
+
+    def get_job_by_id(self, job_id: int) -> Optional[JobDTO]:
+        # populate_existing: задачу обновляет другой процесс, кэш сессии здесь не годится
+        db_job = self.db.query(Job).populate_existing().filter(Job.id == job_id).first()
+        self.db.commit()
+        return JobDTO.model_validate(db_job) if db_job else None
+
+    def count_active_jobs(self, user_id: int) -> int:
+        count = self.db.query(Job).filter(Job.user_id == user_id, Job.status.in_(('queued', 'running'))).count()
+        self.db.commit()
+        return count
+
+    def count_queued_jobs(self) -> int:
+        count = self.db.query(Job).filter(Job.status == 'queued').count()
+        self.db.commit()
+        return count
+
+    def claim_job(self, worker_id: str, lease_seconds: int) -> Optional[JobDTO]:
+        while True:
+            # Задачу с истекшей арендой можно забрать повторно: ее воркер упал или потерял связь с базой.
+            # SKIP LOCKED позволяет воркерам на разных узлах разбирать очередь без ожидания друг друга
+            db_job = (
+                self.db.query(Job)
+                .filter(or_(
+                    Job.status == 'queued',
+                    and_(Job.status == 'running', Job.lease_expires_at < func.now())
+                ))
+                .order_by(Job.priority, Job.created_at)
+                .with_for_update(skip_locked=True)
+                .first()
+            )
+            if db_job is None:
+                self.db.commit()
+                return None
+
+            if db_job.attempts >= db_job.max_attempts:
+                db_job.status = 'failed'
+                db_job.error = db_job.error or "Превышено число попыток обработки"
+                db_job.finished_at = func.now()
+                db_job.lease_expires_at = None
+                self.db.commit()
+                continue
+
+            db_job.status = 'running'
+            db_job.stage = None
+            db_job.worker_id = worker_id
+            db_job.attempts += 1
+            db_job.lease_expires_at = func.now() + timedelta(seconds=lease_seconds)
+            self.db.commit()
+            self.db.refresh(db_job)
+            return JobDTO.model_validate(db_job)
+
+    def _owned_job(self, job_id: int, worker_id: str) -> Optional[Job]:
+        return (
+            self.db.query(Job)
+            .filter(Job.id == job_id, Job.worker_id == worker_id, Job.status == 'running')
+            .with_for_update()
+            .first()
+        )
+
+    def extend_lease(self, job_id: int, worker_id: str, lease_seconds: int, stage: Optional[str] = None) -> bool:
+        db_job = self._owned_job(job_id, worker_id)
+        if db_job is None:
+            # Аренду уже перехватил другой воркер - результат этого воркера будет отброшен
+            self.db.commit()
+            return False
+        db_job.lease_expires_at = func.now() + timedelta(seconds=lease_seconds)
+        if stage is not None:
+            db_job.stage = stage
+        self.db.commit()
+        return True
+
+    def complete_job(self, job_id: int, worker_id: str, fixed_path: str, masked_path: str, segmented_path: str,
+                     from_cache: bool) -> bool:
+        db_job = self._owned_job(job_id, worker_id)
+        if db_job is None:
+            self.db.commit()
+            return False
+        db_job.status = 'done'
+        db_job.fixed_path = fixed_path
+        db_job.masked_path = masked_path
+        db_job.segmented_path = segmented_path
+        db_job.from_cache = from_cache
+        db_job.error = None
+        db_job.lease_expires_at = None
+        db_job.finished_at = func.now()
+        self.db.commit()
+        return True
+
+    def fail_job(self, job_id: int, worker_id: str, error: str, retry: bool) -> bool:
+        db_job = self._owned_job(job_id, worker_id)
+        if db_job is None:
+            self.db.commit()
+            return False
+        db_job.error = error
+        db_job.lease_expires_at = None
+        if retry and db_job.attempts < db_job.max_attempts:
+            db_job.status = 'queued'
+        else:
+            db_job.status = 'failed'
+            db_job.finished_at = func.now()
+        self.db.commit()
+        return True
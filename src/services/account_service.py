@@ -1,5 +1,6 @@
 from datetime import datetime
 
+from src.ml_pipeline.priorities import PRIORITY_FREE, PRIORITY_PAID
 from src.repositories.user_repository import UserRepository
 from src.utils.database import session
 
@@ -33,6 +34,10 @@ class AccountService:
             "minutes": minutes
         }
 
+    def get_inference_priority(self, user) -> int:
+        is_subscription_active, _ = self.calculate_subscription_time_left(user)
+        return PRIORITY_PAID if is_subscription_active else PRIORITY_FREE
+
     def update_subscription(self, user_id: int, months: int):
         return self.user_repo.update_subscription(user_id, 30*months)
 
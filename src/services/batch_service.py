@@ -0,0 +1,302 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from src.ml_pipeline.priorities import PRIORITY_PAID, AdmissionError
+from src.repositories.user_repository import UserRepository
+from src.services.main_service import MainService
+from src.settings.ml_settings import ml_settings
+from src.utils.database import Database, db
+from src.utils.logger import logger
+from src.utils.metrics import metrics
+
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+FINISHED_BATCH_TTL = 60 * 60
+ADMISSION_RETRY_DELAY = 1.0
+
+# Общий ограниченный пул: сотни файлов пакета не превращаются в сотни одновременных запросов к планировщику,
+# а несколько параллельных элементов собираются им в один батч инференса. Каждый пакет занимает
+# не больше batch_item_concurrency потоков, поэтому большой пакет одного пользователя не вытесняет чужие
+batch_executor = ThreadPoolExecutor(max_workers=ml_settings.batch_workers, thread_name_prefix="batch-item")
+batch_store = {}
+batch_store_lock = threading.Lock()
+
+
+@dataclass
+class BatchItem:
+    name: str
+    filename: str
+    read: Callable[[], bytes] = field(repr=False)
+    status: str = "queued"
+    stage: Optional[str] = None
+    error: Optional[str] = None
+    from_cache: bool = False
+    charged: bool = False
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in ("done", "failed", "skipped")
+
+
+@dataclass
+class BatchJob:
+    id: str
+    user_id: int
+    folder: str
+    items: list
+    priority: int = PRIORITY_PAID
+    attempts_limit: Optional[int] = None
+    status: str = "running"
+    reserved: int = 0
+    charged: int = 0
+    running: int = 0
+    cancelled: bool = False
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    pending: deque = field(default_factory=deque, repr=False)
+    archive: Optional[zipfile.ZipFile] = field(default=None, repr=False)
+
+    @property
+    def archive_path(self) -> str:
+        return os.path.join(self.folder, "results.zip")
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status == "done"
+
+    @property
+    def finished_count(self) -> int:
+        return sum(1 for item in self.items if item.is_finished)
+
+    @property
+    def progress(self) -> float:
+        return self.finished_count / len(self.items) if self.items else 1.0
+
+    def count(self, status: str) -> int:
+        return sum(1 for item in self.items if item.status == status)
+
+
+class BatchService:
+    """Пакетная обработка: несколько файлов или ZIP-архив проходят конвейер через ограниченный пул потоков."""
+
+    def __init__(self, main_service: MainService = None, executor: ThreadPoolExecutor = batch_executor,
+                 batches: dict = batch_store, lock: threading.Lock = batch_store_lock, database: Database = db,
+                 item_concurrency: int = ml_settings.batch_item_concurrency):
+        self.main_service = main_service or MainService()
+        self.executor = executor
+        self.batches = batches
+        self.lock = lock
+        self.database = database
+        self.item_concurrency = item_concurrency
+
+    def expand_uploads(self, uploads: list) -> list:
+        # Загруженный архив Streamlit и так держит в памяти, но распакованные изображения не копятся:
+        # элемент разжимает свой файл из архива только перед обработкой
+        items = []
+        max_item_bytes = ml_settings.batch_max_item_mb * 1024 * 1024
+        for upload in uploads:
+            if upload.name.lower().endswith(".zip"):
+                try:
+                    archive = zipfile.ZipFile(upload)
+                except zipfile.BadZipFile:
+                    raise ValueError(f"Файл {upload.name} не является ZIP-архивом")
+                for member in archive.infolist():
+                    name = os.path.basename(member.filename)
+                    if member.is_dir() or member.filename.startswith("__MACOSX") or name.startswith("."):
+                        continue
+                    if not name.lower().endswith(IMG_EXTENSIONS):
+                        continue
+                    if member.file_size > max_item_bytes:
+                        raise ValueError(f"Файл {name} в архиве {upload.name} больше {ml_settings.batch_max_item_mb} МБ")
+                    items.append((name, lambda archive=archive, member=member: archive.read(member)))
+            elif upload.name.lower().endswith(IMG_EXTENSIONS):
+                items.append((upload.name, upload.getvalue))
+
+        if not items:
+            raise ValueError("Среди загруженных файлов нет изображений")
+        if len(items) > ml_settings.batch_max_items:
+            raise ValueError(f"В одном пакете можно обработать не больше {ml_settings.batch_max_items} изображений")
+        return items
+
+    def submit(self, user_id: int, uploads: list, temp_folder: str, priority: int = PRIORITY_PAID,
+               attempts_limit: Optional[int] = None) -> str:
+        batch_id = uuid.uuid4().hex
+        items = [BatchItem(name=name, filename=self.main_service.generate_unique_filename(name), read=read)
+                 for name, read in self.expand_uploads(uploads)]
+        batch = BatchJob(id=batch_id, user_id=user_id, folder=os.path.join(temp_folder, "batches", batch_id),
+                         items=items, priority=priority, attempts_limit=attempts_limit)
+        os.makedirs(batch.folder, exist_ok=True)
+        # Архив результатов пополняется по мере готовности: к концу пакета его не нужно собирать заново
+        batch.archive = zipfile.ZipFile(batch.archive_path, "w", compression=zipfile.ZIP_STORED)
+        batch.pending.extend(items)
+
+        with self.lock:
+            self._purge_finished()
+            self.batches[batch_id] = batch
+        self._schedule(batch)
+        logger.info(f"Batch {batch_id} of user (id={user_id}) submitted with {len(items)} images")
+        return batch_id
+
+    def get(self, batch_id: str) -> Optional[BatchJob]:
+        with self.lock:
+            return self.batches.get(batch_id)
+
+    def cancel(self, batch_id: str) -> None:
+        batch = self.get(batch_id)
+        if batch is not None:
+            self.cancel_batch(batch)
+
+    def cancel_batch(self, batch: BatchJob) -> None:
+        with batch.lock:
+            batch.cancelled = True
+        # Элементы, еще не отданные пулу, завершаются сразу
+        self._schedule(batch)
+
+    def discard(self, batch_id: str) -> None:
+        with self.lock:
+            batch = self.batches.pop(batch_id, None)
+        if batch is not None:
+            self.cancel_batch(batch)
+            if batch.is_finished:
+                shutil.rmtree(batch.folder, ignore_errors=True)
+
+    def _schedule(self, batch: BatchJob) -> None:
+        # Элементы отдаются пулу по мере освобождения мест пакета. Попытка резервируется до отправки,
+        # чтобы параллельные элементы не превысили остаток; поток пула никогда не ждет попытку
+        skipped = []
+        with batch.lock:
+            while batch.pending and batch.running < self.item_concurrency:
+                if batch.cancelled:
+                    reason = "Обработка пакета отменена"
+                elif batch.attempts_limit is not None and batch.charged >= batch.attempts_limit:
+                    reason = "Закончились бесплатные попытки"
+                elif batch.attempts_limit is not None and batch.reserved >= batch.attempts_limit:
+                    # Остаток занят элементами в обработке: следующий отправится, когда они спишут или вернут попытку
+                    break
+                else:
+                    reason = None
+
+                item = batch.pending.popleft()
+                if reason is not None:
+                    item.status = "skipped"
+                    item.error = reason
+                    skipped.append(item)
+                    continue
+                batch.reserved += 1
+                batch.running += 1
+                self.executor.submit(self._run_item, batch, item)
+        if skipped:
+            self._finish_item(batch)
+
+    def _release_attempt(self, batch: BatchJob) -> None:
+        with batch.lock:
+            batch.reserved -= 1
+
+    def _commit_attempt(self, batch: BatchJob, item: BatchItem) -> None:
+        with batch.lock:
+            item.charged = True
+            batch.charged += 1
+        if batch.attempts_limit is None:
+            return
+        try:
+            # Попытка списывается сразу из потока элемента в собственной сессии БД:
+            # закрытая вкладка не оставляет обработанные изображения неоплаченными
+            with self.database.session_scope() as user_session:
+                UserRepository(user_session).decrease_attempts_count(batch.user_id)
+        except Exception as e:
+            logger.error(f"Failed to charge an attempt of user (id={batch.user_id}) for batch {batch.id}: {e}")
+
+    def _set_stage(self, item: BatchItem, stage: str) -> None:
+        item.status = "running"
+        item.stage = stage
+
+    def _run_item(self, batch: BatchJob, item: BatchItem, image_bytes: bytes = None) -> None:
+        if batch.cancelled:
+            self._release_attempt(batch)
+            item.status = "skipped"
+            item.error = "Обработка пакета отменена"
+            self._complete_item(batch)
+            return
+
+        try:
+            image_bytes = image_bytes if image_bytes is not None else item.read()
+            try:
+                # Ограничение на число запросов пользователя не применяется: пакет сам ограничен числом потоков
+                result = self.main_service.process_upload(
+                    image_bytes,
+                    batch.folder,
+                    item.filename,
+                    progress=lambda stage: self._set_stage(item, stage),
+                    priority=batch.priority
+                )
+            except AdmissionError:
+                if batch.cancelled:
+                    raise
+                # Очередь планировщика заполнена: поток пула освобождается, элемент повторится по таймеру
+                timer = threading.Timer(ADMISSION_RETRY_DELAY, self.executor.submit,
+                                        args=(self._run_item, batch, item, image_bytes))
+                timer.daemon = True
+                timer.start()
+                return
+            result["context"].persist_steps(batch.folder)
+            with batch.lock:
+                batch.archive.write(os.path.join(batch.folder, "fixed", item.filename), self._archive_name(batch, item))
+        except Exception as e:
+            self._release_attempt(batch)
+            item.error = str(e)
+            item.status = "failed"
+            logger.error(f"Batch {batch.id} item {item.name} of user (id={batch.user_id}) failed: {e}")
+            self._complete_item(batch)
+            return
+
+        item.from_cache = result["from_cache"]
+        # Результат из кэша попытку не тратит, как и при обработке одного изображения
+        if item.from_cache:
+            self._release_attempt(batch)
+        else:
+            self._commit_attempt(batch, item)
+        item.status = "done"
+        metrics.increment("batch_items_total")
+        self._complete_item(batch)
+
+    def _complete_item(self, batch: BatchJob) -> None:
+        with batch.lock:
+            batch.running -= 1
+        self._schedule(batch)
+        self._finish_item(batch)
+
+    def _archive_name(self, batch: BatchJob, item: BatchItem) -> str:
+        names = [other.name for other in batch.items]
+        if names.count(item.name) == 1:
+            return item.name
+        # Одноименные файлы из разных архивов различаются порядковым номером
+        return f"{batch.items.index(item) + 1:04d}_{item.name}"
+
+    def _finish_item(self, batch: BatchJob) -> None:
+        with batch.lock:
+            if batch.status == "done" or batch.finished_count < len(batch.items):
+                return
+            batch.archive.close()
+            batch.status = "done"
+            batch.finished_at = time.time()
+        logger.info(f"Batch {batch.id} of user (id={batch.user_id}) finished: "
+                    f"{batch.count('done')} done, {batch.count('failed')} failed, {batch.count('skipped')} skipped")
+        with self.lock:
+            discarded = batch.id not in self.batches
+        if discarded:
+            # Пакет закрыли до завершения - результаты больше никому не нужны
+            shutil.rmtree(batch.folder, ignore_errors=True)
+
+    def _purge_finished(self) -> None:
+        now = time.time()
+        for batch_id in [batch_id for batch_id, batch in self.batches.items()
+                         if batch.is_finished and now - batch.finished_at > FINISHED_BATCH_TTL]:
+            shutil.rmtree(self.batches.pop(batch_id).folder, ignore_errors=True)
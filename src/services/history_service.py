@@ -1,15 +1,22 @@
+import os
+
+from src.entities.image import ImageDTO
 from src.repositories.image_repository import ImageRepository
 from src.repositories.user_repository import UserRepository
-from src.utils.database import session
+from src.utils.database import Database, db, session
+from src.utils.logger import logger
+from src.utils.thumbnails import create_thumbnails
 
 user_repository = UserRepository(session)
 image_repository = ImageRepository(session)
 
 
 class HistoryService:
-    def __init__(self, user_repo: UserRepository = user_repository, image_repo: ImageRepository = image_repository):
+    def __init__(self, user_repo: UserRepository = user_repository, image_repo: ImageRepository = image_repository,
+                 database: Database = db):
         self.user_repo = user_repo
         self.image_repo = image_repo
+        self.database = database
 
     def get_images_by_user_id(self, user_id):
         return self.image_repo.get_user_images(user_id)
@@ -18,4 +25,25 @@ class HistoryService:
         return self.image_repo.toggle_like_status(image_id)
 
     def delete_image_by_id(self, image_id):
-        return self.image_repo.delete_image_by_id(image_id)
+        # Удаление со снятием ссылок на файлы хранилища - отдельная транзакция, как и сохранение
+        with self.database.session_scope() as delete_session:
+            return ImageRepository(delete_session).delete_image_by_id(image_id)
+
+    def get_thumbnail_path(self, image: ImageDTO, size_name: str = "small"):
+        path = getattr(image, f"thumbnail_{size_name}_path")
+        if path and os.path.exists(path):
+            return path
+        if not os.path.exists(image.fixed_path):
+            return None
+
+        # Изображения, сохраненные до появления миниатюр, получают их при первом показе в галерее
+        if path:
+            # Миниатюры лежат в <upload_folder>/thumbnails/<размер>/
+            upload_folder = os.path.dirname(os.path.dirname(os.path.dirname(path)))
+        else:
+            upload_folder = os.path.dirname(os.path.dirname(image.fixed_path))
+        thumbnails = create_thumbnails(image.fixed_path, upload_folder, os.path.basename(image.fixed_path))
+        self.image_repo.set_thumbnails(image.id, thumbnails["small"], thumbnails["medium"])
+        image.thumbnail_small_path, image.thumbnail_medium_path = thumbnails["small"], thumbnails["medium"]
+        logger.debug(f"Thumbnails for image (id={image.id}) have been created")
+        return thumbnails[size_name]
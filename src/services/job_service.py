@@ -0,0 +1,205 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Optional
+
+from src.entities.job import JobAddDTO
+from src.ml_pipeline.priorities import PRIORITY_FREE, PRIORITY_PAID, AdmissionError
+from src.ml_pipeline.restoration_context import RestorationContext
+from src.repositories.job_repository import JobRepository
+from src.services.main_service import MainService
+from src.settings.ml_settings import ml_settings
+from src.utils.database import Database, db
+from src.utils.logger import logger
+
+STAGES = ("decode", "segment", "mask", "inpaint", "persist")
+FINISHED_JOB_TTL = 60 * 60
+
+# Потоки задач в основном ждут планировщик. Их не меньше, чем мест в его очереди: иначе задачи копились бы
+# в FIFO-очереди пула, минуя приоритеты планировщика
+job_executor = ThreadPoolExecutor(max_workers=max(ml_settings.job_workers, ml_settings.scheduler_max_queue_size),
+                                  thread_name_prefix="processing-job")
+job_store = {}
+job_store_lock = threading.Lock()
+
+
+@dataclass
+class ProcessingJob:
+    id: str
+    user_id: int
+    filename: str
+    priority: int = PRIORITY_PAID
+    charge_attempt: bool = False
+    status: str = "queued"
+    stage: Optional[str] = None
+    error: Optional[str] = None
+    result: Optional[dict] = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    @property
+    def progress(self) -> float:
+        if self.status == "done":
+            return 1.0
+        if self.stage is None:
+            return 0.0
+        return STAGES.index(self.stage) / len(STAGES)
+
+
+class JobService:
+    def __init__(self, main_service: MainService = None, executor: ThreadPoolExecutor = job_executor,
+                 jobs: dict = job_store, lock: threading.Lock = job_store_lock):
+        self.main_service = main_service or MainService()
+        self.executor = executor
+        self.jobs = jobs
+        self.lock = lock
+
+    def _active_jobs(self, user_id: int) -> int:
+        return sum(1 for job in self.jobs.values() if job.user_id == user_id and not job.is_finished)
+
+    def submit(self, user_id: int, image_bytes: bytes, upload_folder: str, filename: str,
+               priority: int = PRIORITY_PAID, charge_attempt: bool = False) -> str:
+        job = ProcessingJob(id=uuid.uuid4().hex, user_id=user_id, filename=filename, priority=priority,
+                            charge_attempt=charge_attempt)
+        with self.lock:
+            self._purge_finished()
+            # Отказ до постановки в очередь: пользователь сразу видит причину, попытка не тратится
+            if ml_settings.scheduler_max_inflight_per_user and \
+                    self._active_jobs(user_id) >= ml_settings.scheduler_max_inflight_per_user:
+                raise AdmissionError("Дождитесь завершения предыдущих обработок")
+            self.main_service.check_admission(user_id, priority)
+            self.jobs[job.id] = job
+        self.executor.submit(self._run, job, image_bytes, upload_folder)
+        return job.id
+
+    def get(self, job_id: str) -> Optional[ProcessingJob]:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def discard(self, job_id: str) -> None:
+        with self.lock:
+            self.jobs.pop(job_id, None)
+
+    def _set_stage(self, job: ProcessingJob, stage: str) -> None:
+        job.status = "running"
+        job.stage = stage
+
+    def _run(self, job: ProcessingJob, image_bytes: bytes, upload_folder: str) -> None:
+        try:
+            job.result = self.main_service.process_upload(
+                image_bytes,
+                upload_folder,
+                job.filename,
+                progress=lambda stage: self._set_stage(job, stage),
+                user_id=job.user_id,
+                priority=job.priority
+            )
+            # Попытка списывается при завершении задачи, а не при ее показе: закрытая вкладка не отменяет оплату.
+            # Повторная загрузка того же фото отдается из кэша и попытку не тратит
+            if job.charge_attempt and not job.result["from_cache"]:
+                self.main_service.charge_attempt(job.user_id)
+            job.status = "done"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+            logger.error(f"Processing job {job.id} of user (id={job.user_id}) failed: {e}")
+        finally:
+            job.finished_at = time.time()
+
+    def _purge_finished(self) -> None:
+        # Результаты, которые никто не забрал (закрытая вкладка), не должны копиться в памяти
+        now = time.time()
+        for job_id in [job_id for job_id, job in self.jobs.items()
+                       if job.is_finished and now - job.finished_at > FINISHED_JOB_TTL]:
+            del self.jobs[job_id]
+
+
+class DatabaseJobService(JobService):
+    """Очередь задач в таблице jobs: обработку выполняют воркеры src.services.queue_worker на любых узлах."""
+
+    def __init__(self, main_service: MainService = None, database: Database = db):
+        super().__init__(main_service)
+        self.database = database
+
+    @contextmanager
+    def _job_repo(self):
+        # Фрагменты всех сессий Streamlit опрашивают задачи из своих потоков - каждому вызову своя сессия БД
+        with self.database.session_scope() as job_session:
+            yield JobRepository(job_session)
+
+    def submit(self, user_id: int, image_bytes: bytes, upload_folder: str, filename: str,
+               priority: int = PRIORITY_PAID, charge_attempt: bool = False) -> str:
+        with self._job_repo() as job_repo:
+            return self._submit(job_repo, user_id, image_bytes, upload_folder, filename, priority, charge_attempt)
+
+    def _submit(self, job_repo: JobRepository, user_id: int, image_bytes: bytes, upload_folder: str, filename: str,
+                priority: int, charge_attempt: bool) -> str:
+        if ml_settings.scheduler_max_inflight_per_user and \
+                job_repo.count_active_jobs(user_id) >= ml_settings.scheduler_max_inflight_per_user:
+            raise AdmissionError("Дождитесь завершения предыдущих обработок")
+        queued = job_repo.count_queued_jobs()
+        limit = ml_settings.scheduler_max_queue_size
+        if priority == PRIORITY_FREE:
+            limit = int(limit * ml_settings.scheduler_free_queue_share)
+        if ml_settings.scheduler_max_queue_size and queued >= limit:
+            raise AdmissionError("Сервис перегружен, попробуйте позже")
+
+        # Исходник кладется в общее хранилище: воркер на другом узле читает его по тому же пути
+        upload_folder = os.path.abspath(upload_folder)
+        source_path = os.path.join(upload_folder, "incoming", filename)
+        os.makedirs(os.path.dirname(source_path), exist_ok=True)
+        with open(source_path, "wb") as f:
+            f.write(image_bytes)
+
+        job = job_repo.add_job(JobAddDTO(
+            user_id=user_id,
+            filename=filename,
+            source_path=source_path,
+            upload_folder=upload_folder,
+            priority=priority,
+            charge_attempt=charge_attempt,
+            max_attempts=ml_settings.job_max_attempts
+        ))
+        return str(job.id)
+
+    def get(self, job_id: str) -> Optional[ProcessingJob]:
+        with self._job_repo() as job_repo:
+            job_data = job_repo.get_job_by_id(int(job_id))
+        if job_data is None:
+            return None
+
+        job = ProcessingJob(
+            id=str(job_data.id),
+            user_id=job_data.user_id,
+            filename=job_data.filename,
+            priority=job_data.priority,
+            status=job_data.status,
+            stage=job_data.stage,
+            error=job_data.error if job_data.status == "failed" else None,
+            created_at=job_data.created_at.timestamp(),
+            finished_at=job_data.finished_at.timestamp() if job_data.finished_at else None
+        )
+        if job_data.status == "done":
+            job.result = {
+                "context": RestorationContext.from_files(job_data.filename, job_data.upload_folder),
+                "from_cache": job_data.from_cache
+            }
+        return job
+
+    def discard(self, job_id: str) -> None:
+        # Строка задачи остается в таблице как история обработки
+        pass
+
+
+def create_job_service(main_service: MainService = None) -> JobService:
+    if ml_settings.job_backend == "postgres":
+        return DatabaseJobService(main_service)
+    return JobService(main_service)
@@ -1,78 +1,142 @@
 import os
-import shutil
-import time
+import threading
 import uuid
 from datetime import datetime
+from typing import TYPE_CHECKING, Union
 
 from src.entities.image import ImageAddDTO
-from src.ml_pipeline.model_cnn.test.test_segment import ImageSegmentation
-from src.ml_pipeline.model_gan.test.test_inpaint import Inpainter
-from src.ml_pipeline.model_manager import ModelManager
-from src.repositories.image_repository import ImageRepository
+from src.ml_pipeline.inference_client import InferenceClient
+from src.ml_pipeline.priorities import PRIORITY_PAID
+from src.ml_pipeline.restoration_context import RestorationContext, artifact_path
+from src.repositories.blob_repository import BlobRepository
+from src.repositories.image_repository import ARTIFACTS, ImageRepository
 from src.repositories.user_repository import UserRepository
+from src.settings.metrics_settings import metrics_settings
 from src.settings.ml_settings import ml_settings
-from src.utils.database import session
-from PIL import Image
-import numpy as np
+from src.utils.blob_store import BlobStore
+from src.utils.database import Database, db, session
+from src.utils.logger import logger
+from src.utils.metrics import metrics
+from src.utils.result_cache import ResultCache
+from src.utils.thumbnails import create_thumbnails
+
+if TYPE_CHECKING:
+    from src.ml_pipeline.inference_scheduler import InferenceScheduler
 
 user_repository = UserRepository(session)
 image_repository = ImageRepository(session)
 
-model_manager = ModelManager(r"D:\Projects\Python\diploma_project\src\settings\models_config.json", ml_settings=ml_settings)
-cnn_model = model_manager.load_model('cnn')
-gan_model = model_manager.load_model('gan')
+if ml_settings.inference_server_address:
+    # Модели живут в отдельном процессе src.ml_pipeline.inference_server, UI-процесс их не загружает
+    model_manager = None
+    cnn_model = None
+    gan_model = None
+    inference_scheduler = InferenceClient(
+        ml_settings.inference_server_address,
+        authkey=ml_settings.inference_server_authkey.encode(),
+        timeout=ml_settings.inference_server_timeout
+    )
+else:
+    # Стек моделей (torch, ultralytics) импортируется, только если инференс выполняется в этом процессе
+    from src.ml_pipeline.inference_scheduler import InferenceScheduler
+    from src.ml_pipeline.model_manager import ModelHandle, ModelManager
+
+    model_manager = ModelManager(r"D:\Projects\Python\diploma_project\src\settings\models_config.json", ml_settings=ml_settings,
+                                 memory_budget_bytes=ml_settings.model_memory_budget_mb * 1024 * 1024)
+    # Модели загружаются при первом батче и переключаются между версиями без перезапуска приложения
+    cnn_model = ModelHandle(model_manager, 'cnn')
+    gan_model = ModelHandle(model_manager, ml_settings.gan_model_name)
+    inference_scheduler = InferenceScheduler(
+        cnn_model=cnn_model,
+        gan_model=gan_model,
+        max_batch_size=ml_settings.batch_max_size,
+        max_wait_ms=ml_settings.batch_max_wait_ms,
+        inpaint_options=ml_settings.inpaint_options,
+        max_queue_size=ml_settings.scheduler_max_queue_size,
+        free_queue_share=ml_settings.scheduler_free_queue_share,
+        max_inflight_per_user=ml_settings.scheduler_max_inflight_per_user
+    )
+    if ml_settings.model_preload:
+        threading.Thread(target=model_manager.preload, args=(['cnn', ml_settings.gan_model_name],),
+                         name="model-preload", daemon=True).start()
+    else:
+        model_manager.ready.set()
+result_cache = ResultCache(
+    cache_dir=os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, ml_settings.result_cache_dir),
+    max_bytes=ml_settings.result_cache_max_mb * 1024 * 1024
+)
+
+metrics.set_readiness_check(inference_scheduler.is_ready)
+if metrics_settings.metrics_port:
+    metrics.start_http_server(metrics_settings.metrics_host, metrics_settings.metrics_port)
+if metrics_settings.metrics_dump_path:
+    metrics.start_json_dump(metrics_settings.metrics_dump_path, metrics_settings.metrics_dump_interval)
 
 
 class MainService:
-    def __init__(self, user_repo: UserRepository = user_repository, image_repo: ImageRepository = image_repository):
+    def __init__(self, user_repo: UserRepository = user_repository, image_repo: ImageRepository = image_repository,
+                 scheduler: Union["InferenceScheduler", InferenceClient] = inference_scheduler, cache: ResultCache = result_cache,
+                 database: Database = db):
         self.user_repo = user_repo
         self.image_repo = image_repo
+        self.database = database
         self.cnn_model = cnn_model
         self.gan_model = gan_model
-
-
-    def add_image(self, user_id, is_liked, temp_folder, upload_folder, filename):
-        self.save_temp_image(temp_folder, upload_folder, filename)
-        image_data = ImageAddDTO(
-            user_id=user_id,
-            fix_datetime=datetime.now(),
-            is_liked=is_liked,
-            defected_path=os.path.join(upload_folder, "defected", filename),
-            fixed_path=os.path.join(upload_folder, "fixed", filename),
-            masked_path=os.path.join(upload_folder, "masked", filename),
-            segmented_path=os.path.join(upload_folder, "segmented", filename)
-        )
-        self.image_repo.add_image(image_data)
-
-    def decrease_attempts_count(self, user_id):
-        return self.user_repo.decrease_attempts_count(user_id)
-
-    def image_processing(self, uploaded_image, filepath, filename):
-        start_time = time.time()
-
-        image = Image.open(uploaded_image).convert('RGB')
-        image_np = np.array(image)
-
-        segment_filepath = os.path.join(filepath, "segmented")
-        mask_filepath = os.path.join(filepath, "masked")
-        os.makedirs(segment_filepath, exist_ok=True)
-        os.makedirs(mask_filepath, exist_ok=True)
-
-        segmentation = ImageSegmentation(
-            model=self.cnn_model,
-            save_segment_dir=segment_filepath,
-            save_mask_dir=mask_filepath
-        )
-        segmented_image, masked_image = segmentation.segment_image(image_np, filename)
-        mask_np = np.array(masked_image)
-        inpainting = Inpainter(
-            image=image_np,
-            mask=mask_np,
-            generator=self.gan_model
-        )
-        inpainted_image = inpainting.inpaint()
-        print(f"TIME: {time.time() - start_time}")
-        return segmented_image, masked_image, inpainted_image
+        self.scheduler = scheduler
+        self.result_cache = cache
+
+
+    def add_image(self, user_id, is_liked, temp_folder, upload_folder, filename, context: RestorationContext = None):
+        if context is not None:
+            # Сегментация и маска кодируются в файлы только при сохранении результата
+            context.persist_steps(temp_folder)
+        # Сохранение идет в собственной транзакции: строки blobs блокируются до ее фиксации, а откат при ошибке
+        # не затрагивает незафиксированную работу других потоков в общей сессии
+        with self.database.session_scope() as save_session:
+            image_repo = ImageRepository(save_session)
+            artifacts = self.save_temp_image(temp_folder, upload_folder, filename, image_repo.blob_repo)
+            with metrics.timer("thumbnails"):
+                # Результат уже в памяти - миниатюры строятся из него без повторного чтения файла
+                source = context.result_image if context is not None else artifacts["fixed"][1]
+                thumbnails = create_thumbnails(source, upload_folder, filename)
+            image_data = ImageAddDTO(
+                user_id=user_id,
+                fix_datetime=datetime.now(),
+                is_liked=is_liked,
+                thumbnail_small_path=thumbnails["small"],
+                thumbnail_medium_path=thumbnails["medium"],
+                **{f"{kind}_path": path for kind, (_, path) in artifacts.items()},
+                **{f"{kind}_hash": digest for kind, (digest, _) in artifacts.items()}
+            )
+            with metrics.timer("db_insert"):
+                image_repo.add_image(image_data)
+
+    def get_model_versions(self) -> list:
+        return self.scheduler.get_model_versions()
+
+    def is_ready(self) -> bool:
+        return self.scheduler.is_ready()
+
+    def switch_model_version(self, model_name: str, version: str) -> str:
+        return self.scheduler.set_active_version(model_name, version)
+
+    def charge_attempt(self, user_id: int) -> None:
+        try:
+            # Вызывается из потока задачи или воркера очереди, поэтому в собственной сессии БД
+            with self.database.session_scope() as user_session:
+                UserRepository(user_session).decrease_attempts_count(user_id)
+        except Exception as e:
+            logger.error(f"Failed to charge an attempt of user (id={user_id}): {e}")
+
+    def check_admission(self, user_id: int = None, priority: int = PRIORITY_PAID) -> None:
+        self.scheduler.check_admission(user_id, priority)
+
+    def image_processing(self, context: RestorationContext, progress=None, user_id: int = None,
+                         priority: int = PRIORITY_PAID) -> RestorationContext:
+        with metrics.timer("pipeline"):
+            context = self.scheduler.process(context, progress, user_id, priority)
+        metrics.observe("mask_coverage_ratio", float(context.mask_bool.mean()))
+        return context
 
     def generate_unique_filename(self, original_filename: str) -> str:
         ext = original_filename.split('.')[-1]
@@ -80,21 +144,56 @@ class MainService:
         unique_id = uuid.uuid4().hex
         return f"{timestamp}_{unique_id}.{ext}"
 
-    def handle_processing(self, st, upload_folder, filename):
-        segmented_image, masked_image, processed_image = self.image_processing(st.session_state.uploaded_image, upload_folder, filename)
+    def process_upload(self, image_bytes: bytes, upload_folder, filename, progress=None, user_id: int = None,
+                       priority: int = PRIORITY_PAID) -> dict:
+        progress = progress or (lambda stage: None)
+
+        progress("decode")
+        with metrics.timer("decode"):
+            context = RestorationContext.from_bytes(filename, image_bytes)
+        metrics.observe("image_megapixels", context.image.shape[0] * context.image.shape[1] / 1e6)
+        metrics.increment("images_total")
+
+        model_versions = self.get_model_versions()
+        cache_key = self.result_cache.make_key(context.image, model_versions, ml_settings.inpaint_options)
+        cached = self.result_cache.get(cache_key)
+        if cached is not None:
+            masked, context.result = cached
+            context.load_mask_array(masked)
+            context.from_cache = True
+            metrics.increment("result_cache_hits_total")
+        else:
+            context = self.image_processing(context, progress, user_id, priority)
+            if context.model_versions and context.model_versions != model_versions:
+                # Версию переключили, пока запрос ждал в очереди - результат кэшируется под фактической версией
+                cache_key = self.result_cache.make_key(context.image, context.model_versions,
+                                                       ml_settings.inpaint_options)
+            try:
+                self.result_cache.put(cache_key, context.mask_bool, context.result)
+            except Exception as e:
+                # Кэш - оптимизация: ошибка записи не должна ронять уже выполненную обработку
+                logger.warning(f"Failed to store result in cache: {e}")
+
+        progress("persist")
+        context.persist(upload_folder)
+
+        return {"context": context, "from_cache": context.from_cache}
+
+    def apply_result(self, st, result: dict):
+        context = result["context"]
         st.session_state.original_image = st.session_state.uploaded_image
-        st.session_state.masked_image = masked_image
-        st.session_state.segmented_image = segmented_image
-        st.session_state.result_image = processed_image
+        st.session_state.restoration_context = context
+        st.session_state.result_image = context.result_image
 
-        defected_image = Image.open(st.session_state.original_image)
-        defected_image.save(upload_folder + "/defected/" + filename)
-        st.session_state.result_image.save(upload_folder + "/fixed/" + filename)
+    def handle_processing(self, st, upload_folder, filename):
+        result = self.process_upload(st.session_state.uploaded_image.getvalue(), upload_folder, filename)
+        self.apply_result(st, result)
+        return result["from_cache"]
 
     def delete_temp_image(self, temp_folder, filename):
         defected_file_path = os.path.join(temp_folder, "defected", filename)
         fixed_file_path = os.path.join(temp_folder, "fixed", filename)
-        masked_file_path = os.path.join(temp_folder, "masked", filename)
+        masked_file_path = artifact_path(temp_folder, "masked", filename)
         segmented_file_path = os.path.join(temp_folder, "segmented", filename)
 
         files_to_remove = [defected_file_path, fixed_file_path, masked_file_path, segmented_file_path]
@@ -103,25 +202,18 @@ class MainService:
             if os.path.exists(file_path):
                 os.remove(file_path)
 
-    def save_temp_image(self, temp_folder, upload_folder, filename):
-        defected_file_path = os.path.join(temp_folder, "defected", filename)
-        fixed_file_path = os.path.join(temp_folder, "fixed", filename)
-        masked_file_path = os.path.join(temp_folder, "masked", filename)
-        segmented_file_path = os.path.join(temp_folder, "segmented", filename)
-
-        upload_defected_path = os.path.join(upload_folder, "defected", filename)
-        upload_fixed_path = os.path.join(upload_folder, "fixed", filename)
-        upload_masked_path = os.path.join(upload_folder, "masked", filename)
-        upload_segmented_path = os.path.join(upload_folder, "segmented", filename)
-
-        files_to_copy = [
-            (defected_file_path, upload_defected_path),
-            (fixed_file_path, upload_fixed_path),
-            (masked_file_path, upload_masked_path),
-            (segmented_file_path, upload_segmented_path)
-        ]
-
-        for original_path, destination_path in files_to_copy:
-            if os.path.exists(original_path):
-                os.makedirs(os.path.dirname(destination_path), exist_ok=True)
-                shutil.copy(original_path, destination_path)
+    def save_temp_image(self, temp_folder, upload_folder, filename, blob_repo: BlobRepository) -> dict:
+        # Артефакты кладутся в хранилище по хэшу содержимого: повторно сохраненный исходник не занимает места.
+        # Счетчики ссылок фиксируются одной транзакцией со строкой Image в add_image
+        blob_store = BlobStore(os.path.join(upload_folder, "blobs"))
+        artifacts = {}
+        for kind in ARTIFACTS:
+            temp_path = artifact_path(temp_folder, kind, filename)
+            if not os.path.exists(temp_path):
+                artifacts[kind] = (None, artifact_path(upload_folder, kind, filename))
+                continue
+            digest, size = blob_store.hash_file(temp_path)
+            extension = blob_repo.acquire(digest, os.path.splitext(temp_path)[1].lower(), size)
+            with metrics.timer("disk_write"):
+                artifacts[kind] = (digest, blob_store.write(temp_path, digest, extension))
+        return artifacts
@@ -0,0 +1,131 @@
+import argparse
+import os
+import socket
+import threading
+import time
+import uuid
+
+from src.entities.job import JobDTO
+from src.ml_pipeline.restoration_context import artifact_path
+from src.repositories.job_repository import JobRepository
+from src.services.main_service import MainService
+from src.settings.ml_settings import ml_settings
+from src.utils.database import db
+from src.utils.logger import logger
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--worker-id', type=str, default=f"{socket.gethostname()}-{os.getpid()}", help="Worker name in jobs table")
+parser.add_argument('--threads', type=int, default=2, help="Jobs processed concurrently by this worker")
+parser.add_argument('--lease', type=int, default=ml_settings.job_lease_seconds, help="Job lease duration in seconds")
+parser.add_argument('--poll-interval', type=float, default=ml_settings.job_poll_interval, help="Idle poll interval in seconds")
+
+
+class QueueWorker:
+    """Забирает задачи из таблицы jobs и выполняет их тем же конвейером, что и UI."""
+
+    def __init__(self, worker_id: str, main_service: MainService, lease_seconds: int, poll_interval: float):
+        self.worker_id = worker_id
+        self.main_service = main_service
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+
+    def run(self, thread_index: int) -> None:
+        # У каждого потока своя сессия: сессия SQLAlchemy не потокобезопасна
+        job_repo = JobRepository(db.get_session())
+        worker_id = f"{self.worker_id}/{thread_index}"
+        while True:
+            try:
+                job = job_repo.claim_job(worker_id, self.lease_seconds)
+            except Exception as e:
+                logger.error(f"Worker {worker_id} failed to claim a job: {e}")
+                job_repo.db.rollback()
+                time.sleep(self.poll_interval)
+                continue
+
+            if job is None:
+                time.sleep(self.poll_interval)
+                continue
+            try:
+                self.process(job_repo, worker_id, job)
+            except Exception as e:
+                # Ошибка записи результата не должна останавливать поток: задачу вернет в очередь истекшая аренда
+                logger.error(f"Worker {worker_id} failed to finish job {job.id}: {e}")
+                job_repo.db.rollback()
+
+    def process(self, job_repo: JobRepository, worker_id: str, job: JobDTO) -> None:
+        logger.info(f"Worker {worker_id} started job {job.id} (attempt {job.attempts}/{job.max_attempts})")
+        state = {"stage": None}
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job, worker_id, state, stop), daemon=True)
+        heartbeat.start()
+
+        try:
+            with open(job.source_path, "rb") as f:
+                image_bytes = f.read()
+            result = self.main_service.process_upload(
+                image_bytes,
+                job.upload_folder,
+                job.filename,
+                # Лимиты на пользователя проверены при постановке в таблицу, здесь важен только приоритет
+                progress=lambda stage: state.__setitem__("stage", stage),
+                priority=job.priority
+            )
+            # Промежуточные шаги нужны UI на другом узле, поэтому сохраняются сразу
+            result["context"].persist_steps(job.upload_folder)
+        except Exception as e:
+            stop.set()
+            heartbeat.join()
+            # Отсутствие дефектов - детерминированный результат, повтор его не изменит
+            retry = not isinstance(e, ValueError)
+            job_repo.fail_job(job.id, worker_id, str(e), retry=retry)
+            logger.error(f"Worker {worker_id} failed job {job.id}: {e}")
+            return
+
+        stop.set()
+        heartbeat.join()
+        completed = job_repo.complete_job(
+            job.id,
+            worker_id,
+            fixed_path=os.path.join(job.upload_folder, "fixed", job.filename),
+            masked_path=artifact_path(job.upload_folder, "masked", job.filename),
+            segmented_path=os.path.join(job.upload_folder, "segmented", job.filename),
+            from_cache=result["from_cache"]
+        )
+        if completed:
+            # Списание здесь, а не в UI: задачу мог поставить пользователь, который уже закрыл вкладку
+            if job.charge_attempt and not result["from_cache"]:
+                self.main_service.charge_attempt(job.user_id)
+            if os.path.exists(job.source_path):
+                os.remove(job.source_path)
+            logger.info(f"Worker {worker_id} finished job {job.id}")
+        else:
+            logger.warning(f"Worker {worker_id} lost the lease of job {job.id}, result discarded")
+
+    def _heartbeat(self, job: JobDTO, worker_id: str, state: dict, stop: threading.Event) -> None:
+        job_repo = JobRepository(db.get_session())
+        last_stage, last_extend = None, time.monotonic()
+        try:
+            while not stop.wait(0.5):
+                stage = state["stage"]
+                if stage == last_stage and time.monotonic() - last_extend < self.lease_seconds / 3:
+                    continue
+                if not job_repo.extend_lease(job.id, worker_id, self.lease_seconds, stage):
+                    # Задачу перехватил другой воркер - complete_job тоже это увидит и не запишет результат
+                    return
+                last_stage, last_extend = stage, time.monotonic()
+        except Exception as e:
+            logger.error(f"Worker {worker_id} failed to extend the lease of job {job.id}: {e}")
+        finally:
+            job_repo.db.close()
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    worker = QueueWorker(f"{args.worker_id}-{uuid.uuid4().hex[:6]}", MainService(), args.lease, args.poll_interval)
+    logger.info(f"Queue worker {worker.worker_id} started with {args.threads} threads")
+    threads = [threading.Thread(target=worker.run, args=(index,), name=f"queue-worker-{index}")
+               for index in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
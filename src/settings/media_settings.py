@@ -0,0 +1,20 @@
+import os
+
+from pydantic import Field, SecretStr, StrictStr
+from pydantic_settings import BaseSettings
+
+
+class MediaSettings(BaseSettings):
+    media_root: StrictStr = Field("saved_images", validation_alias="MEDIA_ROOT")
+    media_host: StrictStr = Field("0.0.0.0", validation_alias="MEDIA_HOST")
+    media_port: int = Field(0, validation_alias="MEDIA_PORT")
+    media_public_url: StrictStr = Field("", validation_alias="MEDIA_PUBLIC_URL")
+    media_secret: SecretStr = Field("", validation_alias="MEDIA_SECRET")
+    media_url_ttl: int = Field(24 * 60 * 60, validation_alias="MEDIA_URL_TTL")
+
+    class Config:
+        env_file = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, '.envs', 'media.env')
+        env_file_encoding = 'utf-8'
+
+
+media_settings = MediaSettings()
@@ -0,0 +1,18 @@
+import os
+
+from pydantic import Field, StrictStr
+from pydantic_settings import BaseSettings
+
+
+class MetricsSettings(BaseSettings):
+    metrics_host: StrictStr = Field("127.0.0.1", validation_alias="METRICS_HOST")
+    metrics_port: int = Field(0, validation_alias="METRICS_PORT")
+    metrics_dump_path: StrictStr = Field("", validation_alias="METRICS_DUMP_PATH")
+    metrics_dump_interval: float = Field(60.0, validation_alias="METRICS_DUMP_INTERVAL")
+
+    class Config:
+        env_file = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, '.envs', 'metrics.env')
+        env_file_encoding = 'utf-8'
+
+
+metrics_settings = MetricsSettings()
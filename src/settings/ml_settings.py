@@ -7,6 +7,65 @@ from pydantic_settings import BaseSettings
 class MlSettings(BaseSettings):
     path_to_cnn: StrictStr = Field(..., validation_alias="PATH_TO_CNN")
     path_to_gan: StrictStr = Field(..., validation_alias="PATH_TO_GAN")
+    path_to_gan_quantized: StrictStr = Field("", validation_alias="PATH_TO_GAN_QUANTIZED")
+    gan_model_name: StrictStr = Field("gan", validation_alias="GAN_MODEL_NAME")
+    path_to_cnn_onnx: StrictStr = Field("", validation_alias="PATH_TO_CNN_ONNX")
+    path_to_gan_onnx: StrictStr = Field("", validation_alias="PATH_TO_GAN_ONNX")
+    batch_max_size: int = Field(8, validation_alias="BATCH_MAX_SIZE")
+    batch_max_wait_ms: float = Field(10.0, validation_alias="BATCH_MAX_WAIT_MS")
+    inpaint_mode: StrictStr = Field("full", validation_alias="INPAINT_MODE")
+    inpaint_roi_context: int = Field(32, validation_alias="INPAINT_ROI_CONTEXT")
+    inpaint_roi_merge_distance: int = Field(16, validation_alias="INPAINT_ROI_MERGE_DISTANCE")
+    inpaint_tile_size: int = Field(0, validation_alias="INPAINT_TILE_SIZE")
+    inpaint_tile_overlap: int = Field(32, validation_alias="INPAINT_TILE_OVERLAP")
+    inpaint_tile_workers: int = Field(2, validation_alias="INPAINT_TILE_WORKERS")
+    inpaint_classical_method: StrictStr = Field("telea", validation_alias="INPAINT_CLASSICAL_METHOD")
+    inpaint_classical_max_thickness: int = Field(6, validation_alias="INPAINT_CLASSICAL_MAX_THICKNESS")
+    inpaint_classical_max_area: int = Field(0, validation_alias="INPAINT_CLASSICAL_MAX_AREA")
+    inpaint_classical_radius: int = Field(3, validation_alias="INPAINT_CLASSICAL_RADIUS")
+    result_cache_dir: StrictStr = Field("saved_images/cache", validation_alias="RESULT_CACHE_DIR")
+    result_cache_max_mb: int = Field(1024, validation_alias="RESULT_CACHE_MAX_MB")
+    temp_max_age_hours: int = Field(24, validation_alias="TEMP_MAX_AGE_HOURS")
+    temp_gc_interval: int = Field(3600, validation_alias="TEMP_GC_INTERVAL")
+    job_workers: int = Field(4, validation_alias="JOB_WORKERS")
+    scheduler_max_queue_size: int = Field(32, validation_alias="SCHEDULER_MAX_QUEUE_SIZE")
+    scheduler_free_queue_share: float = Field(0.5, validation_alias="SCHEDULER_FREE_QUEUE_SHARE")
+    scheduler_max_inflight_per_user: int = Field(2, validation_alias="SCHEDULER_MAX_INFLIGHT_PER_USER")
+    job_backend: StrictStr = Field("local", validation_alias="JOB_BACKEND")
+    job_lease_seconds: int = Field(120, validation_alias="JOB_LEASE_SECONDS")
+    job_max_attempts: int = Field(3, validation_alias="JOB_MAX_ATTEMPTS")
+    job_poll_interval: float = Field(1.0, validation_alias="JOB_POLL_INTERVAL")
+    batch_workers: int = Field(8, validation_alias="BATCH_WORKERS")
+    batch_item_concurrency: int = Field(2, validation_alias="BATCH_ITEM_CONCURRENCY")
+    batch_max_items: int = Field(500, validation_alias="BATCH_MAX_ITEMS")
+    batch_max_item_mb: int = Field(50, validation_alias="BATCH_MAX_ITEM_MB")
+    model_memory_budget_mb: int = Field(0, validation_alias="MODEL_MEMORY_BUDGET_MB")
+    model_mmap: bool = Field(True, validation_alias="MODEL_MMAP")
+    model_preload: bool = Field(True, validation_alias="MODEL_PRELOAD")
+    model_warmup_resolutions: StrictStr = Field("512,1024", validation_alias="MODEL_WARMUP_RESOLUTIONS")
+    model_warmup_passes: int = Field(2, validation_alias="MODEL_WARMUP_PASSES")
+    model_compile: StrictStr = Field("none", validation_alias="MODEL_COMPILE")
+    model_compile_cache_dir: StrictStr = Field("saved_images/compiled", validation_alias="MODEL_COMPILE_CACHE_DIR")
+
+    inference_server_address: StrictStr = Field("", validation_alias="INFERENCE_SERVER_ADDRESS")
+    inference_server_authkey: StrictStr = Field("", validation_alias="INFERENCE_SERVER_AUTHKEY")
+    inference_server_workers: int = Field(2, validation_alias="INFERENCE_SERVER_WORKERS")
+    inference_server_timeout: float = Field(300.0, validation_alias="INFERENCE_SERVER_TIMEOUT")
+
+    @property
+    def inpaint_options(self) -> dict:
+        return {
+            "mode": self.inpaint_mode,
+            "roi_context": self.inpaint_roi_context,
+            "roi_merge_distance": self.inpaint_roi_merge_distance,
+            "tile_size": self.inpaint_tile_size,
+            "tile_overlap": self.inpaint_tile_overlap,
+            "tile_workers": self.inpaint_tile_workers,
+            "classical_method": self.inpaint_classical_method,
+            "classical_max_thickness": self.inpaint_classical_max_thickness,
+            "classical_max_area": self.inpaint_classical_max_area,
+            "classical_radius": self.inpaint_classical_radius
+        }
 
     class Config:
         env_file = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, '.envs', 'ml.env')
@@ -0,0 +1,43 @@
+import hashlib
+import os
+import shutil
+import threading
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class BlobStore:
+    """Файлы по хэшу содержимого в каталогах ab/cd/: одинаковые артефакты хранятся один раз."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    @staticmethod
+    def hash_file(path: str) -> tuple:
+        digest = hashlib.sha256()
+        size = 0
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                size += len(chunk)
+        return digest.hexdigest(), size
+
+    def path(self, digest: str, extension: str) -> str:
+        # Два уровня по 256 каталогов: даже миллионы файлов не собираются в одной директории
+        return os.path.join(self.root, digest[:2], digest[2:4], f"{digest}{extension}")
+
+    def write(self, source_path: str, digest: str, extension: str) -> str:
+        path = self.path(digest, extension)
+        if os.path.exists(path):
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp{os.getpid()}_{threading.get_ident()}"
+        try:
+            # Жесткая ссылка на файл из временной папки: данные не копируются, если тома совпадают
+            os.link(source_path, tmp_path)
+        except OSError:
+            # Другой том или файловая система без жестких ссылок
+            shutil.copyfile(source_path, tmp_path)
+        # Файл появляется под итоговым именем атомарно - читатель не увидит его наполовину записанным
+        os.replace(tmp_path, path)
+        return path
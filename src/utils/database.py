@@ -1,8 +1,12 @@
+from contextlib import contextmanager
+
 from sqlalchemy import create_engine
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker, Session
 from src.models.user import Base as UserBase
 from src.models.image import Base as ImageBase
+from src.models.job import Base as JobBase
+from src.models.blob import Base as BlobBase
 from src.settings.database_settings import DatabaseSettings
 from src.utils.logger import logger
 
@@ -22,6 +26,19 @@ class Database:
     def get_session(self) -> Session:
         return self.SessionLocal()
 
+    @contextmanager
+    def session_scope(self):
+        # Отдельная сессия на одну операцию: общая сессия модуля не потокобезопасна,
+        # а ее rollback отменил бы и незафиксированную работу других потоков
+        session = self.get_session()
+        try:
+            yield session
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
     def check_connection(self):
         try:
             with self.engine.connect() as connection:
@@ -33,6 +50,8 @@ class Database:
     def init_db(self):
         UserBase.metadata.create_all(bind=self.engine)
         ImageBase.metadata.create_all(bind=self.engine)
+        JobBase.metadata.create_all(bind=self.engine)
+        BlobBase.metadata.create_all(bind=self.engine)
         logger.warning(f"Tables successfully updated")
 
 
@@ -0,0 +1,39 @@
+import struct
+import zlib
+
+import cv2
+import numpy as np
+
+MASK_EXTENSION = ".msk"
+MAGIC = b"MSK1"
+# Заголовок: сигнатура, высота и ширина маски; дальше - zlib-сжатые биты np.packbits
+HEADER = struct.Struct("<4sII")
+COMPRESSION_LEVEL = 6
+
+
+def encode_packed(packed: np.ndarray, shape: tuple) -> bytes:
+    # Маска в контексте уже хранится по биту на пиксель - повторно ее не упаковываем
+    return HEADER.pack(MAGIC, shape[0], shape[1]) + zlib.compress(packed.tobytes(), COMPRESSION_LEVEL)
+
+
+def encode_mask(mask: np.ndarray) -> bytes:
+    return encode_packed(np.packbits(mask.astype(bool)), mask.shape[:2])
+
+
+def decode_packed(data: bytes) -> tuple:
+    magic, height, width = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Файл не является маской .msk")
+    packed = np.frombuffer(zlib.decompress(data[HEADER.size:]), dtype=np.uint8)
+    return packed, (height, width)
+
+
+def decode_mask(data: bytes) -> np.ndarray:
+    packed, shape = decode_packed(data)
+    return np.unpackbits(packed, count=shape[0] * shape[1]).reshape(shape).astype(bool)
+
+
+def render_png(mask: np.ndarray) -> bytes:
+    # PNG строится только для показа или скачивания, на диске маска в .msk
+    _, buffer = cv2.imencode(".png", mask.astype(np.uint8) * 255)
+    return buffer.tobytes()
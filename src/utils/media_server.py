@@ -0,0 +1,204 @@
+import argparse
+import hashlib
+import hmac
+import mimetypes
+import os
+import posixpath
+import secrets
+import shutil
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+from src.settings.media_settings import media_settings
+from src.utils.logger import logger
+from src.utils.mask_codec import MASK_EXTENSION, decode_mask, render_png
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--host', type=str, default=media_settings.media_host)
+parser.add_argument('--port', type=int, default=media_settings.media_port or 8601)
+
+PROJECT_ROOT = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
+# Оформление интерфейса общее для всех пользователей и отдается без подписи
+PUBLIC_PREFIXES = ("front/",)
+PUBLIC_MAX_AGE = 24 * 60 * 60
+CHUNK_SIZE = 256 * 1024
+ALL_INTERFACES = ("", "0.0.0.0", "::")
+
+
+class MediaServer:
+    """Раздает файлы saved_images по подписанным ссылкам с ETag и заголовками долгого кэширования."""
+
+    def __init__(self, root: str, secret: bytes, url_ttl: int, public_url: str = ""):
+        self.root = os.path.realpath(root)
+        self.secret = secret
+        self.url_ttl = url_ttl
+        self.public_url = public_url.rstrip("/")
+        self._server = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        # Внешний сервер (отдельный процесс или прокси) задается адресом, встроенный - запуском в этом процессе
+        return bool(self.public_url) or self._server is not None
+
+    def _relative(self, path: str) -> Optional[str]:
+        real_path = os.path.realpath(path)
+        if os.path.commonpath([real_path, self.root]) != self.root:
+            return None
+        return os.path.relpath(real_path, self.root).replace(os.sep, "/")
+
+    def resolve(self, relative_path: str) -> Optional[str]:
+        # realpath отсекает и "..", и симлинки за пределы каталога
+        path = os.path.realpath(os.path.join(self.root, relative_path))
+        if os.path.commonpath([path, self.root]) != self.root or not os.path.isfile(path):
+            return None
+        return path
+
+    def _signature(self, relative_path: str, user_id: int, expires: int) -> str:
+        message = f"{relative_path}:{user_id}:{expires}".encode()
+        return hmac.new(self.secret, message, hashlib.sha256).hexdigest()[:32]
+
+    def url_for(self, path: str, user_id: int = None) -> Optional[str]:
+        relative_path = self._relative(path)
+        if relative_path is None:
+            return None
+        url = f"{self.public_url}/{quote(relative_path)}"
+        if relative_path.startswith(PUBLIC_PREFIXES):
+            return url
+
+        # Срок действия округляется до окна TTL: ссылка не меняется между перезапусками скрипта Streamlit,
+        # и браузер берет изображение из своего кэша
+        expires = (int(time.time()) // self.url_ttl + 2) * self.url_ttl
+        return f"{url}?u={user_id}&e={expires}&s={self._signature(relative_path, user_id, expires)}"
+
+    def check_access(self, relative_path: str, query: dict) -> Optional[int]:
+        # Возвращает max-age ответа или None, если ссылка подделана либо устарела
+        if relative_path.startswith(PUBLIC_PREFIXES):
+            return PUBLIC_MAX_AGE
+        try:
+            user_id, expires, signature = int(query["u"][0]), int(query["e"][0]), query["s"][0]
+        except (KeyError, ValueError):
+            return None
+        remaining = expires - int(time.time())
+        if remaining <= 0 or not hmac.compare_digest(signature, self._signature(relative_path, user_id, expires)):
+            return None
+        return remaining
+
+    def start(self, host: str, port: int) -> None:
+        with self._lock:
+            if self._server is not None:
+                return
+            if not self.public_url and host in ALL_INTERFACES:
+                # localhost в ссылке открылся бы только на машине сервера, а не в браузерах пользователей
+                raise ValueError("Медиасервер слушает все интерфейсы: задайте MEDIA_PUBLIC_URL, "
+                                 "по которому браузеры пользователей его видят")
+            self._server = ThreadingHTTPServer((host, port), self._handler_class())
+            if not self.public_url:
+                self.public_url = f"http://{host}:{port}"
+            thread = threading.Thread(target=self._server.serve_forever, name="media-http", daemon=True)
+            thread.start()
+        logger.info(f"Media server is listening on {host}:{port}")
+
+    def _handler_class(self):
+        media = self
+
+        class MediaHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self._serve(send_body=True)
+
+            def do_HEAD(self):
+                self._serve(send_body=False)
+
+            def _serve(self, send_body: bool):
+                url = urlsplit(self.path)
+                # Путь нормализуется до проверки доступа: "front/../storage/..." не должен сойти за публичный
+                relative_path = posixpath.normpath(unquote(url.path).lstrip("/"))
+                if relative_path == ".." or relative_path.startswith("../"):
+                    self.send_error(404)
+                    return
+                max_age = media.check_access(relative_path, parse_qs(url.query))
+                if max_age is None:
+                    self.send_error(403)
+                    return
+                path = media.resolve(relative_path)
+                if path is None:
+                    self.send_error(404)
+                    return
+
+                stat = os.stat(path)
+                etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+                if relative_path.startswith(PUBLIC_PREFIXES):
+                    cache_control = f"public, max-age={max_age}"
+                else:
+                    # Имена сохраненных файлов уникальны и не переиспользуются - содержимое по ссылке не меняется
+                    cache_control = f"private, max-age={max_age}, immutable"
+
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Cache-Control", cache_control)
+                    self.end_headers()
+                    return
+
+                body = None
+                content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+                content_length = stat.st_size
+                if path.endswith(MASK_EXTENSION):
+                    # Браузер не знает формат .msk - маска отдается PNG, построенным при запросе
+                    with open(path, "rb") as f:
+                        body = render_png(decode_mask(f.read()))
+                    content_type, content_length = "image/png", len(body)
+
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(content_length))
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", formatdate(stat.st_mtime, usegmt=True))
+                self.send_header("Cache-Control", cache_control)
+                self.send_header("X-Content-Type-Options", "nosniff")
+                self.end_headers()
+                if not send_body:
+                    return
+                if body is not None:
+                    self.wfile.write(body)
+                else:
+                    with open(path, "rb") as f:
+                        shutil.copyfileobj(f, self.wfile, CHUNK_SIZE)
+
+            def log_message(self, format, *args):
+                pass
+
+        return MediaHandler
+
+
+def _secret() -> bytes:
+    secret = media_settings.media_secret.get_secret_value()
+    if secret:
+        return secret.encode()
+    if media_settings.media_public_url or __name__ == '__main__':
+        # Ссылки подписывает приложение, а проверяет отдельный сервер: со случайными ключами каждая ссылка получит 403
+        raise ValueError("Не задан MEDIA_SECRET: без общего ключа внешний медиасервер отклонит все ссылки")
+    if media_settings.media_port:
+        # Встроенный сервер проверяет подписи своим ключом, но ссылки перестанут действовать после перезапуска
+        logger.warning("MEDIA_SECRET is not set, media URLs are signed with a per-process key")
+    return secrets.token_bytes(32)
+
+
+media_server = MediaServer(
+    root=os.path.join(PROJECT_ROOT, media_settings.media_root),
+    secret=_secret(),
+    url_ttl=media_settings.media_url_ttl,
+    public_url=media_settings.media_public_url
+)
+if media_settings.media_port:
+    media_server.start(media_settings.media_host, media_settings.media_port)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    media_server.start(args.host, args.port)
+    threading.Event().wait()
@@ -0,0 +1,162 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from src.utils.logger import logger
+
+QUANTILES = (50, 95, 99)
+
+
+class Histogram:
+    """Хранит последние max_samples наблюдений: перцентили считаются по скользящему окну."""
+
+    def __init__(self, max_samples: int = 2048):
+        self.samples = deque(maxlen=max_samples)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def summary(self) -> dict:
+        summary = {"count": self.count, "sum": self.total}
+        if self.samples:
+            values = np.percentile(np.fromiter(self.samples, dtype=np.float64), QUANTILES)
+            summary.update({f"p{q}": float(v) for q, v in zip(QUANTILES, values)})
+        return summary
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._exporters = {}
+        self._readiness_check = None
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            self._histograms.setdefault(name, Histogram()).observe(value)
+
+    def increment(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    @contextmanager
+    def timer(self, name: str):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - start_time)
+
+    def set_readiness_check(self, check) -> None:
+        self._readiness_check = check
+
+    def is_ready(self) -> bool:
+        return self._readiness_check is None or self._readiness_check()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "timestamp": time.time(),
+                "histograms": {name: histogram.summary() for name, histogram in self._histograms.items()},
+                "counters": dict(self._counters)
+            }
+
+    def to_prometheus(self) -> str:
+        snapshot = self.snapshot()
+        lines = []
+        for name, summary in snapshot["histograms"].items():
+            lines.append(f"# TYPE flawless_{name} summary")
+            for q in QUANTILES:
+                if f"p{q}" in summary:
+                    lines.append(f'flawless_{name}{{quantile="{q / 100}"}} {summary[f"p{q}"]}')
+            lines.append(f"flawless_{name}_sum {summary['sum']}")
+            lines.append(f"flawless_{name}_count {summary['count']}")
+        for name, value in snapshot["counters"].items():
+            lines.append(f"# TYPE flawless_{name} counter")
+            lines.append(f"flawless_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def dump_json(self, path: str) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, indent=4)
+        os.replace(tmp_path, path)
+
+    def start_json_dump(self, path: str, interval: float) -> None:
+        with self._lock:
+            if "json" in self._exporters:
+                return
+
+            def dump_loop():
+                while True:
+                    time.sleep(interval)
+                    try:
+                        self.dump_json(path)
+                    except (OSError, TypeError, ValueError) as e:
+                        # Ошибка одной выгрузки (диск заполнен, нет прав) не должна останавливать экспорт
+                        logger.error(f"Metrics dump to {path} failed: {e}")
+
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            thread = threading.Thread(target=dump_loop, name="metrics-json-dump", daemon=True)
+            thread.start()
+            self._exporters["json"] = thread
+
+    def start_http_server(self, host: str, port: int) -> None:
+        with self._lock:
+            if "http" in self._exporters:
+                return
+
+            registry = self
+
+            class MetricsHandler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path == "/metrics":
+                        body, content_type = registry.to_prometheus(), "text/plain; version=0.0.4"
+                    elif self.path == "/metrics.json":
+                        body, content_type = json.dumps(registry.snapshot()), "application/json"
+                    elif self.path == "/ready":
+                        if not registry.is_ready():
+                            self.send_error(503, "Models are warming up")
+                            return
+                        body, content_type = "ready", "text/plain"
+                    else:
+                        self.send_error(404)
+                        return
+                    payload = body.encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", content_type)
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+
+                def log_message(self, format, *args):
+                    pass
+
+            try:
+                server = ThreadingHTTPServer((host, port), MetricsHandler)
+            except OSError as e:
+                # Занятый порт не должен останавливать приложение - оно продолжит работу без эндпоинта метрик
+                logger.error(f"Metrics endpoint on {host}:{port} is not started: {e}")
+                return
+            thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+            thread.start()
+            self._exporters["http"] = server
+
+
+metrics = MetricsRegistry()
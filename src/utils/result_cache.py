@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+from src.utils.logger import logger
+from src.utils.mask_codec import decode_mask, encode_mask
+
+# Визуализация сегментации не кэшируется: она строится из изображения и маски
+ARTIFACTS = ("masked", "fixed")
+# Маска хранится битами в .msk, изображения - в PNG
+ARTIFACT_FILES = {"masked": "masked.msk", "fixed": "fixed.png"}
+
+
+class ResultCache:
+    """Дисковый кэш результатов обработки с ключом по хэшу пикселей, версиям моделей и параметрам, с LRU-вытеснением."""
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._size = sum(size for _, _, size in self._entries())
+
+    def make_key(self, image_np: np.ndarray, model_versions: list, options: dict = None) -> str:
+        digest = hashlib.sha256()
+        digest.update(str(image_np.shape).encode())
+        digest.update(np.ascontiguousarray(image_np).data)
+        for version in model_versions:
+            digest.update(version.encode())
+        # Режим и параметры инпейнтинга меняют результат так же, как версия модели
+        digest.update(json.dumps(options or {}, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _entries(self):
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.is_dir() and '.tmp' not in entry.name:
+                    files = [f for f in os.scandir(entry.path) if f.is_file()]
+                    yield entry.path, entry.stat().st_mtime, sum(f.stat().st_size for f in files)
+
+    def get(self, key: str) -> Optional[tuple]:
+        entry_dir = self._entry_dir(key)
+        if not all(os.path.exists(os.path.join(entry_dir, ARTIFACT_FILES[name])) for name in ARTIFACTS):
+            return None
+
+        try:
+            images = []
+            for name in ARTIFACTS:
+                path = os.path.join(entry_dir, ARTIFACT_FILES[name])
+                if name == "masked":
+                    with open(path, "rb") as f:
+                        images.append(decode_mask(f.read()))
+                else:
+                    with Image.open(path) as img:
+                        images.append(np.array(img))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Result cache entry {key} is corrupted: {e}")
+            return None
+
+        # mtime каталога служит меткой последнего обращения для LRU
+        os.utime(entry_dir)
+        return tuple(images)
+
+    def put(self, key: str, mask: np.ndarray, fixed_image: np.ndarray) -> None:
+        entry_dir = self._entry_dir(key)
+        # Каталог кэша может быть общим для нескольких процессов, поэтому имя уникально не только в пределах потока
+        tmp_dir = f"{entry_dir}.tmp{os.getpid()}_{uuid.uuid4().hex}"
+        os.makedirs(tmp_dir)
+
+        size = 0
+        try:
+            for name, image in zip(ARTIFACTS, (mask, fixed_image)):
+                path = os.path.join(tmp_dir, ARTIFACT_FILES[name])
+                if name == "masked":
+                    with open(path, "wb") as f:
+                        f.write(encode_mask(image))
+                else:
+                    Image.fromarray(image).save(path)
+                size += os.path.getsize(path)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        with self._lock:
+            if os.path.exists(entry_dir):
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                return
+            os.replace(tmp_dir, entry_dir)
+            self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        for path, _, size in entries:
+            if self._size <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            self._size -= size
+        logger.debug(f"Result cache evicted down to {self._size} bytes")
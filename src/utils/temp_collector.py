@@ -0,0 +1,72 @@
+import os
+import threading
+import time
+
+from src.settings.ml_settings import ml_settings
+from src.utils.logger import logger
+from src.utils.metrics import metrics
+
+
+class TempCollector:
+    """Фоновая очистка временной папки от результатов, которые пользователь так и не сохранил."""
+
+    def __init__(self, max_age: float, interval: float):
+        self.max_age = max_age
+        self.interval = interval
+        self.folders = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, folder: str) -> None:
+        with self._lock:
+            self.folders.add(os.path.abspath(folder))
+            if self._thread is not None or not self.interval:
+                return
+            self._thread = threading.Thread(target=self._loop, name="temp-collector", daemon=True)
+            self._thread.start()
+
+    def _loop(self) -> None:
+        while True:
+            for folder in list(self.folders):
+                try:
+                    self.sweep(folder)
+                except OSError as e:
+                    logger.error(f"Temp folder {folder} sweep failed: {e}")
+            time.sleep(self.interval)
+
+    def sweep(self, folder: str) -> tuple:
+        # Один проход снизу вверх: сначала файлы старше max_age, затем опустевшие каталоги пакетов и этапов
+        deadline = time.time() - self.max_age
+        removed_files, removed_bytes = 0, 0
+        for root, _, _ in os.walk(folder, topdown=False):
+            for entry in os.scandir(root):
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                if stat.st_mtime >= deadline:
+                    continue
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    # Файл уже удалил reset_app или discard пакета
+                    continue
+                removed_files += 1
+                # Файл, сохраненный в хранилище жесткой ссылкой, места не освобождает
+                if stat.st_nlink == 1:
+                    removed_bytes += stat.st_size
+            # Каталог, в который давно ничего не писали: его не удалить из-под только что начатой записи
+            if root != folder and os.stat(root).st_mtime < deadline:
+                try:
+                    os.rmdir(root)
+                except OSError:
+                    pass
+
+        metrics.increment("temp_gc_files_total", removed_files)
+        metrics.increment("temp_gc_bytes_total", removed_bytes)
+        if removed_files:
+            logger.info(f"Temp collector removed {removed_files} files ({removed_bytes / (1024 * 1024):.1f} MB) from {folder}")
+        return removed_files, removed_bytes
+
+
+temp_collector = TempCollector(max_age=ml_settings.temp_max_age_hours * 60 * 60,
+                               interval=ml_settings.temp_gc_interval)
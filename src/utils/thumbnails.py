@@ -0,0 +1,36 @@
+import os
+from typing import Union
+
+from PIL import Image
+
+THUMBNAILS_FOLDER = "thumbnails"
+# Размеры по длинной стороне: small - общая лента истории, medium - раздел понравившихся, где фото немного
+THUMBNAIL_SIZES = {"medium": 640, "small": 320}
+THUMBNAIL_QUALITY = 85
+
+
+def thumbnail_path(upload_folder: str, size_name: str, filename: str) -> str:
+    return os.path.join(upload_folder, THUMBNAILS_FOLDER, size_name, os.path.splitext(filename)[0] + ".jpg")
+
+
+def create_thumbnails(source: Union[str, Image.Image], upload_folder: str, filename: str) -> dict:
+    if isinstance(source, str):
+        with Image.open(source) as image:
+            # JPEG декодируется сразу в уменьшенном масштабе, полное разрешение в память не попадает
+            image.draft("RGB", (max(THUMBNAIL_SIZES.values()),) * 2)
+            image = image.convert("RGB")
+    else:
+        # convert возвращает копию: уменьшение на месте не затрагивает переданное изображение
+        image = source.convert("RGB")
+
+    paths = {}
+    # Пирамида: каждый следующий уровень уменьшается из предыдущего, а не из оригинала
+    for size_name, size in sorted(THUMBNAIL_SIZES.items(), key=lambda item: -item[1]):
+        image.thumbnail((size, size), Image.LANCZOS)
+        path = thumbnail_path(upload_folder, size_name, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        image.save(tmp_path, format="JPEG", quality=THUMBNAIL_QUALITY, optimize=True, progressive=True)
+        os.replace(tmp_path, path)
+        paths[size_name] = path
+    return paths
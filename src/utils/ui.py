@@ -1,4 +1,15 @@
 import base64
+import mimetypes
+from functools import lru_cache
+
+from src.utils.media_server import media_server
+
+
+@lru_cache(maxsize=1024)
+def image_data_uri(image_path: str) -> str:
+    with open(image_path, "rb") as img_file:
+        encoded = base64.b64encode(img_file.read()).decode()
+    return f"data:{mimetypes.guess_type(image_path)[0] or 'image/png'};base64,{encoded}"
 
 
 class UserInterfaceUtils:
@@ -6,6 +17,14 @@ class UserInterfaceUtils:
         with open(image_path, "rb") as img_file:
             return base64.b64encode(img_file.read()).decode()
 
+    def get_image_src(self, image_path, user_id: int = None) -> str:
+        # По ссылке браузер кэширует изображение, data URI уходит в каждом ответе Streamlit заново
+        if media_server.enabled:
+            url = media_server.url_for(image_path, user_id)
+            if url is not None:
+                return url
+        return image_data_uri(image_path)
+
     def init_paths(self):
         return {
             "temp_folder": r"saved_images\buff",